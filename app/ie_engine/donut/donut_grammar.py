@@ -0,0 +1,303 @@
+from dataclasses import dataclass, field
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Tuple
+
+from huggingface_hub import hf_hub_download
+from huggingface_hub.utils import EntryNotFoundError, LocalEntryNotFoundError
+import torch
+from transformers import LogitsProcessor, PreTrainedTokenizerBase
+
+
+SEP_TOKEN: str = "<sep/>"
+
+#soubor se schématem ve složce modelu (vedle vah a procesoru)
+GRAMMAR_FILE: str = "donut_grammar.json"
+
+
+@dataclass
+class grammar_node:
+    """
+    Jeden klíč schématu Donut cílů (kořen nemá jméno).
+
+    :param children: Podklíče v pořadí, v jakém je zapisuje `json2token` (seřazené sestupně)
+    :param leaf: Hodnota klíče může být text
+    :param is_list: Hodnota klíče může být seznam položek oddělených `<sep/>`
+    """
+
+    name: str = ""
+    children: Dict[str, "grammar_node"] = field(default_factory=dict)
+    leaf: bool = False
+    is_list: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"leaf": self.leaf, "is_list": self.is_list, "children": {k: v.to_dict() for k, v in self.children.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], name: str = "") -> "grammar_node":
+        return cls(name=name, leaf=data["leaf"], is_list=data["is_list"],
+                   children={k: cls.from_dict(v, k) for k, v in data["children"].items()})
+
+
+class donut_grammar:
+    """
+    Schéma `<s_klíč>…</s_klíč>` sekvencí, které vyrábí `json2token` z donut_invoice_dataset.
+
+    Strom klíčů se sestaví z gt_parse záznamů datasetu stejnými pravidly jako json2token
+    (slovník s jedním klíčem se zapisuje jen hodnotou, seznam se spojuje `<sep/>`, klíče jsou seřazené sestupně).
+    """
+
+    def __init__(self, root: grammar_node):
+        self.root = root
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @classmethod
+    def from_records(cls, gt_parses: Iterable[Dict[str, Any]]) -> "donut_grammar":
+        root = grammar_node()
+        for gt_parse in gt_parses:
+            cls._collect(gt_parse, root)
+        cls._sort(root)
+        return cls(root)
+
+    @classmethod
+    def _collect(cls, obj: Any, node: grammar_node) -> None:
+        if isinstance(obj, dict) and len(obj) != 1:
+            for k, v in obj.items():
+                cls._collect(v, node.children.setdefault(k, grammar_node(name=k)))
+        elif isinstance(obj, list):
+            node.is_list = node.is_list or len(obj) > 1
+            for item in obj:
+                cls._collect(item, node)
+            if not obj:
+                node.leaf = True
+        else:
+            node.leaf = True
+
+    @classmethod
+    def _sort(cls, node: grammar_node) -> None:
+        node.children = dict(sorted(node.children.items(), reverse=True))
+        for child in node.children.values():
+            cls._sort(child)
+
+    def tags(self) -> List[str]:
+        output: List[str] = list()
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for k, child in node.children.items():
+                output.extend([f"<s_{k}>", f"</s_{k}>"])
+                stack.append(child)
+        return output
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.root.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "donut_grammar":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(grammar_node.from_dict(json.load(f)))
+
+    def save_pretrained(self, model_dir: str) -> None:
+        os.makedirs(model_dir, exist_ok=True)
+        self.save(os.path.join(model_dir, GRAMMAR_FILE))
+
+    @classmethod
+    def from_pretrained(cls, model_name: str) -> "donut_grammar | None":
+        """
+        Schéma uložené s modelem (lokální složka nebo repozitář na HuggingFace), nebo None, pokud u modelu není.
+        Ostatní chyby (síť, přístup, poškozený soubor) se propagují...jinak by se bez varování generovalo bez omezení.
+        """
+        if os.path.isdir(model_name):
+            path = os.path.join(model_name, GRAMMAR_FILE)
+            return cls.load(path) if os.path.exists(path) else None
+
+        try:
+            path = hf_hub_download(model_name, GRAMMAR_FILE)
+        except (EntryNotFoundError, LocalEntryNotFoundError):
+            return None
+        return cls.load(path)
+
+
+#rámec zásobníku: (uzel, index posledního uzavřeného potomka)
+_frame = Tuple[grammar_node, int]
+
+
+@dataclass
+class _row_state:
+    """
+    Stav jedné generované sekvence pro `donut_grammar_logits_processor`.
+
+    :param stack: Zásobník otevřených klíčů
+    :param has_text: Za posledním tagem už je text
+    :param length: Délka sekvence (i s promptem), do které je stav spočítaný
+    """
+
+    stack: List[_frame]
+    has_text: bool
+    length: int
+
+
+class donut_grammar_logits_processor(LogitsProcessor):
+    """
+    Omezí generování Donutu na sekvence odpovídající `donut_grammar`.
+
+    - v kořeni a v objektech jsou povolené jen otevírací tagy dalších klíčů (v pořadí json2token), `<sep/>` u seznamů a uzavírací tag
+    - text je povolený jen uvnitř listových klíčů
+    - `</s>` je povolený jen v kořeni, tedy po uzavření všech tagů
+    - nový tag ani text se nepovolí, pokud by pak do `max_length` nezbylo místo na uzavření všech tagů a `</s>`
+
+    Stav (zásobník otevřených klíčů) si procesor drží pro každou sekvenci a každý krok do něj započítá jen nový token.
+    Sekvence se poznávají podle `rows` (index sekvence v dávce), takže generátor smí hotové sekvence z dávky vyřazovat.
+
+    :param prompt_length: Počet tokenů promptu na začátku každé sekvence
+    :param max_length: Maximální délka sekvence včetně promptu (None = bez vynucování uzavření)
+    """
+
+    def __init__(self, grammar: donut_grammar, tokenizer: PreTrainedTokenizerBase, prompt_length: int = 1, max_length: int | None = None):
+        self.grammar = grammar
+        self.prompt_length = prompt_length
+        self.max_length = max_length
+        self.eos_token_id: int = tokenizer.eos_token_id
+
+        unk = tokenizer.unk_token_id
+
+        #jméno klíče <-> id otevíracího a uzavíracího tagu
+        self.open_ids: Dict[str, int] = dict()
+        self.close_ids: Dict[str, int] = dict()
+        for tag in grammar.tags():
+            token_id = tokenizer.convert_tokens_to_ids(tag)
+            if token_id is None or token_id == unk:
+                raise ValueError(f"Tag {tag} není v tokenizeru jako samostatný token.")
+            if tag.startswith("</"):
+                self.close_ids[tag[len("</s_"):-1]] = token_id
+            else:
+                self.open_ids[tag[len("<s_"):-1]] = token_id
+        self.open_names: Dict[int, str] = {v: k for k, v in self.open_ids.items()}
+        self.close_names: Dict[int, str] = {v: k for k, v in self.close_ids.items()}
+
+        sep_id = tokenizer.convert_tokens_to_ids(SEP_TOKEN)
+        self.sep_id: int | None = sep_id if sep_id is not None and sep_id != unk else None
+
+        self.tag_ids: List[int] = list(self.open_names) + list(self.close_names) + ([self.sep_id] if self.sep_id is not None else [])
+
+        #vše, co není text: speciální tokeny a přidané tagy ve tvaru <...>
+        self._not_text: List[int] = sorted(set(tokenizer.all_special_ids) | set(self.tag_ids)
+                                          | {i for t, i in tokenizer.get_added_vocab().items() if re.fullmatch(r"<.*>", t)})
+        self._text_mask: torch.Tensor | None = None
+
+        #stav rozpracovaných sekvencí (index sekvence v dávce -> stav)
+        self._rows: Dict[int, _row_state] = dict()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, rows: torch.Tensor | None = None) -> torch.FloatTensor:
+        """
+        :param rows: Index sekvence v dávce pro každý řádek (None = řádky se z dávky nevyřazují)
+        """
+        vocab = scores.size(-1)
+        if self._text_mask is None or self._text_mask.size(0) != vocab or self._text_mask.device != scores.device:
+            self._build_masks(vocab, scores.device)
+
+        length = input_ids.size(1)
+        if length <= self.prompt_length:
+            #první krok nového generování
+            self._rows.clear()
+
+        #jediná synchronizace se zařízením za krok...indexy sekvencí a poslední tokeny všech řádků
+        row_ids = rows if rows is not None else torch.arange(input_ids.size(0), device=input_ids.device)
+        row_ids, last_tokens = torch.stack([row_ids.to(input_ids.device), input_ids[:, -1]]).tolist()
+
+        #kolik tokenů ještě smí přijít...každý krok musí nechat místo na uzavření všech tagů a </s>
+        budget = self.max_length - length if self.max_length is not None else vocab + length
+
+        text_rows: List[int] = list()
+        allowed_rows: List[int] = list()
+        allowed_tokens: List[int] = list()
+
+        for row, (index, last_token) in enumerate(zip(row_ids, last_tokens)):
+            state = self._advance(index, last_token, input_ids[row], length)
+            node, last = state.stack[-1]
+            depth = len(state.stack)
+
+            tokens: List[int] = list()
+            if depth == 1:
+                tokens.append(self.eos_token_id)
+            else:
+                tokens.append(self.close_ids[node.name])
+
+                if node.leaf and last < 0 and budget >= depth + 1:
+                    text_rows.append(row)
+
+            if not state.has_text and budget >= depth + 2:
+                tokens.extend(self._child_ids(node)[last + 1:])
+
+            if node.is_list and self.sep_id is not None and (last >= 0 or state.has_text) and budget >= depth + 1:
+                tokens.append(self.sep_id)
+
+            allowed_rows.extend([row] * len(tokens))
+            allowed_tokens.extend(tokens)
+
+        allowed = torch.zeros_like(scores, dtype=torch.bool)
+        if text_rows:
+            allowed[text_rows] = self._text_mask
+        allowed[allowed_rows, allowed_tokens] = True
+
+        return scores.masked_fill(~allowed, -float("inf"))
+
+    def _advance(self, index: int, last_token: int, sequence: torch.Tensor, length: int) -> _row_state:
+        """
+        Stav sekvence po posledním tokenu...běžně se započítá jen ten, jinak (nová sekvence) se spočítá z celé sekvence.
+        """
+        state = self._rows.get(index)
+
+        if state is not None and state.length == length - 1:
+            self._push(state, last_token)
+            state.length = length
+            return state
+
+        state = _row_state(stack=[(self.grammar.root, -1)], has_text=False, length=length)
+        for token_id in sequence[self.prompt_length:length].tolist():
+            self._push(state, token_id)
+        self._rows[index] = state
+        return state
+
+    def _push(self, state: _row_state, token_id: int) -> None:
+        stack = state.stack
+        node, last = stack[-1]
+
+        if token_id in self.open_names:
+            state.has_text = False
+            name = self.open_names[token_id]
+            if name not in node.children:
+                return #tag mimo schéma (jen bez omezení, např. při vynuceném promptu)
+            stack[-1] = (node, list(node.children).index(name))
+            stack.append((node.children[name], -1))
+        elif token_id in self.close_names:
+            state.has_text = False
+            if len(stack) > 1 and self.close_names[token_id] == node.name:
+                stack.pop()
+        elif token_id == self.sep_id:
+            state.has_text = False
+            stack[-1] = (node, -1)
+        else:
+            #text za posledním tagem patří do nejvnitřnějšího otevřeného klíče
+            state.has_text = True
+
+    def _child_ids(self, node: grammar_node) -> List[int]:
+        return [self.open_ids[name] for name in node.children]
+
+    def _build_masks(self, vocab: int, device: torch.device) -> None:
+        self._text_mask = torch.ones(vocab, dtype=torch.bool, device=device)
+        self._text_mask[[i for i in self._not_text if i < vocab]] = False
+
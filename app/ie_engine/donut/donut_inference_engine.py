@@ -0,0 +1,168 @@
+import re
+from threading import Lock
+import time
+from typing import Any, Dict, List, Sequence
+
+from PIL import Image
+import torch
+from transformers import DonutProcessor, LogitsProcessorList, VisionEncoderDecoderModel
+
+from app.ie_engine.donut.donut_grammar import donut_grammar, donut_grammar_logits_processor
+from app.ie_engine.utility.micro_batcher import micro_batcher
+
+
+class donut_inference_engine:
+    """
+    Rezidentní Donut model pro dávkovou inferenci.
+
+    Procesor a váhy se načtou jednou. Obrázky celé dávky projdou Swin encoderem jedním voláním,
+    decoder pak generuje greedy s KV cache: v každém kroku dostane jen poslední token a cache předchozích
+    kroků (cross-attention klíče a hodnoty z výstupu encoderu se spočítají v prvním kroku a dál se jen čtou).
+    Sekvence, která vygeneruje `</s>`, se z dávky i z cache hned vyřadí, takže krátké faktury
+    nečekají na nejdelší dokument ani na `max_length`.
+
+    :param model_name: Model a procesor (HuggingFace nebo lokální složka)
+    :param task_prompt: Startovací token úlohy
+    :param max_length: Maximální délka sekvence včetně promptu (None = max_position_embeddings decoderu)
+    :param grammar: Schéma tagů (objekt nebo cesta k json z `donut_grammar.save`)...generování se omezí na platné sekvence.
+                    None = schéma uložené s modelem (`donut_grammar.save_pretrained`), pokud existuje, False = bez omezení
+    """
+
+    def __init__(self, model_name: str = "TomasFAV/DonutInvoiceCzech", device: str | None = None,
+                 task_prompt: str = "<s_cord-v2>", max_length: int | None = None, grammar: donut_grammar | str | bool | None = None):
+
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+
+        self.processor: DonutProcessor = DonutProcessor.from_pretrained(model_name)
+        self.model: VisionEncoderDecoderModel = VisionEncoderDecoderModel.from_pretrained(model_name)
+        self.model.eval().to(self.device)
+
+        self.task_prompt = task_prompt
+        self.prompt_ids: List[int] = self.processor.tokenizer(task_prompt, add_special_tokens=False).input_ids
+        self.max_length = max_length or self.model.decoder.config.max_position_embeddings
+
+        if grammar is None:
+            grammar = donut_grammar.from_pretrained(model_name)
+        elif isinstance(grammar, str):
+            grammar = donut_grammar.load(grammar)
+        self.grammar: donut_grammar | None = grammar or None
+        self.logits_processor = LogitsProcessorList([donut_grammar_logits_processor(self.grammar, self.processor.tokenizer,
+                                                                                    len(self.prompt_ids), self.max_length)]) if self.grammar is not None else None
+
+        self._lock = Lock()
+        self.counters: Dict[str, float] = {"documents": 0, "generated_tokens": 0, "encoder_seconds": 0.0, "decoder_seconds": 0.0}
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def predict(self, img: Image.Image) -> Dict[str, Any]:
+        return self.predict_batch([img])[0]
+
+    def predict_batch(self, images: Sequence[Image.Image], logits_processor: LogitsProcessorList | None = None) -> List[Dict[str, Any]]:
+        pixel_values = self.processor([img.convert("RGB") for img in images], return_tensors="pt").pixel_values
+        sequences = self.generate(pixel_values, logits_processor if logits_processor is not None else self.logits_processor)
+        return [self.processor.token2json(seq) for seq in self.decode(sequences)]
+
+    @torch.inference_mode()
+    def generate(self, pixel_values: torch.Tensor, logits_processor: LogitsProcessorList | None = None) -> List[List[int]]:
+        """
+        Greedy generování s KV cache a vyřazováním hotových sekvencí. Vrací id tokenů každé sekvence včetně promptu.
+        """
+        tokenizer = self.processor.tokenizer
+        forced_eos = self.model.generation_config.forced_eos_token_id #jako model.generate...poslední token může být jen </s>
+        B = pixel_values.size(0)
+
+        with self._lock:
+            start = time.perf_counter()
+            encoder_hidden = self.model.encoder(pixel_values=pixel_values.to(self.device, self.model.dtype)).last_hidden_state
+            if self.model.encoder.config.hidden_size != self.model.decoder.config.hidden_size and self.model.decoder.config.cross_attention_hidden_size is None:
+                encoder_hidden = self.model.enc_to_dec_proj(encoder_hidden)
+            encoded = time.perf_counter()
+
+            sequences = torch.tensor(self.prompt_ids, device=self.device).expand(B, -1).clone() # [aktivní, délka]
+            active = torch.arange(B, device=self.device)    #index sekvence v dávce pro každý aktivní řádek
+            outputs: List[List[int]] = [list() for _ in range(B)]
+
+            decoder_input = sequences
+            past = None
+            generated = 0
+
+            while sequences.size(1) < self.max_length:
+                out = self.model.decoder(input_ids=decoder_input, encoder_hidden_states=encoder_hidden,
+                                         past_key_values=past, use_cache=True)
+                scores = out.logits[:, -1, :]
+                scores[:, tokenizer.unk_token_id] = -float("inf")
+                if logits_processor is not None:
+                    scores = logits_processor(sequences, scores, rows=active)
+
+                next_tokens = scores.argmax(dim=-1)
+                if forced_eos is not None and sequences.size(1) + 1 == self.max_length:
+                    next_tokens = torch.full_like(next_tokens, forced_eos)
+                sequences = torch.cat([sequences, next_tokens.unsqueeze(1)], dim=1)
+                generated += next_tokens.size(0)
+
+                finished = next_tokens == tokenizer.eos_token_id
+                if sequences.size(1) >= self.max_length:
+                    finished = torch.ones_like(finished)
+
+                if finished.any():
+                    for row in finished.nonzero().flatten().tolist():
+                        outputs[active[row]] = sequences[row].tolist()
+
+                    keep = ~finished
+                    if not keep.any():
+                        break
+
+                    #hotové sekvence se vyřadí z dávky, z výstupu encoderu i z cache
+                    sequences, active, encoder_hidden, next_tokens = sequences[keep], active[keep], encoder_hidden[keep], next_tokens[keep]
+                    past = select_cache(out.past_key_values, keep)
+                else:
+                    past = out.past_key_values
+
+                decoder_input = next_tokens.unsqueeze(1)
+
+            #max_length nestačil ani na jeden krok...vrátí se jen prompt
+            for row, index in enumerate(active.tolist()):
+                if not outputs[index]:
+                    outputs[index] = sequences[row].tolist()
+
+            decoded = time.perf_counter()
+            self.counters["documents"] += B
+            self.counters["generated_tokens"] += generated
+            self.counters["encoder_seconds"] += encoded - start
+            self.counters["decoder_seconds"] += decoded - encoded
+
+        return outputs
+
+    def decode(self, sequences: List[List[int]]) -> List[str]:
+        tokenizer = self.processor.tokenizer
+
+        texts: List[str] = list()
+        for seq in tokenizer.batch_decode(sequences):
+            seq = seq.replace(tokenizer.eos_token, "").replace(tokenizer.pad_token, "")
+            seq = re.sub(r"<.*?>", "", seq, count=1).strip()  # remove first task start token
+            texts.append(seq)
+        return texts
+
+    def batcher(self, max_batch_size: int = 8, max_wait_ms: float = 10.0) -> micro_batcher[Image.Image, Dict[str, Any]]:
+        return micro_batcher(self.predict_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["tokens_per_second"] = stats["generated_tokens"] / stats["decoder_seconds"] if stats["decoder_seconds"] else 0.0
+        stats["tokens_per_document"] = stats["generated_tokens"] / stats["documents"] if stats["documents"] else 0.0
+        return stats
+
+
+def select_cache(past: Any, keep: torch.Tensor) -> Any:
+    """
+    Vybere z KV cache decoderu jen ponechané řádky dávky (legacy tuple i Cache objekty).
+    """
+    if hasattr(past, "batch_select_indices"):
+        past.batch_select_indices(keep.nonzero().flatten())
+        return past
+    return tuple(tuple(tensor[keep] for tensor in layer) for layer in past)
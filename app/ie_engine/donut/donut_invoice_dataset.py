@@ -1,22 +1,30 @@
 import json
 from PIL import Image
-from typing import Any, List, Tuple, Dict, Union
+from typing import Any, Iterable, Iterator, List, Tuple, Dict, Union
 import torch
 from torch.utils.data import Dataset
 import os
 from transformers import PreTrainedTokenizerFast, VisionEncoderDecoderModel
 from transformers import DonutProcessor
 
+from app.ie_engine.donut.donut_grammar import donut_grammar
+from app.invoices_generator.utility.annotation_store import annotation_store
+from app.invoices_generator.utility.augmentation import augmentation_config, augmentation_pipeline
+
 added_tokens:list[Any] = []
 
 class donut_invoice_dataset(Dataset[Tuple[torch.Tensor, torch.Tensor, str]]):
-
+    """
+    :param augmentation: Efekty naskenovaného dokumentu aplikované při každém načtení vzorku (None = obrázky tak, jak jsou uložené)
+    """
 
     def __init__(self, data_root_folder_path:str, processor:DonutProcessor, model:VisionEncoderDecoderModel, max_length: int,
-                task_start_token: str = "<s>",prompt_end_token: str|None = None):
+                task_start_token: str = "<s>",prompt_end_token: str|None = None, augmentation:augmentation_config | None = None):
         
         super().__init__()
 
+        self.augmentation:augmentation_config | None = augmentation
+
         self.data_root_folder_path:str = data_root_folder_path
         self.processor:DonutProcessor = processor
         self.max_length:int = max_length
@@ -24,91 +32,123 @@ class donut_invoice_dataset(Dataset[Tuple[torch.Tensor, torch.Tensor, str]]):
         self.task_start_token = task_start_token
         self.prompt_end_token = prompt_end_token if prompt_end_token else task_start_token
 
-        metadata_path = data_root_folder_path + "/metadata.jsonl"
+        #anotace z annotations-*.arrow zůstávají memory-mapované, cílové sekvence se tokenizují až v __getitem__
+        store = annotation_store(self.data_root_folder_path)
+        self.records:annotation_store | List[Dict[str, Any]] = store if store.exists() else self._load_metadata()
 
-        lines:list[str]
-        data:List[dict[str, Any]] = list()
+        #nové tokeny klíčů se přidají do tokenizeru, schéma tagů je pro omezené generování (donut_grammar_logits_processor)
+        self.grammar:donut_grammar = register_targets(processor, model, self._gt_parses(), [self.task_start_token, self.prompt_end_token])
 
-        new_tokens: set[str] = set()
+    def _load_metadata(self)-> List[Dict[str, Any]]:
+        metadata_path = self.data_root_folder_path + "/metadata.jsonl"
 
         with open(metadata_path, mode="r", encoding="utf-8") as f:
-            for line in f:
-                output:Dict[str, Any] = json.loads(line)
-
-                tokens:str = self.json2token(output['ground_truth']['gt_parse'], new_tokens) #do new_tokens se sbírají nově nalezené tokeny 
-                output['ground_truth']['gt_parse'] = tokens
-                data.append(output)
-
-
-        #přidám až všechny najednou
-        if new_tokens:
-            self.add_tokens(list(new_tokens))
-
-        self.add_tokens([self.task_start_token, self.prompt_end_token])
+            return [json.loads(line) for line in f]
 
-        self.data:List[Dict[str, Any]] = data
-
-
-
-
-    def json2token(self, obj:Union[Dict[str, Any], List[Any], str, int, float, None],  new_tokens: set[str], update_special_tokens_for_json_key: bool = True, sort_json_key: bool = True)->str:
-        """
-        REKURZIVNĚ Převede json string na formát tokenů a nové tokeny přidá do tokenizátoru
-        """
-        if isinstance(obj, dict):
-            if len(obj) == 1:
-                return str(next(iter(obj.values())))
-            
-            output = ""
-            keys = sorted(obj.keys(), reverse=True) if sort_json_key else obj.keys()
-            for k in keys:
-                if update_special_tokens_for_json_key:
-                    new_tokens.update([fr"<s_{k}>", fr"</s_{k}>"])
-                    #self.add_tokens([fr"<s_{k}>", fr"</s_{k}>"])
-                output += (
-                    fr"<s_{k}>"
-                    + self.json2token(obj[k], new_tokens, update_special_tokens_for_json_key, sort_json_key)
-                    + fr"</s_{k}>"
-                )
-            return output
-        
-        elif isinstance(obj, list):
-            return "<sep/>".join([self.json2token(item,new_tokens, update_special_tokens_for_json_key, sort_json_key) for item in obj])
+    def _gt_parses(self)-> Iterator[Dict[str, Any]]:
+        if isinstance(self.records, annotation_store):
+            #jen sloupec gt_parse...celé záznamy se nepřevádí
+            for gt_parse in self.records.iter_column("gt_parse"):
+                yield json.loads(gt_parse)
         else:
-            obj_str = str(obj)
-            if f"<{obj_str}/>" in added_tokens:
-                obj_str = f"<{obj_str}/>"  # pro kategorické speciální tokeny
-            return obj_str
-
-    def add_tokens(self, list_of_tokens: List[str])->None:
-        """
-        Přidá token do tokenizeru a zvětší embeding dekodéru
-        """
-        tokenizer: PreTrainedTokenizerFast = self.processor.tokenizer # type: ignore[attr-defined]
-
-        newly_added_num:int = tokenizer.add_tokens(list_of_tokens)
-        if newly_added_num > 0:
-            self.model.decoder.resize_token_embeddings(len(tokenizer))
-            added_tokens.extend(list_of_tokens)
+            for record in self.records:
+                yield record["ground_truth"]["gt_parse"]
 
     def __len__(self) -> int:
-        return len(self.data)
+        return len(self.records)
 
     def __getitem__(self, index:int)-> Tuple[torch.Tensor, torch.Tensor, str]:
-        
-        image_path:str = self.data_root_folder_path + "/" +self.data[index]["file_name"]
+        record = self.records[index]
+
+        image_path:str = self.data_root_folder_path + "/" +record["file_name"]
         image = Image.open(image_path).convert("RGB")
         
-        target_sequence:str  = self.data[index]["ground_truth"]["gt_parse"]
-
-        #embeding tokenizovaného jsonu + předzpracování obrázku
-        encoding = self.processor(
-            images=image,
-            text=target_sequence,
-            return_tensors="pt",
-            max_length=self.max_length,
-            padding="max_length",
-            truncation=True
-        )
-
-        return encoding.pixel_values.squeeze(0), encoding.labels.squeeze(0), target_sequence
\ No newline at end of file
+        target_sequence:str  = json2token(record["ground_truth"]["gt_parse"], set())
+
+        return encode_donut(self.processor, image, target_sequence, self.max_length, self.augmentation)
+
+
+def json2token(obj:Union[Dict[str, Any], List[Any], str, int, float, None],  new_tokens: set[str], update_special_tokens_for_json_key: bool = True, sort_json_key: bool = True)->str:
+    """
+    REKURZIVNĚ Převede json string na formát tokenů, nové tokeny klíčů sbírá do new_tokens
+    """
+    if isinstance(obj, dict):
+        if len(obj) == 1:
+            return str(next(iter(obj.values())))
+
+        output = ""
+        keys = sorted(obj.keys(), reverse=True) if sort_json_key else obj.keys()
+        for k in keys:
+            if update_special_tokens_for_json_key:
+                new_tokens.update([fr"<s_{k}>", fr"</s_{k}>"])
+            output += (
+                fr"<s_{k}>"
+                + json2token(obj[k], new_tokens, update_special_tokens_for_json_key, sort_json_key)
+                + fr"</s_{k}>"
+            )
+        return output
+
+    elif isinstance(obj, list):
+        return "<sep/>".join([json2token(item,new_tokens, update_special_tokens_for_json_key, sort_json_key) for item in obj])
+    else:
+        obj_str = str(obj)
+        if f"<{obj_str}/>" in added_tokens:
+            obj_str = f"<{obj_str}/>"  # pro kategorické speciální tokeny
+        return obj_str
+
+
+def add_tokens(processor:DonutProcessor, model:VisionEncoderDecoderModel, list_of_tokens: List[str])->None:
+    """
+    Přidá token do tokenizeru a zvětší embeding dekodéru
+    """
+    tokenizer: PreTrainedTokenizerFast = processor.tokenizer # type: ignore[attr-defined]
+
+    newly_added_num:int = tokenizer.add_tokens(list_of_tokens)
+    if newly_added_num > 0:
+        model.decoder.resize_token_embeddings(len(tokenizer))
+        added_tokens.extend(list_of_tokens)
+
+
+def register_targets(processor:DonutProcessor, model:VisionEncoderDecoderModel, gt_parses:Iterable[Dict[str, Any]], extra_tokens:List[str])->donut_grammar:
+    """
+    Jeden průchod gt_parse záznamy datasetu: přidá do tokenizeru tokeny všech klíčů (a `extra_tokens`) a vrátí schéma tagů.
+    Sdílí ho donut_invoice_dataset i donut_invoice_shard_dataset.
+    """
+    new_tokens: set[str] = set()
+
+    def collect(gt_parses:Iterable[Dict[str, Any]])-> Iterator[Dict[str, Any]]:
+        for gt_parse in gt_parses:
+            json2token(gt_parse, new_tokens) #do new_tokens se sbírají nově nalezené tokeny
+            yield gt_parse
+
+    #schéma a tokeny v jednom průchodu...záznamy se nikde nedrží
+    grammar = donut_grammar.from_records(collect(gt_parses))
+
+    #přidám až všechny najednou
+    if new_tokens:
+        add_tokens(processor, model, list(new_tokens))
+
+    add_tokens(processor, model, extra_tokens)
+
+    return grammar
+
+
+def encode_donut(processor:DonutProcessor, image:Image.Image, target_sequence:str, max_length:int,
+                 augmentation:augmentation_config | None = None)-> Tuple[torch.Tensor, torch.Tensor, str]:
+    """
+    Zakóduje jeden vzorek (obrázek + cílová sekvence z json2token) pro Donut.
+    """
+    if augmentation is not None:
+        image = augmentation_pipeline.shared(augmentation).apply(image)
+
+    #embeding tokenizovaného jsonu + předzpracování obrázku
+    encoding = processor(
+        images=image,
+        text=target_sequence,
+        return_tensors="pt",
+        max_length=max_length,
+        padding="max_length",
+        truncation=True
+    )
+
+    return encoding.pixel_values.squeeze(0), encoding.labels.squeeze(0), target_sequence
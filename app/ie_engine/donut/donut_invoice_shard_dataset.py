@@ -0,0 +1,63 @@
+import io
+from PIL import Image
+from typing import Any, Dict, Iterator, List, Tuple
+import torch
+from torch.utils.data import IterableDataset
+from transformers import DonutProcessor, VisionEncoderDecoderModel
+
+from app.ie_engine.donut.donut_grammar import donut_grammar
+from app.ie_engine.donut.donut_invoice_dataset import encode_donut, json2token, register_targets
+from app.ie_engine.utility.worker_split import worker_split
+from app.invoices_generator.utility.augmentation import augmentation_config
+from app.invoices_generator.utility.shards import buffer_shuffle, iter_shard_samples, list_shards, split_shards
+
+class donut_invoice_shard_dataset(IterableDataset[Tuple[torch.Tensor, torch.Tensor, str]]):
+    """
+    Streamovaný dataset nad tar shardy (invoice_generator s output_format=TAR).
+
+    Při vytvoření se jednou projdou jen json záznamy shardů (obrázky se přeskočí), aby šlo
+    zaregistrovat nové tokeny stejně jako v donut_invoice_dataset. Záznamy se v paměti nedrží,
+    obrázky i cílové sekvence se čtou sekvenčně ze shardů v `__iter__`.
+    """
+
+    def __init__(self, data_root_folder_path:str, processor:DonutProcessor, model:VisionEncoderDecoderModel, max_length: int,
+                task_start_token: str = "<s>",prompt_end_token: str|None = None, shuffle:bool = False, shuffle_buffer:int = 64,
+                augmentation:augmentation_config | None = None):
+
+        super().__init__()
+
+        self.data_root_folder_path:str = data_root_folder_path
+        self.processor:DonutProcessor = processor
+        self.max_length:int = max_length
+        self.task_start_token = task_start_token
+        self.prompt_end_token = prompt_end_token if prompt_end_token else task_start_token
+        self.shuffle:bool = shuffle
+        self.shuffle_buffer:int = shuffle_buffer
+        self.augmentation:augmentation_config | None = augmentation
+
+        self.shards:List[str] = list_shards(data_root_folder_path)
+        self._length:int = 0
+
+        def gt_parses()-> Iterator[Dict[str, Any]]:
+            for _, _, record in iter_shard_samples(self.shards, with_images=False):
+                self._length += 1
+                yield record["ground_truth"]["gt_parse"]
+
+        self.grammar:donut_grammar = register_targets(processor, model, gt_parses(), [self.task_start_token, self.prompt_end_token])
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, torch.Tensor, str]]:
+        worker_id, num_workers, seed = worker_split()
+
+        shards = split_shards(self.shards, worker_id, num_workers, seed if self.shuffle else None)
+
+        samples:Iterator[Tuple[str, bytes | None, Dict[str, Any]]] = iter_shard_samples(shards)
+        if self.shuffle:
+            samples = buffer_shuffle(samples, self.shuffle_buffer, seed + worker_id)
+
+        for _, image_bytes, record in samples:
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            target_sequence = json2token(record["ground_truth"]["gt_parse"], set())
+            yield encode_donut(self.processor, image, target_sequence, self.max_length, self.augmentation)
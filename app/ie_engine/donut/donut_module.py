@@ -10,6 +10,8 @@ import pytorch_lightning
 from transformers import DonutProcessor,PreTrainedTokenizerFast, VisionEncoderDecoderModel, VisionEncoderDecoderConfig
 from PIL import Image
 
+from app.ie_engine.donut.donut_grammar import donut_grammar
+
 class donut_module(pytorch_lightning.LightningModule):
     
     def __init__(self, train_config:dict[Any], processor:DonutProcessor, model:VisionEncoderDecoderModel, max_length:int = 768)->None:
@@ -74,17 +76,25 @@ class donut_module(pytorch_lightning.LightningModule):
     
 
 class training_callback(pytorch_lightning.Callback):
-    def __init__(self, save_path="app/engine/models"):
+    """
+    :param grammar: Schéma tagů Donut cílů, uloží se s modelem (donut_inference_engine ho pak načte sám)
+    """
+    def __init__(self, save_path="app/engine/models", grammar: donut_grammar | None = None):
         super().__init__()
         self.save_path = save_path
+        self.grammar = grammar
 
     def on_train_epoch_end(self, trainer, pl_module):
         print(f"Saving model after epoch {trainer.current_epoch}")
         pl_module.model.save_pretrained(f"{self.save_path}/epoch_{trainer.current_epoch}")
         pl_module.processor.save_pretrained(f"{self.save_path}/epoch_{trainer.current_epoch}")
+        if self.grammar is not None:
+            self.grammar.save_pretrained(f"{self.save_path}/epoch_{trainer.current_epoch}")
 
     def on_train_end(self, trainer, pl_module):
         print("Saving final model after training")
         pl_module.model.save_pretrained(f"{self.save_path}/final")
         pl_module.processor.save_pretrained(f"{self.save_path}/final")
+        if self.grammar is not None:
+            self.grammar.save_pretrained(f"{self.save_path}/final")
         
@@ -1,11 +1,11 @@
-import re
 from PIL import Image
 from typing import Any
-import torch
 from transformers import DonutProcessor, PreTrainedTokenizerFast, VisionEncoderDecoderModel, VisionEncoderDecoderConfig
+from app.ie_engine.donut.donut_inference_engine import donut_inference_engine
 from app.ie_engine.donut.donut_invoice_dataset import donut_invoice_dataset
 from torch.utils.data import DataLoader
 from app.ie_engine.donut.donut_module import donut_module, training_callback
+from app.invoices_generator.utility.augmentation import augmentation_config
 import pytorch_lightning
 
 
@@ -41,7 +41,9 @@ class donut_trainer:
         processor = DonutProcessor.from_pretrained(model_name)
         model:VisionEncoderDecoderModel = VisionEncoderDecoderModel.from_pretrained(model_name, config=config)
 
-        train_dataset = donut_invoice_dataset(data_root_folder_path="app/data/train", processor=processor, model=model,max_length=max_length, task_start_token="<s_cord-v2>", prompt_end_token="<s_cord-v2>")
+        #train je uložený bez efektů...augmentuje se při načítání, každou epochu jinak
+        train_dataset = donut_invoice_dataset(data_root_folder_path="app/data/train", processor=processor, model=model,max_length=max_length, task_start_token="<s_cord-v2>", prompt_end_token="<s_cord-v2>",
+                                              augmentation=augmentation_config())
 
         test_dataset = donut_invoice_dataset(data_root_folder_path="app/data/test", processor=processor, model=model,max_length=max_length, task_start_token="<s_cord-v2>", prompt_end_token="<s_cord-v2>")
 
@@ -54,7 +56,7 @@ class donut_trainer:
         model.config.decoder_start_token_id = int(tokenizer.convert_tokens_to_ids(['<s_cord-v2>'])[0])
         model.gradient_checkpointing_enable()
 
-        train_dataloader:DataLoader = DataLoader(test_dataset, batch_size=train_config.get("train_batch_sizes"), shuffle=True, num_workers=4)
+        train_dataloader:DataLoader = DataLoader(train_dataset, batch_size=train_config.get("train_batch_sizes"), shuffle=True, num_workers=4)
         #test_dataloader:DataLoader = DataLoader(test_dataset, batch_size=1, shuffle=True, num_workers=4)
         val_dataloader:DataLoader = DataLoader(val_dataset, batch_size=train_config.get("val_batch_sizes"), shuffle=False, num_workers=4)
 
@@ -69,7 +71,7 @@ class donut_trainer:
             gradient_clip_val=train_config.get("gradient_clip_val"),
             precision=16, # we'll use mixed precision
             num_sanity_val_steps=0,
-            callbacks=[training_callback()],
+            callbacks=[training_callback(grammar=train_dataset.grammar)],
         )
 
         lr_finder = trainer.tuner.lr_find(model_module)
@@ -78,44 +80,12 @@ class donut_trainer:
 
         trainer.fit(model_module, train_dataloaders=train_dataloader, val_dataloaders=val_dataloader)
     
-    @staticmethod
-    def predict(img:Image.Image) -> None:
-        model_name: str = "TomasFAV/DonutInvoiceCzech"
+    _engine: donut_inference_engine | None = None
 
-        processor = DonutProcessor.from_pretrained(model_name)
-        model: VisionEncoderDecoderModel = VisionEncoderDecoderModel.from_pretrained(model_name)
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-
-        model.eval()
-        model.to(device)
-
-        # prepare encoder inputs
-        pixel_values = processor(img, return_tensors="pt").pixel_values
-        pixel_values = pixel_values.to(device)
-        # prepare decoder inputs
-        task_prompt = "<s_cord-v2>"
-        decoder_input_ids = processor.tokenizer(task_prompt, add_special_tokens=False, return_tensors="pt").input_ids
-        decoder_input_ids = decoder_input_ids.to(device)
-            
-        # autoregressively generate sequence
-        outputs = model.generate(
-            pixel_values,
-            decoder_input_ids=decoder_input_ids,
-            max_length=model.decoder.config.max_position_embeddings,
-            early_stopping=True,
-            pad_token_id=processor.tokenizer.pad_token_id,
-            eos_token_id=processor.tokenizer.eos_token_id,
-            use_cache=True,
-            num_beams=1,
-            bad_words_ids=[[processor.tokenizer.unk_token_id]],
-            return_dict_in_generate=True,
-        )
+    @staticmethod
+    def predict(img:Image.Image) -> Any:
+        #model zůstává načtený mezi voláními
+        if donut_trainer._engine is None:
+            donut_trainer._engine = donut_inference_engine("TomasFAV/DonutInvoiceCzech")
 
-        # turn into JSON
-        seq = processor.batch_decode(outputs.sequences)[0]
-        seq = seq.replace(processor.tokenizer.eos_token, "").replace(processor.tokenizer.pad_token, "")
-        seq = re.sub(r"<.*?>", "", seq, count=1).strip()  # remove first task start token
-        print(seq)
-        seq = processor.token2json(seq)
-            
-        print(seq)
\ No newline at end of file
+        return donut_trainer._engine.predict(img)
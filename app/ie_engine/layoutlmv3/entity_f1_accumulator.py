@@ -0,0 +1,55 @@
+from collections import Counter
+from typing import Dict, List
+
+from seqeval.metrics.sequence_labeling import get_entities
+
+
+class entity_f1_accumulator:
+    """
+    Průběžný výpočet entity-level precision/recall/F1 (stejná definice entit jako seqeval).
+
+    `update` z každého batche jen připočte počty (správně nalezené, predikované a skutečné entity
+    pro každý typ), takže nic nedrží v paměti a `compute` je O(počet typů) místo přepočtu celé epochy.
+    """
+
+    def __init__(self):
+        self.true_positive: Counter = Counter()
+        self.predicted: Counter = Counter()
+        self.gold: Counter = Counter()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def update(self, predictions: List[List[str]], references: List[List[str]]) -> None:
+        for pred, gold in zip(predictions, references):
+            pred_entities = set(get_entities(pred))
+            gold_entities = set(get_entities(gold))
+
+            self.predicted.update(entity_type for entity_type, _, _ in pred_entities)
+            self.gold.update(entity_type for entity_type, _, _ in gold_entities)
+            self.true_positive.update(entity_type for entity_type, _, _ in pred_entities & gold_entities)
+
+    def compute(self) -> Dict[str, float]:
+        """
+        Micro průměr přes všechny typy entit (`overall_*`) a F1 jednotlivých typů.
+        """
+        results = {f"{entity_type}_f1": self._f1(self.true_positive[entity_type], self.predicted[entity_type], self.gold[entity_type])
+                   for entity_type in sorted(self.gold.keys() | self.predicted.keys())}
+
+        tp, predicted, gold = sum(self.true_positive.values()), sum(self.predicted.values()), sum(self.gold.values())
+        results["overall_precision"] = tp / predicted if predicted else 0.0
+        results["overall_recall"] = tp / gold if gold else 0.0
+        results["overall_f1"] = self._f1(tp, predicted, gold)
+        return results
+
+    def reset(self) -> None:
+        self.true_positive.clear()
+        self.predicted.clear()
+        self.gold.clear()
+
+    @staticmethod
+    def _f1(tp: int, predicted: int, gold: int) -> float:
+        return 2 * tp / (predicted + gold) if predicted + gold else 0.0
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import sys
+from threading import Lock, Thread
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+from PIL import Image
+import torch
+from transformers import LayoutLMv3Model, LayoutLMv3Processor
+
+from app.ie_engine.layoutlmv3.layout_invoice_dataset import collate_joint, encode_invoice
+from app.ie_engine.layoutlmv3.layoutlmv3_model import layoutlmv3_model
+from app.ie_engine.utility.micro_batcher import micro_batcher
+from app.ie_engine.utility.ocr_pool import ocr_pool
+from app.invoices_generator.core.enumerates.relationship_types import relationship_types
+from app.invoices_generator.core.enumerates.span_tags import span_tags
+from app.invoices_generator.core.enumerates.token_tags import token_tags
+
+
+#slova dokumentu a jejich boxy (0-1000)
+ocr_result = Tuple[List[str], List[Tuple[float, float, float, float]]]
+
+
+class layout_inference_service:
+    """
+    Dlouho žijící služba pro extrakci polí z faktur modelem LayoutLMv3.
+
+    Procesor a váhy se načtou jednou v konstruktoru, model zůstává v eval režimu a každé volání běží
+    pod `torch.inference_mode`. Jedno volání `extract_batch` udělá celý řetězec
+    OCR -> zakódování do oken -> NER -> spany z NER -> vztahy mezi spany -> strukturovaná pole.
+
+    :param checkpoint_path: Lightning checkpoint (`layoutlmv3_pl_model`) nebo state_dict `layoutlmv3_model`...None = jen základní váhy
+    :param model_name: Základní model a procesor z HuggingFace
+    :param ocr: OCR pool (None = vlastní pool s výchozím nastavením, tesseract z TESSERACT_CMD nebo PATH)
+    :param min_confidence: Slova s nižší jistotou OCR se zahodí
+    """
+
+    def __init__(self, checkpoint_path: str | None = None, model_name: str = "microsoft/layoutlmv3-base",
+                 device: str | None = None, ocr: ocr_pool | None = None, min_confidence: float = 40):
+
+        self.device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+        self.ocr_pool = ocr if ocr is not None else ocr_pool()
+        self.min_confidence = min_confidence
+
+        self.processor = LayoutLMv3Processor.from_pretrained(model_name, apply_ocr=False)
+        backbone: LayoutLMv3Model = LayoutLMv3Model.from_pretrained(model_name)
+
+        self.model = layoutlmv3_model(len(token_tags), len(relationship_types), backbone)
+        if checkpoint_path is not None:
+            self.model.load_state_dict(load_model_state(checkpoint_path))
+        self.model.eval().to(self.device)
+
+        #id NER tagu -> span_tags (None pro O)...B_X i I_X mají ref na I_X
+        span_of_ref = {span.ref.ref: span for span in span_tags if span is not span_tags.O}
+        self._tag_spans: List[span_tags | None] = [span_of_ref.get(tag.ref) for tag in token_tags]
+        self._tag_begins: List[bool] = [tag.name.startswith("B_") for tag in token_tags]
+
+        self._lock = Lock()
+        self.counters: Dict[str, float] = {"requests": 0, "documents": 0, "words": 0,
+                                           "ocr_seconds": 0.0, "encode_seconds": 0.0, "model_seconds": 0.0, "total_seconds": 0.0}
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def ocr(self, img: Image.Image) -> ocr_result:
+        return self.ocr_pool.recognize(img).normalized(self.min_confidence)
+
+    def extract(self, img: Image.Image, ocr_data: ocr_result | None = None) -> Dict[str, Any]:
+        return self.extract_batch([img], [ocr_data])[0]
+
+    def extract_batch(self, images: Sequence[Image.Image], ocr_results: Sequence[ocr_result | None] | None = None) -> List[Dict[str, Any]]:
+        """
+        Extrakce polí z více faktur najednou (jeden průchod modelem).
+
+        :param ocr_results: Hotové výsledky OCR (slova, boxy) pro obrázky...None = spustí se OCR
+        """
+        start = time.perf_counter()
+        images = [img.convert("RGB") for img in images]
+
+        ocr_results = list(ocr_results) if ocr_results is not None else [None] * len(images)
+
+        #chybějící OCR celé dávky najednou...obrázky se rozpoznávají paralelně ve workerech poolu
+        missing = [i for i, result in enumerate(ocr_results) if result is None]
+        for i, page in zip(missing, self.ocr_pool.recognize_batch([images[i] for i in missing])):
+            ocr_results[i] = page.normalized(self.min_confidence)
+        ocr_done = time.perf_counter()
+
+        samples = [encode_invoice(self.processor, img, inference_record(words, boxes)) for img, (words, boxes) in zip(images, ocr_results)]
+        batch = collate_joint(samples, pad_token_id=self.processor.tokenizer.pad_token_id)
+        encode_done = time.perf_counter()
+
+        with self._lock, torch.inference_mode():
+            batch = {k: v.to(self.device) if torch.is_tensor(v) else v for k, v in batch.items()}
+
+            outputs_list, ner_logits = self.model.encode(batch)
+            word_tags = self.word_tags(ner_logits.argmax(-1), batch["word_input_ids_mapping"], [len(words) for words, _ in ocr_results])
+
+            batch["spans"] = [self.decode_spans(tags) for tags in word_tags]
+            batch["relationships"] = None
+            relations = self.model.relate(batch, outputs_list, training=False)
+
+            rel_probs = relations["rel_logits"].float().softmax(-1).cpu()
+            rel_offsets = relations["rel_doc_offsets"].tolist()
+        model_done = time.perf_counter()
+
+        results: List[Dict[str, Any]] = list()
+        for b, (words, _) in enumerate(ocr_results):
+            doc_probs = rel_probs[rel_offsets[b]:rel_offsets[b+1]]
+            results.append(self.build_fields(words, batch["spans"][b], relations["rel_pair_indices"][b], doc_probs))
+
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["documents"] += len(images)
+            self.counters["words"] += sum(len(words) for words, _ in ocr_results)
+            self.counters["ocr_seconds"] += ocr_done - start
+            self.counters["encode_seconds"] += encode_done - ocr_done
+            self.counters["model_seconds"] += model_done - encode_done
+            self.counters["total_seconds"] += time.perf_counter() - start
+
+        return results
+
+    def word_tags(self, ner_ids: torch.Tensor, word_input_ids_mapping: torch.Tensor, n_words: List[int]) -> List[List[int]]:
+        """
+        Tag každého slova z predikce jeho prvního subtokenu v prvním okně, ve kterém slovo je.
+        """
+        maps = word_input_ids_mapping.to(ner_ids.device).long()     # [B, P, N, 2]
+        found = maps[..., 0] >= 0                                   # [B, P, N]
+        page = found.int().argmax(dim=1)                            # [B, N]
+        start = maps[..., 0].gather(1, page.unsqueeze(1)).squeeze(1) # [B, N]
+
+        doc = torch.arange(ner_ids.size(0), device=ner_ids.device).unsqueeze(1).expand_as(page)
+        tags = ner_ids[doc, page, start.clamp(min=0)]
+        tags = torch.where(found.any(dim=1), tags, token_tags.O.code).tolist()
+
+        return [doc_tags[:n] for doc_tags, n in zip(tags, n_words)]
+
+    def decode_spans(self, tags: List[int]) -> Dict[str, List[Any]]:
+        """
+        BIO dekódování tagů slov na spany ve tvaru `record["data"]["spans"]` (kódy span_tags a indexy slov).
+        """
+        span_codes: List[int] = list()
+        token_indices: List[List[int]] = list()
+        current: span_tags | None = None
+
+        for index, tag in enumerate(tags):
+            span = self._tag_spans[tag]
+            if span is None:
+                current = None
+                continue
+
+            #I_X bez předchozího X se bere jako začátek spanu
+            if self._tag_begins[tag] or span is not current:
+                span_codes.append(span.code)
+                token_indices.append(list())
+                current = span
+            token_indices[-1].append(index)
+
+        return {"tags": span_codes, "token_indices": token_indices}
+
+    def build_fields(self, words: List[str], spans: Dict[str, List[Any]], pair_indices: List[Tuple[int, int]], pair_probs: torch.Tensor) -> Dict[str, Any]:
+        """
+        Strukturovaný výstup: texty polí podle span_tags a řádky DPH (sazba, základ, daň) z predikovaných vztahů.
+        """
+        texts = [" ".join(words[i] for i in indices) for indices in spans["token_indices"]]
+
+        fields: Dict[str, List[str]] = dict()
+        for code, text in zip(spans["tags"], texts):
+            fields.setdefault(span_tags_by_code[code].text, list()).append(text)
+
+        #indexy párů jsou indexy mezi spany, které span_pooler ponechal
+        kept = [i for i, code in enumerate(spans["tags"]) if code in self.model.span_pooler.allowed_span_types]
+
+        vat_rows: Dict[int, Dict[str, Any]] = dict()
+        best: Dict[Tuple[int, int], float] = dict()
+        for (a, b), probs in zip(pair_indices, pair_probs.tolist()):
+            relation = max(range(len(probs)), key=probs.__getitem__)
+            if relation == relationship_types.NONE.code:
+                continue
+
+            row = vat_rows.setdefault(b, {"vat_percentage": texts[kept[b]], "vat_base": None, "vat": None})
+            key = "vat_base" if relation == relationship_types.BASE_OF.code else "vat"
+
+            #pro každou sazbu jen nejjistější základ a daň
+            if probs[relation] > best.get((b, relation), 0.0):
+                best[(b, relation)] = probs[relation]
+                row[key] = texts[kept[a]]
+
+        return {"fields": fields, "vat_rows": list(vat_rows.values())}
+
+    def batcher(self, max_batch_size: int = 8, max_wait_ms: float = 10.0) -> micro_batcher[Tuple[Image.Image, ocr_result | None], Dict[str, Any]]:
+        """
+        Asynchronní fronta, která jednotlivé požadavky (obrázek, OCR nebo None) skládá do jednoho volání extract_batch.
+        """
+        return micro_batcher(lambda items: self.extract_batch([img for img, _ in items], [ocr_data for _, ocr_data in items]),
+                             max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self.counters)
+        stats["avg_latency_ms"] = 1000 * stats["total_seconds"] / stats["requests"] if stats["requests"] else 0.0
+        stats["documents_per_second"] = stats["documents"] / stats["total_seconds"] if stats["total_seconds"] else 0.0
+        stats["ocr"] = self.ocr_pool.stats()
+        return stats
+
+
+span_tags_by_code: Dict[int, span_tags] = {span.code: span for span in span_tags}
+
+
+def inference_record(words: List[str], boxes: List[Tuple[float, float, float, float]]) -> Dict[str, Any]:
+    """
+    Záznam ve tvaru řádku metadata.jsonl pro encode_invoice bez anotací (tagy O, žádné spany ani vztahy).
+    """
+    return {"data": {"tokens": {"tokens": list(words), "boxes": list(boxes), "tags": [token_tags.O.code] * len(words)},
+                     "spans": {"tags": [], "token_indices": []},
+                     "relationships": {"span_index_a": [], "span_index_b": [], "relationship_type": []}}}
+
+
+def load_model_state(checkpoint_path: str) -> Dict[str, torch.Tensor]:
+    """
+    State dict `layoutlmv3_model` z Lightning checkpointu (klíče s prefixem "model.") nebo přímo uloženého state_dict.
+    """
+    #weights_only=False...Lightning checkpoint má v hyper_parameters uložený i objekt modelu (save_hyperparameters),
+    #který se s weights_only=True nenačte. Načítají se jen vlastní lokální checkpointy.
+    state = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    if "state_dict" in state:
+        state = {k[len("model."):]: v for k, v in state["state_dict"].items() if k.startswith("model.")}
+    return state
+
+
+def load_image(source: str | bytes) -> Image.Image:
+    #načte obrázek celý do paměti...Image.open čte soubor líně
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as img:
+        return img.convert("RGB")
+
+
+def serve_stdin(service: layout_inference_service, max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                max_pending: int | None = None) -> None:
+    """
+    JSONL front end: na vstupu řádky {"id": ..., "path": ...}, na výstup jde {"id": ..., "result": ...} nebo {"id": ..., "error": ...}.
+    Požadavky se zpracovávají souběžně přes micro_batcher, odpovědi proto můžou přijít v jiném pořadí než požadavky.
+
+    :param max_pending: Kolik požadavků (načtených obrázků) může být rozpracovaných najednou...další řádek vstupu
+                        se čte až po dokončení některého z nich (None = 4 * max_batch_size)
+    """
+    asyncio.run(_serve_stdin(service.batcher(max_batch_size, max_wait_ms), max_pending or 4 * max_batch_size))
+
+
+async def _serve_stdin(batcher: micro_batcher, max_pending: int) -> None:
+    loop = asyncio.get_running_loop()
+    pending: set[asyncio.Task[None]] = set()
+    slots = asyncio.Semaphore(max_pending)
+
+    async def handle(request: Dict[str, Any]) -> None:
+        try:
+            img = await loop.run_in_executor(None, load_image, request["path"])
+            response = {"id": request.get("id"), "result": await batcher.submit((img, None))}
+        except Exception as e:
+            response = {"id": request.get("id"), "error": str(e)}
+        finally:
+            slots.release()
+
+        sys.stdout.write(json.dumps(response, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    while True:
+        await slots.acquire()
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            break
+        if not line.strip():
+            slots.release()
+            continue
+
+        task = asyncio.create_task(handle(json.loads(line)))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    await asyncio.gather(*pending)
+    await batcher.stop()
+
+
+def serve_http(service: layout_inference_service, host: str = "127.0.0.1", port: int = 8080,
+               max_batch_size: int = 8, max_wait_ms: float = 10.0) -> None:
+    """
+    Lokální HTTP front end: POST /extract s bajty obrázku v těle vrátí extrahovaná pole, GET /stats vrátí čítače služby a fronty.
+    Každý požadavek má vlastní vlákno, souběžné požadavky skládá do batchů micro_batcher v event loopu na pozadí.
+    """
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, daemon=True).start()
+    batcher = service.batcher(max_batch_size, max_wait_ms)
+
+    class handler(BaseHTTPRequestHandler):
+
+        def do_GET(self) -> None:
+            if self.path != "/stats":
+                self._send(404, {"error": "not found"})
+                return
+            self._send(200, {"service": service.stats(), "batcher": batcher.stats()})
+
+        def do_POST(self) -> None:
+            if self.path != "/extract":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                img = load_image(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                self._send(200, asyncio.run_coroutine_threadsafe(batcher.submit((img, None)), loop).result())
+            except Exception as e:
+                self._send(400, {"error": str(e)})
+
+        def _send(self, status: int, payload: Dict[str, Any]) -> None:
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    ThreadingHTTPServer((host, port), handler).serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extrakce polí z faktur modelem LayoutLMv3")
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--model-name", default="microsoft/layoutlmv3-base")
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--http", action="store_true", help="HTTP server místo JSONL na stdin/stdout")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0)
+    parser.add_argument("--ocr-workers", type=int, default=None)
+    parser.add_argument("--ocr-lang", default="ces")
+    parser.add_argument("--ocr-cache", default="app/data/ocr_cache")
+    args = parser.parse_args()
+
+    service = layout_inference_service(args.checkpoint, args.model_name, args.device,
+                                       ocr_pool(args.ocr_workers, args.ocr_lang, cache_folder_path=args.ocr_cache))
+    if args.http:
+        serve_http(service, args.host, args.port, args.max_batch_size, args.max_wait_ms)
+    else:
+        serve_stdin(service, args.max_batch_size, args.max_wait_ms)
@@ -0,0 +1,185 @@
+import json
+import os
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from transformers import LayoutLMv3Processor
+
+from app.ie_engine.layoutlmv3.layout_invoice_dataset import layout_invoice_dataset
+from app.invoices_generator.utility.annotation_store import annotation_store, write_annotations
+
+CACHE_META: str = "cache.json"
+
+#pole cache: (dtype, tvar jednoho okna)...všechna okna všech dokumentů jsou za sebou
+#procesor vrací všechna pole jako int64, při čtení se na int64 převádí zpět (bbox je v rozsahu 0-1000)
+WINDOW_ARRAYS: Dict[str, Tuple[str, Tuple[int, ...]]] = {
+    "input_ids": ("int32", (512,)),
+    "attention_mask": ("int8", (512,)),
+    "bbox": ("int16", (512, 4)),
+    "labels": ("int16", (512,)),
+}
+
+
+def build_layout_cache(data_root_folder_path:str, processor:LayoutLMv3Processor, cache_folder_path:str | None = None, workers:int = 0)-> str:
+    """
+    Jednorázově zakóduje celou složku datasetu (unidecode + LayoutLMv3Processor) do memory-mapovaných NumPy polí,
+    ze kterých pak čte layout_invoice_cached_dataset. Vrací cestu ke složce cache.
+
+    - input_ids, attention_mask, bbox a labels se ukládají po oknech
+    - word_input_ids_mapping [okna, slova, 2] se ukládá jako ploché int32 pole dvojic
+    - obrázek se ukládá jednou na dokument jako uint8 [3, H, W] (normalizace se dělá až při čtení)
+    - slova (po unidecode), spany a vztahy jsou v annotations-000000.arrow (annotation_store)
+
+    :param workers: Počet DataLoader workerů pro kódování
+    """
+    cache_folder_path = cache_folder_path or os.path.join(data_root_folder_path, "cache_layoutlmv3")
+    os.makedirs(cache_folder_path, exist_ok=True)
+
+    #metadata se zapisují jako poslední...nedokončená cache se nenačte
+    meta_path = os.path.join(cache_folder_path, CACHE_META)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    dataset = layout_invoice_dataset(data_root_folder_path, processor)
+    loader = DataLoader(dataset, batch_size=None, shuffle=False, num_workers=workers)
+
+    image_processor = processor.image_processor
+    mean = np.asarray(image_processor.image_mean, dtype=np.float32).reshape(-1, 1, 1)
+    std = np.asarray(image_processor.image_std, dtype=np.float32).reshape(-1, 1, 1)
+
+    files = {name: open(os.path.join(cache_folder_path, name + ".bin"), "wb") for name in list(WINDOW_ARRAYS) + ["word_input_ids_mapping", "pixels"]}
+    doc_windows: List[int] = [0]
+    doc_word_maps: List[int] = [0]
+    records: List[Dict[str, Any]] = list()
+    pixel_shape: Tuple[int, ...] = ()
+
+    try:
+        for index, sample in enumerate(loader):
+            encoding = sample["encodings"]
+            windows = sample["windows"]
+
+            for name, (dtype, shape) in WINDOW_ARRAYS.items():
+                files[name].write(encoding[name][:windows].numpy().astype(dtype).tobytes())
+
+            word_map = sample["word_input_ids_mapping"].numpy().astype(np.int32)
+            files["word_input_ids_mapping"].write(word_map.tobytes())
+            doc_word_maps.append(doc_word_maps[-1] + word_map.size // 2)
+
+            #inverze normalizace procesoru...hodnoty pixelů jsou po resize celočíselné
+            pixels = np.rint((encoding["pixel_values"].numpy() * std + mean) * 255.0).clip(0, 255).astype(np.uint8)
+            files["pixels"].write(pixels.tobytes())
+            pixel_shape = pixels.shape
+
+            doc_windows.append(doc_windows[-1] + windows)
+
+            #kopie záznamu...záznamy datasetu se nemění
+            record = dataset.data[index]
+            data = record["data"]
+            records.append({**record, "data": {**data, "tokens": {**data["tokens"], "tokens": sample["words"]}}})
+    finally:
+        for f in files.values():
+            f.close()
+
+    np.save(os.path.join(cache_folder_path, "doc_windows.npy"), np.asarray(doc_windows, dtype=np.int64))
+    np.save(os.path.join(cache_folder_path, "doc_word_maps.npy"), np.asarray(doc_word_maps, dtype=np.int64))
+    write_annotations(os.path.join(cache_folder_path, "annotations-000000.arrow"), records)
+
+    meta = {
+        "documents": len(records),
+        "windows": doc_windows[-1],
+        "word_maps": doc_word_maps[-1],
+        "pixel_shape": list(pixel_shape),
+        "image_mean": image_processor.image_mean,
+        "image_std": image_processor.image_std,
+        "pad_token_id": processor.tokenizer.pad_token_id,
+        "dtypes": {name: dtype for name, (dtype, _) in WINDOW_ARRAYS.items()},
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    return cache_folder_path
+
+
+class layout_invoice_cached_dataset(Dataset[Dict[str, Any]]):
+    """
+    Dataset nad cache z `build_layout_cache`. Vrací stejné vzorky jako layout_invoice_dataset,
+    ale `__getitem__` jen řeže memory-mapovaná pole (žádný unidecode, tokenizace ani resize obrázku).
+    Memory-mapy se otevírají líně, takže se do DataLoader workerů nekopírují.
+    """
+
+    def __init__(self, cache_folder_path:str):
+
+        super().__init__()
+
+        self.cache_folder_path:str = cache_folder_path
+
+        with open(os.path.join(cache_folder_path, CACHE_META), "r", encoding="utf-8") as f:
+            self.meta:Dict[str, Any] = json.load(f)
+
+        dtypes = {name: dtype for name, (dtype, _) in WINDOW_ARRAYS.items()}
+        if self.meta.get("dtypes") != dtypes:
+            raise ValueError(f"Cache {cache_folder_path} má jiný formát polí ({self.meta.get('dtypes')}), je potřeba ji znovu sestavit (build_layout_cache).")
+
+        self.doc_windows:np.ndarray = np.load(os.path.join(cache_folder_path, "doc_windows.npy"))
+        self.doc_word_maps:np.ndarray = np.load(os.path.join(cache_folder_path, "doc_word_maps.npy"))
+        self.annotations = annotation_store(cache_folder_path)
+
+        self.mean = np.asarray(self.meta["image_mean"], dtype=np.float32).reshape(-1, 1, 1)
+        self.std = np.asarray(self.meta["image_std"], dtype=np.float32).reshape(-1, 1, 1)
+
+        self._arrays:Dict[str, np.memmap] | None = None
+
+    @property
+    def arrays(self) -> Dict[str, np.memmap]:
+        if self._arrays is None:
+            windows = self.meta["windows"]
+            arrays = {name: np.memmap(os.path.join(self.cache_folder_path, name + ".bin"), dtype=dtype, mode="r", shape=(windows,) + shape)
+                      for name, (dtype, shape) in WINDOW_ARRAYS.items()}
+            arrays["word_input_ids_mapping"] = np.memmap(os.path.join(self.cache_folder_path, "word_input_ids_mapping.bin"), dtype=np.int32, mode="r",
+                                                         shape=(self.meta["word_maps"], 2))
+            arrays["pixels"] = np.memmap(os.path.join(self.cache_folder_path, "pixels.bin"), dtype=np.uint8, mode="r",
+                                         shape=(self.meta["documents"], *self.meta["pixel_shape"]))
+            self._arrays = arrays
+        return self._arrays
+
+    def __len__(self) -> int:
+        return self.meta["documents"]
+
+    def sample_lengths(self) -> List[int]:
+        """
+        Počet skutečných subtokenů dokumentů (součet attention_mask přes okna) pro length_grouped_batch_sampler.
+        """
+        window_lengths = self.arrays["attention_mask"].sum(axis=-1, dtype=np.int64)
+        return np.add.reduceat(window_lengths, self.doc_windows[:-1]).tolist()
+
+    def __getitem__(self, index:int)-> Dict[str, Any]:
+        arrays = self.arrays
+        start, end = int(self.doc_windows[index]), int(self.doc_windows[index + 1])
+        windows = end - start
+
+        #stejné operace jako rescale + normalize v image procesoru
+        pixels = (arrays["pixels"][index].astype(np.float64) * (1 / 255)).astype(np.float32)
+        pixels = (pixels - self.mean) / self.std
+
+        encoding = {
+            "input_ids": torch.from_numpy(arrays["input_ids"][start:end].astype(np.int64)),
+            "attention_mask": torch.from_numpy(arrays["attention_mask"][start:end].astype(np.int64)),
+            "bbox": torch.from_numpy(arrays["bbox"][start:end].astype(np.int64)),
+            "labels": torch.from_numpy(arrays["labels"][start:end].astype(np.int64)),
+            "pixel_values": torch.from_numpy(pixels),
+        }
+
+        record = self.annotations[index]
+        words = record["data"]["tokens"]["tokens"]
+
+        map_start, map_end = int(self.doc_word_maps[index]), int(self.doc_word_maps[index + 1])
+        word_map = torch.from_numpy(np.array(arrays["word_input_ids_mapping"][map_start:map_end])).view(windows, len(words), 2)
+
+        return dict(encodings=encoding, words=words, word_input_ids_mapping=word_map,
+                    spans=record["data"]["spans"], relationships=record["data"]["relationships"], windows=windows)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
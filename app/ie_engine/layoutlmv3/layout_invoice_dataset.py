@@ -1,149 +1,246 @@
 from collections import defaultdict
 import json
 from PIL import Image
-from typing import Any, List, Tuple, Dict
+import math
+from typing import Any, Iterator, List, Sequence, Tuple, Dict
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from transformers import BatchEncoding, LayoutLMv3Processor
 from unidecode import unidecode
 
-class layout_invoice_dataset(Dataset[Tuple[torch.Tensor, torch.Tensor, str]]):
+from app.invoices_generator.utility.annotation_store import annotation_store
+from app.invoices_generator.utility.augmentation import augmentation_config, augmentation_pipeline
+from app.invoices_generator.utility.box_array import box_array
 
+class layout_invoice_dataset(Dataset[Tuple[torch.Tensor, torch.Tensor, str]]):
+    """
+    :param augmentation: Efekty naskenovaného dokumentu aplikované při každém načtení vzorku (None = obrázky tak, jak jsou uložené)
+    """
 
-    def __init__(self, data_root_folder_path:str, processor:LayoutLMv3Processor):
+    def __init__(self, data_root_folder_path:str, processor:LayoutLMv3Processor, augmentation:augmentation_config | None = None):
         
         super().__init__()
 
         self.data_root_folder_path:str = data_root_folder_path
         self.processor:LayoutLMv3Processor = processor
+        self.augmentation:augmentation_config | None = augmentation
     
 
-        metadata_path = data_root_folder_path + "/metadata.jsonl"
-        data:List[dict[str, Any]] = list()
-
-        with open(metadata_path, mode="r", encoding="utf-8") as f:
-            for line in f:
-                output:Dict[str, Any] = json.loads(line)
-                data.append(output)
-
-        self.data:List[Dict[str, Any]] = data
+        self.data:Sequence[Dict[str, Any]] = load_annotations(data_root_folder_path)
 
 
     def __len__(self) -> int:
         return len(self.data)
 
+    def sample_lengths(self) -> List[int]:
+        """
+        Odhad délky dokumentů (počet slov) pro length_grouped_batch_sampler.
+        """
+        if isinstance(self.data, annotation_store):
+            return self.data.list_lengths("tokens")
+        return [len(record["data"]["tokens"]["tokens"]) for record in self.data]
+
     def __getitem__(self, index:int)-> BatchEncoding:
         
-        image_path:str = self.data_root_folder_path + "/" +self.data[index]["file_name"]
+        record = self.data[index]
+
+        image_path:str = self.data_root_folder_path + "/" +record["file_name"]
         image = Image.open(image_path).convert("RGB")
 
-        words = self.data[index]["data"]["tokens"]["tokens"]
-        boxes = self.data[index]["data"]["tokens"]["boxes"]
-        word_labels = self.data[index]["data"]["tokens"]["tags"]
-        spans = self.data[index]["data"]["spans"]
-        relationships = self.data[index]["data"]["relationships"]
+        if self.augmentation is not None:
+            image, record = augment_invoice(self.augmentation, image, record)
 
-        #normalizace slov(NUTNÉ!!!!)...v opačném případě rozděluje slova s diakritikou na více slov a potom nesedí word_labels
-        words = [unidecode(word) for word in words]
-        
-        encoding = self.processor(image, words, boxes=boxes, word_labels=word_labels, truncation=True, stride = 128, 
-        padding="max_length", max_length=512, return_overflowing_tokens=True, return_offsets_mapping=True, return_tensors="pt")
-        #word_ids encodingu mají pro každý input_id index prvku z words ke kterému patří
+        return encode_invoice(self.processor, image, record)
+    
+def load_annotations(data_root_folder_path:str)-> Sequence[Dict[str, Any]]:
+    """
+    Anotace složky datasetu. Pokud složka obsahuje annotations-*.arrow, vrátí memory-mapovaný annotation_store,
+    jinak načte metadata.jsonl do seznamu slovníků.
+    """
+    store = annotation_store(data_root_folder_path)
+    if store.exists():
+        return store
 
-        encoding.pop('offset_mapping')
+    data:List[Dict[str, Any]] = list()
 
-        encoding.pop('overflow_to_sample_mapping')
+    with open(data_root_folder_path + "/metadata.jsonl", mode="r", encoding="utf-8") as f:
+        for line in f:
+            output:Dict[str, Any] = json.loads(line)
+            data.append(output)
 
-        windows = encoding["input_ids"].shape[0]
-        
-        input_ids      = encoding["input_ids"].tolist()          # [T_text]
-        
-        #pole dvojic (start_index, end_index) [exkluzivní] pro každé encodované slovo do pole input_ids 
-        words_subtokens_map = [[(-1,-1) for x in range(len(input_ids[b]))] for b in range(len(input_ids))] #zarovnáno na [b,512] 
-
-        for b in range(len(input_ids)):
-            word_ids = encoding.word_ids(batch_index=b)
-            gl_index = 0
-            for (index,word_id) in enumerate(word_ids):
-                if(word_id is None):
-                    continue
-                if(words_subtokens_map[b][word_id][0] == -1):
-                    words_subtokens_map[b][word_id]= (index, index)
-                    continue
-                words_subtokens_map[b][word_id] = (words_subtokens_map[b][word_id][0], index)
-
-
-        pv = encoding.get("pixel_values", None)
-        pv = torch.stack(pv, dim=0)             # [C,H,W] -> [1,C,H,W]
-        encoding["pixel_values"] = pv
-
-        encoding = pad_to_two_windows(
-            encoding,
-            pad_token_id=self.processor.tokenizer.pad_token_id,
-            ignore_index=-100
-        )
-
-        return dict(encodings=encoding, words = words, word_input_ids_mapping = words_subtokens_map,
-                    spans=spans, relationships=relationships, windows=windows)
+    return data
+
+def augment_invoice(augmentation:augmentation_config, image:Image.Image, record:Dict[str, Any])-> Tuple[Image.Image, Dict[str, Any]]:
+    """
+    Augmentuje obrázek vzorku a vrátí ho spolu s kopií záznamu, ve které jsou b-boxy tokenů a spanů
+    transformované stejně jako obrázek (původní záznam se nemění).
+    """
+    data = record["data"]
+    tokens, spans = dict(data["tokens"]), dict(data["spans"])
+
+    def transform(M) -> None:
+        w, h = image.size
+        #b-boxy tokenů jsou relativní (0-1), spanů 0-1000...stejně jako je zapisuje invoice
+        for boxes, scale in ((tokens, (1, 1)), (spans, (1000, 1000))):
+            array = box_array.from_list(boxes["boxes"], scale)
+            array.transform(M, w, h)
+            boxes["boxes"] = array.tolist()
+
+    augmented = augmentation_pipeline.shared(augmentation).apply(image, on_transform=transform)
+
+    return augmented, {**record, "data": {**data, "tokens": tokens, "spans": spans}}
+
+def encode_invoice(processor:LayoutLMv3Processor, image:Image.Image, record:Dict[str, Any])-> Dict[str, Any]:
+    """
+    Zakóduje jeden vzorek (obrázek + záznam ve tvaru řádku metadata.jsonl) pro layoutlmv3_model.
+    Sdílí ho layout_invoice_dataset i layout_invoice_shard_dataset.
+    """
+    words = record["data"]["tokens"]["tokens"]
+    boxes = record["data"]["tokens"]["boxes"]
+    word_labels = record["data"]["tokens"]["tags"]
+    spans = record["data"]["spans"]
+    relationships = record["data"]["relationships"]
+
+    #normalizace slov(NUTNÉ!!!!)...v opačném případě rozděluje slova s diakritikou na více slov a potom nesedí word_labels
+    words = [unidecode(word) for word in words]
+    
+    encoding = processor(image, words, boxes=boxes, word_labels=word_labels, truncation=True, stride = 128, 
+    padding="max_length", max_length=512, return_overflowing_tokens=True, return_offsets_mapping=True, return_tensors="pt")
+    #word_ids encodingu mají pro každý input_id index prvku z words ke kterému patří
+
+    encoding.pop('offset_mapping')
+
+    encoding.pop('overflow_to_sample_mapping')
+
+    #dtype bbox procesoru závisí na vstupních boxech (float pro neceločíselné)...model bere celočíselné pozice jako .long()
+    encoding["bbox"] = encoding["bbox"].long()
+
+    windows = encoding["input_ids"].shape[0]
     
-def pad_to_two_windows(enc, pad_token_id: int, ignore_index: int = -100):
-    """
-    Pokud má BatchEncoding tvar [1, 512, ...], doplní prázdné druhé okno tak,
-    aby vše mělo [2, 512, ...]. Pokud už má [2, 512, ...], vrátí beze změny.
-    Pokud by bylo víc než 2, vyhodí chybu.
-    """
-    s = enc["input_ids"].shape[0]
-    if s == 2:
-        return enc
-    if s > 2:
-        raise ValueError(f"max 2 okna, přišlo {s}.")
-
-    # ========== s == 1 → vytvoř prázdné druhé okno ==========
-    pad_rows = {}
-
-    # Sekvenční pole [s, 512]
-    for key in ("input_ids", "attention_mask", "token_type_ids"):
-        if key in enc:
-            row = enc[key][0].clone()
-            if key == "input_ids":
-                row[:] = pad_token_id           # samé PADy
-            else:
-                row.zero_()                      # masky/typy na nulu
-            pad_rows[key] = row.unsqueeze(0)
-
-    # BBox [s, 512, 4]
-    if "bbox" in enc:
-        row = enc["bbox"][0].clone()
-        row.zero_()
-        pad_rows["bbox"] = row.unsqueeze(0)
-
-    # Labels (NER) [s, 512] – ignorovat v lossu
-    for key in ("labels", "word_labels"):
-        if key in enc:
-            row = torch.full(enc[key].shape, ignore_index)
-            pad_rows[key] = row
-
-    # pixel_values [s, C, H, W] – duplikuj první (tvar musí sedět)
-    if "pixel_values" in enc:
-        row = enc["pixel_values"][0:1] 
-        row = row.clone()
-        pad_rows["pixel_values"] = row
-
-    # Zřetězit po první dimenzi
-    for key, pad_row in pad_rows.items():
-        enc[key] = torch.cat([enc[key], pad_row], dim=0)
-
-    return enc
-
-def collate_joint(batch: List[Dict[str, Any]]) -> Dict[str, Any]:
-    #Rozbalení a nstakování tenzorů fixní délky z encodingu
-    enc_keys = batch[0]["encodings"].keys()
-    out = {k: torch.stack([b["encodings"][k] for b in batch], dim=0) for k in enc_keys}
+    #index slova pro každý subtoken, -1 pro speciální tokeny a padding [windows, 512]
+    word_ids = torch.tensor([[-1 if word_id is None else word_id for word_id in encoding.word_ids(batch_index=b)] for b in range(windows)])
+
+    #dvojice (start_index, end_index) [včetně] pro každé encodované slovo do pole input_ids [windows, len(words), 2]
+    words_subtokens_map = word_subtoken_map(word_ids, len(words))
+
+    #procesor vrací stejný obrázek pro každé okno...ponechá se jen jednou na dokument [C,H,W]
+    encoding["pixel_values"] = encoding["pixel_values"][0]
+
+    return dict(encodings=encoding, words = words, word_input_ids_mapping = words_subtokens_map,
+                spans=spans, relationships=relationships, windows=windows)
+    
+def word_subtoken_map(word_ids:torch.Tensor, n_words:int)-> torch.Tensor:
+    """
+    Z word_ids [windows, L] spočítá pro každé slovo první a poslední pozici jeho subtokenů v každém okně.
+    Vrací int32 tenzor [windows, n_words, 2], slova, která v okně nejsou, mají (-1, -1).
+    """
+    windows, L = word_ids.shape
+
+    positions = torch.arange(L).expand(windows, L)
+    valid = word_ids >= 0
+    flat = (torch.arange(windows).unsqueeze(1) * n_words + word_ids)[valid] #index (okno, slovo) v plochém poli
+
+    first = torch.full((windows * n_words,), L, dtype=torch.long).scatter_reduce(0, flat, positions[valid], reduce="amin")
+    last = torch.full((windows * n_words,), -1, dtype=torch.long).scatter_reduce(0, flat, positions[valid], reduce="amax")
+    first[first == L] = -1
+
+    return torch.stack([first, last], dim=-1).view(windows, n_words, 2).to(torch.int32)
+
+def pad_word_subtoken_maps(maps:List[torch.Tensor])-> torch.Tensor:
+    """
+    Zarovná mapování slov na subtokeny z více dokumentů do jednoho tenzoru [B, max_windows, max_words, 2] doplněného -1.
+    """
+    windows = max(m.shape[0] for m in maps)
+    n_words = max(m.shape[1] for m in maps)
+
+    out = torch.full((len(maps), windows, n_words, 2), -1, dtype=torch.int32)
+    for b, m in enumerate(maps):
+        out[b, :m.shape[0], :m.shape[1]] = m
+    return out
+
+def collate_joint(batch: List[Dict[str, Any]], pad_token_id: int = 1, ignore_index: int = -100) -> Dict[str, Any]:
+    """
+    Spojí dokumenty s různým počtem oken do jednoho batche.
+    Okna se doplní na nejvyšší počet oken v batchi a délka okna se ořízne na nejdelší skutečný obsah (attention_mask),
+    takže krátké účtenky neplatí výpočet za 2x512 tokenů.
+
+    :param pad_token_id: Pad token tokenizéru (1 pro microsoft/layoutlmv3-base)
+    """
+    windows = max(b["encodings"]["input_ids"].shape[0] for b in batch)
+    length = max(int(b["encodings"]["attention_mask"].sum(dim=-1).max()) for b in batch)
+
+    pad_values = {"input_ids": pad_token_id, "labels": ignore_index}
+
+    #Rozbalení tenzorů z encodingu...sekvenční pole se zarovnají na [B, okna, délka, ...]
+    out: Dict[str, Any] = dict()
+    for key in batch[0]["encodings"].keys():
+        if key == "pixel_values":
+            out[key] = torch.stack([b["encodings"][key] for b in batch], dim=0) #[B, C, H, W]
+            continue
+
+        tensors = [b["encodings"][key][:, :length] for b in batch]
+        padded = tensors[0].new_full((len(batch), windows, length, *tensors[0].shape[2:]), pad_values.get(key, 0))
+        for i, t in enumerate(tensors):
+            padded[i, :t.shape[0]] = t
+        out[key] = padded
 
     #Proměnně dlouhé věci jako listy (žádný stack)
     out["words"] = [b["words"] for b in batch]
-    out["word_input_ids_mapping"] = [b["word_input_ids_mapping"] for b in batch]
+    out["word_input_ids_mapping"] = pad_word_subtoken_maps([b["word_input_ids_mapping"] for b in batch]) #[B, okna, slova, 2]
     out["spans"] = [b["spans"] for b in batch]
     out["relationships"] = [b["relationships"] for b in batch]
     out["windows"] = [b["windows"] for b in batch]
     return out
+
+
+class length_grouped_batch_sampler(Sampler[List[int]]):
+    """
+    Batch sampler, který skládá do batche dokumenty podobné délky (a tedy se stejným počtem oken).
+
+    Indexy se náhodně zamíchají, rozdělí do skupin po `batch_size * bucket_batches` dokumentech,
+    každá skupina se seřadí podle délky a rozseká na batche. Pořadí batchů se nakonec znovu zamíchá,
+    aby délka neklesala/nerostla monotónně v rámci epochy.
+
+    :param lengths: Odhad délky každého dokumentu (počet slov nebo subtokenů), viz `sample_lengths()` datasetů
+    """
+
+    def __init__(self, lengths: Sequence[int], batch_size: int, shuffle: bool = True, bucket_batches: int = 50,
+                 drop_last: bool = False, seed: int = 0):
+        self.lengths = list(lengths)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.bucket_batches = bucket_batches
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.epoch += 1 #bez set_epoch se pořadí mění každou epochu samo
+
+        indices = torch.randperm(len(self.lengths), generator=generator).tolist() if self.shuffle else list(range(len(self.lengths)))
+
+        bucket = self.batch_size * self.bucket_batches
+        batches: List[List[int]] = list()
+        for start in range(0, len(indices), bucket):
+            group = sorted(indices[start:start + bucket], key=lambda i: self.lengths[i])
+            for b in range(0, len(group), self.batch_size):
+                batches.append(group[b:b + self.batch_size])
+
+        if self.drop_last:
+            batches = [b for b in batches if len(b) == self.batch_size]
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=generator).tolist()]
+
+        return iter(batches)
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            bucket = self.batch_size * self.bucket_batches
+            full, rest = divmod(len(self.lengths), bucket)
+            return full * self.bucket_batches + rest // self.batch_size
+        return math.ceil(len(self.lengths) / self.batch_size)
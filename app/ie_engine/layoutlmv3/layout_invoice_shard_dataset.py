@@ -0,0 +1,52 @@
+import io
+from PIL import Image
+from typing import Any, Dict, Iterator, List, Tuple
+from torch.utils.data import IterableDataset
+from transformers import LayoutLMv3Processor
+
+from app.ie_engine.layoutlmv3.layout_invoice_dataset import augment_invoice, encode_invoice
+from app.ie_engine.utility.worker_split import worker_split
+from app.invoices_generator.utility.augmentation import augmentation_config
+from app.invoices_generator.utility.shards import buffer_shuffle, count_shard_samples, iter_shard_samples, list_shards, split_shards
+
+class layout_invoice_shard_dataset(IterableDataset[Dict[str, Any]]):
+    """
+    Streamovaný dataset nad tar shardy (invoice_generator s output_format=TAR).
+    Vzorky jsou stejné jako z layout_invoice_dataset, jen se čtou sekvenčně po shardech
+    místo náhodného přístupu k tisícům malých PNG.
+
+    Shardy se rozdělí mezi workery DataLoaderu. Při `shuffle=True` se každou epochu zamíchá pořadí shardů
+    a vzorky se navíc míchají v bufferu o velikosti `shuffle_buffer`. S `augmentation` se obrázky augmentují při čtení.
+    """
+
+    def __init__(self, data_root_folder_path:str, processor:LayoutLMv3Processor, shuffle:bool = False, shuffle_buffer:int = 64,
+                 augmentation:augmentation_config | None = None):
+
+        super().__init__()
+
+        self.data_root_folder_path:str = data_root_folder_path
+        self.processor:LayoutLMv3Processor = processor
+        self.shuffle:bool = shuffle
+        self.shuffle_buffer:int = shuffle_buffer
+        self.augmentation:augmentation_config | None = augmentation
+
+        self.shards:List[str] = list_shards(data_root_folder_path)
+        self._length:int = count_shard_samples(self.shards)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        worker_id, num_workers, seed = worker_split()
+
+        shards = split_shards(self.shards, worker_id, num_workers, seed if self.shuffle else None)
+
+        samples:Iterator[Tuple[str, bytes | None, Dict[str, Any]]] = iter_shard_samples(shards)
+        if self.shuffle:
+            samples = buffer_shuffle(samples, self.shuffle_buffer, seed + worker_id)
+
+        for _, image_bytes, record in samples:
+            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            if self.augmentation is not None:
+                image, record = augment_invoice(self.augmentation, image, record)
+            yield encode_invoice(self.processor, image, record)
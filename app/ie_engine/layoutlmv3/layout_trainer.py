@@ -1,19 +1,20 @@
+from functools import partial
 import re
 from PIL import Image
-from typing import Any
-import pytesseract
+from typing import Any, Dict
 import torch
 from transformers import LayoutLMv3Config, LayoutLMv3Processor,  LayoutLMv3Model
 from app.ie_engine.donut.donut_module import training_callback
 import pytorch_lightning
 
-from app.ie_engine.layoutlmv3.layout_invoice_dataset import collate_joint, layout_invoice_dataset
+from app.ie_engine.layoutlmv3.layout_inference_service import layout_inference_service
+from app.ie_engine.layoutlmv3.layout_invoice_dataset import collate_joint, layout_invoice_dataset, length_grouped_batch_sampler
 from app.ie_engine.layoutlmv3.layoutlmv3_pl_model import layoutlmv3_pl_model
 from app.invoices_generator.core.enumerates.relationship_types import relationship_types
 from app.invoices_generator.core.enumerates.token_tags import token_tags
+from app.invoices_generator.utility.augmentation import augmentation_config
 from torch.utils.data import DataLoader
 
-from pytesseract import Output
 
 class layout_trainer:
 
@@ -24,7 +25,8 @@ class layout_trainer:
         processor = LayoutLMv3Processor.from_pretrained(model_name,apply_ocr=False)
         model:LayoutLMv3Model = LayoutLMv3Model.from_pretrained(model_name)
 
-        train_dataset = layout_invoice_dataset(data_root_folder_path="app/data/train", processor=processor)
+        #train je uložený bez efektů...augmentuje se při načítání, každou epochu jinak
+        train_dataset = layout_invoice_dataset(data_root_folder_path="app/data/train", processor=processor, augmentation=augmentation_config())
 
         test_dataset = layout_invoice_dataset(data_root_folder_path="app/data/test", processor=processor)
 
@@ -36,8 +38,13 @@ class layout_trainer:
         # for k,v in encoding.items():
         #     print(k, v.shape)
 
-        train_dataloader:DataLoader = DataLoader(train_dataset, batch_size=4, shuffle=False, num_workers=4, collate_fn=collate_joint)
-        val_dataloader:DataLoader = DataLoader(test_dataset, batch_size=1, shuffle=False, num_workers=4, collate_fn=collate_joint)
+        collate = partial(collate_joint, pad_token_id=processor.tokenizer.pad_token_id)
+
+        #batche z dokumentů podobné délky...méně oken a tokenů doplněných jen kvůli nejdelšímu dokumentu v batchi
+        train_sampler = length_grouped_batch_sampler(train_dataset.sample_lengths(), batch_size=4)
+
+        train_dataloader:DataLoader = DataLoader(train_dataset, batch_sampler=train_sampler, num_workers=4, collate_fn=collate)
+        val_dataloader:DataLoader = DataLoader(test_dataset, batch_size=1, shuffle=False, num_workers=4, collate_fn=collate)
 
         module = layoutlmv3_pl_model(len(token_tags), len(relationship_types), model)
 
@@ -60,36 +67,15 @@ class layout_trainer:
 
         trainer.fit(module, train_dataloaders=train_dataloader, val_dataloaders=val_dataloader)
 
-    def predict(img: Image)->Any:
-        model_name:str = "microsoft/layoutlmv3-base" 
-        
-        
-        processor = LayoutLMv3Processor.from_pretrained(model_name,apply_ocr=False)
-        model:LayoutLMv3Model = LayoutLMv3Model.from_pretrained(model_name)
-
-        lang = 'ces'
-
-        # If you don't have tesseract executable in your PATH, include the following:
-        pytesseract.pytesseract.tesseract_cmd = r'E:\user\plocha\BP\packages\tesseract.exe'
-        # Example tesseract_cmd = r'C:\Program Files (x86)\Tesseract-OCR\tesseract'
-        # Simple image to string
-        
-        width, height = img.size
-
-        data = pytesseract.image_to_data(img, lang=lang, output_type=Output.DICT)
-        
-        bbox = [(l/width*1000,t/height*1000,(l+w)/width*1000,(t+h)/height*1000)  for l,t,w,h,c in zip(data["left"], data["top"], data["width"], data["height"], data["conf"]) if c != -1 and c > 40]
-        text = [t  for t,c in zip(data["text"], data["conf"]) if c != -1 and c > 40]
-        
-        bbox = bbox[:130] #130 tokenů je maximum
-        text = text[:130]
-
-        encoding = processor(img, text, boxes=bbox, return_tensors="pt")
-
-        module = layoutlmv3_pl_model(len(token_tags), model)
+    _services: Dict[str | None, layout_inference_service] = dict()
 
-        outputs =  module(encoding)
+    @staticmethod
+    def predict(img: Image.Image, checkpoint_path: str | None = None)->Any:
+        #služba se pro každý checkpoint načte jen při prvním volání...další volání už nenačítají procesor ani váhy
+        service = layout_trainer._services.get(checkpoint_path)
+        if service is None:
+            service = layout_trainer._services[checkpoint_path] = layout_inference_service(checkpoint_path)
 
-        predictions = outputs['logits'].argmax(-1)
-        true_predictions, _ = module.get_labels(predictions)
-        print(true_predictions)
\ No newline at end of file
+        result = service.extract(img)
+        print(result)
+        return result
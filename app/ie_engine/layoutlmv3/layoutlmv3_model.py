@@ -6,9 +6,10 @@ from app.ie_engine.layoutlmv3.span_pooler import span_pooler
 
 class layoutlmv3_model(nn.Module):
     
-    def __init__(self, num_classes:int, num_relationships:int, model: LayoutLMv3Model):
+    def __init__(self, num_classes:int, num_relationships:int, model: LayoutLMv3Model, share_visual_embeddings:bool = True):
         super().__init__()
         self.model = model
+        self.share_visual_embeddings = share_visual_embeddings #obrazové embeddingy se počítají jednou na dokument a sdílí je všechna okna
         hidden_dim = self.model.config.hidden_size
         self.ner_layer = nn.Sequential(nn.Linear(in_features = hidden_dim,
                                                 out_features = hidden_dim),
@@ -23,58 +24,111 @@ class layoutlmv3_model(nn.Module):
         
 
 
+    def _forward_shared_image(self, pixel_values:torch.Tensor, window_doc:torch.Tensor, input_ids:torch.Tensor,
+                              bbox:torch.Tensor, attention_mask:torch.Tensor):
+        """
+        Průchod LayoutLMv3 nad okny s obrazovými embeddingy spočítanými jednou na dokument.
+        Skládá vstup enkodéru stejně jako LayoutLMv3Model.forward (text + obraz, LayerNorm, dropout),
+        jen obrazové embeddingy dokumentů rozkopíruje do jejich oken místo počítání pro každé okno.
+        """
+        model = self.model
+        W, L = input_ids.shape
+        device = input_ids.device
+
+        text = model.embeddings(input_ids=input_ids, bbox=bbox,
+                                token_type_ids=torch.zeros_like(input_ids))              # [počet oken, L, H]
+        visual = model.forward_image(pixel_values)[window_doc]                          # [počet oken, 1+patche, H]
+        V = visual.size(1)
+
+        embedding_output = model.dropout(model.LayerNorm(torch.cat([text, visual], dim=1)))
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones(W, V)], dim=1)
+
+        final_bbox = final_position_ids = None
+        if model.config.has_spatial_attention_bias:
+            final_bbox = torch.cat([bbox, model.calculate_visual_bbox(device, dtype=torch.long, batch_size=W)], dim=1)
+        if model.config.has_relative_attention_bias:
+            final_position_ids = torch.cat([torch.arange(L, device=device).expand(W, L),
+                                            torch.arange(V, device=device).expand(W, V)], dim=1)
+
+        extended_attention_mask = model.get_extended_attention_mask(attention_mask, attention_mask.shape,
+                                                                    dtype=embedding_output.dtype)
+
+        return model.encoder(embedding_output,
+                             bbox=final_bbox,
+                             position_ids=final_position_ids,
+                             attention_mask=extended_attention_mask,
+                             head_mask=model.get_head_mask(None, model.config.num_hidden_layers),
+                             return_dict=True,
+                             patch_height=pixel_values.size(2) // model.config.patch_size,
+                             patch_width=pixel_values.size(3) // model.config.patch_size)
+
     def forward(self, batch:dict[str, any], training:bool = True):
+        outputs_list, ner_BP = self.encode(batch)
+        return {"ner_logits": ner_BP, **self.relate(batch, outputs_list, training)}
+
+    def encode(self, batch:dict[str, any]):
+        """
+        Průchod LayoutLMv3 a NER hlavou. Vrací (skryté stavy po dokumentech [P, L, H], ner logity [B, P, L, num_classes]).
+        Při inferenci se spany teprve odvozují z NER, proto jde tahle část volat samostatně.
+        """
         input_ids = batch['input_ids'].long()
         bbox = batch['bbox'].long()
         pixel_values = batch['pixel_values'].float()
         attention_mask = batch['attention_mask'].long()
-        spans = batch["spans"]
-        words = batch["words"]
-        word_input_ids_mapping = batch["word_input_ids_mapping"]
 
         B = input_ids.size(0)
         P = input_ids.size(1) #počet dílů na kolik byl dokument rozdělen...počet oken
 
-        outputs = list()
-        ner_tags = list()
+        #všechna okna všech dokumentů jako jeden batch [B*P, ...]...prázdná okna (doplněná v collate_joint) se do modelu neposílají
+        at_msk = attention_mask.flatten(0, 1)
+        keep = at_msk.any(dim=-1)
 
-        for p in range(P):
+        #obrázek je jednou na dokument [B, C, H, W]...index dokumentu pro každé ponechané okno
+        if pixel_values.dim() == 5:
+            pixel_values = pixel_values[:, 0]
+        window_doc = torch.arange(B, device=keep.device).repeat_interleave(P)[keep]
 
-            px_val = pixel_values[:, p, :, :, :]
-            
-            inpt_ids = input_ids[:, p, :]
-            
-            bbx = bbox[:,p,:,:]
-            
-            at_msk = attention_mask[:,p,:]
+        window_inputs = dict(input_ids=input_ids.flatten(0, 1)[keep],
+                             bbox=bbox.flatten(0, 1)[keep],
+                             attention_mask=at_msk[keep])
 
-            output = self.model(input_ids=inpt_ids,
-                        bbox=bbx,
-                        pixel_values=px_val,
-                        attention_mask=at_msk).last_hidden_state[:, :512, :]  ## output má rozměry [batch_size, 709, 768], 
-                                                                                                    ## 709 = 512 vektorů pro jednotlivé subtokeny a 197 pro obraz
-            
-            #B,512, num_classes
-            ner = self.ner_layer(output)
+        if self.share_visual_embeddings:
+            output = self._forward_shared_image(pixel_values, window_doc, **window_inputs)
+        else:
+            output = self.model(pixel_values=pixel_values[window_doc], **window_inputs)
 
-            outputs.append(output)
-            ner_tags.append(ner) #2, B, 512, 768
+        L = input_ids.size(2) #délka okna (po oříznutí v collate_joint nejvýše 512)
+        output = output.last_hidden_state[:, :L, :]  ## output má rozměry [počet oken, L+197, 768], 
+                                                     ## L vektorů pro jednotlivé subtokeny a 197 pro obraz
 
-        outputs_BP = torch.stack(outputs, dim=1)
+        #rozházení zpět na [B, P, L, H]...vynechaná okna mají nuly
+        outputs_BP = output.new_zeros(B * P, *output.shape[1:])
+        outputs_BP[keep] = output
+        outputs_BP = outputs_BP.view(B, P, *output.shape[1:])
         outputs_list = list(outputs_BP.unbind(dim=0)) #list prvků batche, kde každý prvek batche obsahuje všechny svoje části rozsekané kvůli maximální délce 512 tokenů
 
-        ner_BP = torch.stack(ner_tags, dim=1) #B, 2,512,768
-        ner_list = list(ner_BP.unbind(dim=0))    
+        #B, P, L, num_classes
+        ner = self.ner_layer(output)
+        ner_BP = ner.new_zeros(B * P, *ner.shape[1:])
+        ner_BP[keep] = ner
+        ner_BP = ner_BP.view(B, P, *ner.shape[1:])
+
+        return outputs_list, ner_BP
 
+    def relate(self, batch:dict[str, any], outputs_list:list[torch.Tensor], training:bool = True):
+        """
+        Pooling spanů z batch["spans"] a klasifikace vztahů mezi kandidátními páry.
+        """
         spans = self.span_pooler(batch, outputs_list, training)
             
         # return {
-        #     #P je počet párů spanů v dokumentu, 
+        #     #P je počet párů spanů v celém batchi, 
         #     #S_kept je počet ponechaných spanů,
         #     #H je rozěr output vektoru layoutlmv3 pro jeden subtoken
-        #     "pairs": pairs_per_doc,                # list [P, 2*(3*H)]
+        #     "pairs": pairs,                        # [P, 2*(3*H)]
+        #     "pair_doc_offsets": pair_doc_offsets,  # [B+1]
         #     "pair_indices": pair_indices_per_doc,  # list (i, j)  obsahuje indexy tvořící pár
-        #     "pair_labels": pair_labels_per_doc,    # list [P] obsahuje labely pro dané páry
+        #     "pair_labels": pair_labels,            # [P] obsahuje labely pro dané páry
 
         #     "span_reprs": span_reprs_per_doc,      # list [S_kept, 3H]
         #     "span_tags": kept_tags_per_doc,        # list list[int]
@@ -83,18 +137,11 @@ class layoutlmv3_model(nn.Module):
         #     "kept2origin": kept2origin_per_doc,    # list dict
         # }
 
-        rels = list()
-
-        #PAIRS_PER_DOC MÁ ROZMĚRY [POČET DVOJIC, 2*2304]
-        for pair in spans["pairs_per_doc"]:
-            if pair is not None:
-                rel = self.re_layer(pair) #output má rozměry [počet dvojic, 3]
-                rels.append(rel)
-            else:
-                rels.append(None)
+        #PAIRS MÁ ROZMĚRY [POČET DVOJIC V BATCHI, 2*2304]...jedno volání pro všechny dokumenty
+        rels = self.re_layer(spans["pairs"]) #output má rozměry [počet dvojic, 3]
 
-        return {"ner_logits": ner_BP,
-                "rel_logits": rels,
+        return {"rel_logits": rels,
                 "rel_labels": spans["pair_labels"],
+                "rel_doc_offsets": spans["pair_doc_offsets"],
                 "rel_pair_indices": spans["pair_indices"],
                 "rel_span_words": spans["pair_words_per_doc"]}
\ No newline at end of file
@@ -1,30 +1,35 @@
-import evaluate
+import numpy as np
 import pytorch_lightning
 import torch
 import torch.nn.functional as F
 from transformers import LayoutLMv3Model
 
 
+from app.ie_engine.layoutlmv3.entity_f1_accumulator import entity_f1_accumulator
 from app.ie_engine.layoutlmv3.layoutlmv3_model import layoutlmv3_model
 from app.invoices_generator.core.enumerates.relationship_types import relationship_types
 from app.invoices_generator.core.enumerates.token_tags import token_tags
 
 class layoutlmv3_pl_model(pytorch_lightning.LightningModule):
 
-    def __init__(self, ner_classes:int, re_classes:int ,model:LayoutLMv3Model, lr = 1e-4):
+    def __init__(self, ner_classes:int, re_classes:int ,model:LayoutLMv3Model, lr = 1e-4, share_visual_embeddings:bool = True, metric_interval:int = 50):
 
         super(layoutlmv3_pl_model, self).__init__()
         self.save_hyperparameters()
 
-        self.model = layoutlmv3_model(ner_classes, re_classes,model)
+        self.model = layoutlmv3_model(ner_classes, re_classes,model, share_visual_embeddings)
 
-        ## Metrics
-        self.train_metric = evaluate.load("seqeval")
-        self.val_metric = evaluate.load("seqeval")
+        ## Metrics...průběžné počty entit, F1 se loguje jen každých metric_interval kroků a na konci epochy
+        self.train_metric = entity_f1_accumulator()
+        self.val_metric = entity_f1_accumulator()
 
         ## Parameters
         self.lr = lr
         self.ner_classes = ner_classes
+        self.metric_interval = metric_interval
+
+        #převod id tagu na text jedním indexováním (pořadí jako list(token_tags))
+        self.tag_names = np.array([tag.text for tag in token_tags])
 
     def forward(self, batch):
         return self.model(batch)
@@ -38,33 +43,24 @@ class layoutlmv3_pl_model(pytorch_lightning.LightningModule):
         outputs = self.model(batch)
         ##výsledky a vypočítání ztráty
         predictions = outputs['ner_logits']
-        predictions = torch.reshape(predictions, [predictions.shape[0], predictions.shape[1]*predictions.shape[2], predictions.shape[3]]) #[Batch, 1024, 37] ... [batch, 2*512, 37]
+        predictions = torch.reshape(predictions, [predictions.shape[0], predictions.shape[1]*predictions.shape[2], predictions.shape[3]]) #[Batch, okna*L, 37]
         
         predictions_ids = outputs['ner_logits'].argmax(-1)
-        predictions_ids = torch.reshape(predictions_ids, [predictions_ids.shape[0], predictions_ids.shape[1]*predictions_ids.shape[2]]) #[Batch, 1024] ... [batch, 2*512]
+        predictions_ids = torch.reshape(predictions_ids, [predictions_ids.shape[0], predictions_ids.shape[1]*predictions_ids.shape[2]]) #[Batch, okna*L]
 
         labels = batch["labels"]
-        labels = torch.reshape(labels, [labels.shape[0], labels.shape[1]*labels.shape[2]]) #[Batch, 1024] ... [batch, 2*512]
-
-        rel_predictions = outputs["rel_logits"]
-        rel_predictions = [rel for rel in rel_predictions if rel is not None]
-        if(len(rel_predictions)>0):
-            rel_predictions_flat = torch.cat(rel_predictions)
+        labels = torch.reshape(labels, [labels.shape[0], labels.shape[1]*labels.shape[2]]) #[Batch, okna*L]
 
-        rel_predictions = [rel.argmax(-1) for rel in rel_predictions]
-
-        rel_labels = outputs["rel_labels"]
-        rel_labels = [torch.tensor(rel_label, device=rel_predictions_flat.device) for rel_label in rel_labels if rel_label is not None]
-        if(len(rel_labels)>0):
-            rel_labels_flat = torch.cat(rel_labels)
+        #páry všech dokumentů batche za sebou [P, 3] a [P]
+        rel_predictions_flat = outputs["rel_logits"]
+        rel_labels_flat = outputs["rel_labels"]
 
         true_predictions, true_labels = self.get_labels(predictions_ids, labels)
 
         ## Logging Purpose
-        self.train_metric.add_batch(references=true_labels, predictions=true_predictions)
-        results = self.train_metric.compute()
+        self.train_metric.update(true_predictions, true_labels)
         loss_ner = F.cross_entropy(predictions.view(-1, self.ner_classes), labels.view(-1)) #musí mít tvar INPUT: [B, C] nebo [C], TARGET: [B]
-        if(torch.is_tensor(rel_labels_flat) and torch.is_tensor(rel_predictions_flat)):
+        if(rel_labels_flat.numel() > 0):
             loss_re = F.cross_entropy(rel_predictions_flat ,rel_labels_flat) #musí mít tvar INPUT: [B, C] nebo [C], TARGET: [B]
         else:
             loss_re = 0
@@ -72,59 +68,55 @@ class layoutlmv3_pl_model(pytorch_lightning.LightningModule):
         loss = loss_ner + loss_re
 
         self.log("train_loss", loss.item(), prog_bar = True)
-        self.log("train_overall_fl", results["overall_f1"], prog_bar = True)
-        self.log("train_overall_recall", results["overall_recall"], prog_bar = True)
-        self.log("train_overall_precision", results["overall_precision"], prog_bar = True)
+
+        if self.metric_interval and (batch_idx + 1) % self.metric_interval == 0:
+            self._log_metric("train", self.train_metric)
 
         return loss
 
+    def on_train_epoch_end(self):
+        self._log_metric("train", self.train_metric)
+        self.train_metric.reset()
+
     def validation_step(self, batch, batch_idx):    
         ## Forward Propagatipn
         outputs = self.model(batch)
         ##výsledky a vypočítání ztráty
         predictions = outputs['ner_logits']
-        predictions = torch.reshape(predictions, [predictions.shape[0], predictions.shape[1]*predictions.shape[2], predictions.shape[3]]) #[Batch, 1024, 37] ... [batch, 2*512, 37]
+        predictions = torch.reshape(predictions, [predictions.shape[0], predictions.shape[1]*predictions.shape[2], predictions.shape[3]]) #[Batch, okna*L, 37]
         
         predictions_ids = outputs['ner_logits'].argmax(-1)
-        predictions_ids = torch.reshape(predictions_ids, [predictions_ids.shape[0], predictions_ids.shape[1]*predictions_ids.shape[2]]) #[Batch, 1024] ... [batch, 2*512]
+        predictions_ids = torch.reshape(predictions_ids, [predictions_ids.shape[0], predictions_ids.shape[1]*predictions_ids.shape[2]]) #[Batch, okna*L]
 
         labels = batch["labels"]
-        labels = torch.reshape(labels, [labels.shape[0], labels.shape[1]*labels.shape[2]]) #[Batch, 1024] ... [batch, 2*512]
-
-        rel_predictions = outputs["rel_logits"]
-        rel_predictions = [rel for rel in rel_predictions if rel is not None]
-        rel_predictions_flat = None
-        if(len(rel_predictions)>0):
-            rel_predictions_flat = torch.cat(rel_predictions)
-
-        rel_predictions = [rel.argmax(-1) for rel in rel_predictions]
+        labels = torch.reshape(labels, [labels.shape[0], labels.shape[1]*labels.shape[2]]) #[Batch, okna*L]
 
-        rel_labels = outputs["rel_labels"]
-        rel_labels = [torch.tensor(rel_label, device=rel_predictions_flat.device) for rel_label in rel_labels if rel_label is not None]
-        
-        rel_labels_flat = None
-        if(len(rel_labels)>0):
-            rel_labels_flat = torch.cat(rel_labels)
+        #páry všech dokumentů batche za sebou [P, 3] a [P]
+        rel_predictions_flat = outputs["rel_logits"]
+        rel_labels_flat = outputs["rel_labels"]
 
         true_predictions, true_labels = self.get_labels(predictions_ids, labels)
 
         if(batch_idx%10 == 0):
+            rel_offsets = outputs["rel_doc_offsets"].tolist()
+            rel_predictions_ids = rel_predictions_flat.argmax(-1).tolist()
+            rel_labels_ids = rel_labels_flat.tolist()
+
             for b in range(len(batch["words"])):
                 for word, prediction, label in zip(batch["words"][b], true_predictions[b], true_labels[b]):
                     print(f"Text: {word} | Predikce: {prediction} | Label: {label}")
                 
                 print("***********************VZTAHY***************************")
 
-                for pair_index, (x_id, y_id) in enumerate(outputs["rel_pair_indices"][b]):
-                    print(f"Span A: {outputs['rel_span_words'][b][x_id]} | Span B: {outputs['rel_span_words'][b][y_id]} | Predikce:{list(relationship_types)[rel_predictions[b][pair_index]]}| Label: {list(relationship_types)[rel_labels[b][pair_index]]}")
+                for pair_index, (x_id, y_id) in enumerate(outputs["rel_pair_indices"][b], start=rel_offsets[b]):
+                    print(f"Span A: {outputs['rel_span_words'][b][x_id]} | Span B: {outputs['rel_span_words'][b][y_id]} | Predikce:{list(relationship_types)[rel_predictions_ids[pair_index]]}| Label: {list(relationship_types)[rel_labels_ids[pair_index]]}")
                 print("===========================KONEC===========================")
 
         ## Logging Purpose
-        self.val_metric.add_batch(references=true_labels, predictions=true_predictions)
-        results = self.val_metric.compute()
+        self.val_metric.update(true_predictions, true_labels)
 
         loss_ner = F.cross_entropy(predictions.view(-1, self.ner_classes), labels.view(-1)) #musí mít tvar INPUT: [B, C] nebo [C], TARGET: [B]
-        if(rel_labels_flat is not None and rel_predictions_flat is not None and torch.is_tensor(rel_labels_flat) and torch.is_tensor(rel_predictions_flat)):
+        if(rel_labels_flat.numel() > 0):
             loss_re = F.cross_entropy(rel_predictions_flat ,rel_labels_flat) #musí mít tvar INPUT: [B, C] nebo [C], TARGET: [B]
         else:
             loss_re = 0
@@ -132,55 +124,36 @@ class layoutlmv3_pl_model(pytorch_lightning.LightningModule):
         loss = loss_ner + loss_re
 
         self.log("val_loss", loss.item(), prog_bar = True)
-        self.log("val_overall_fl", results["overall_f1"], prog_bar = True)
-        self.log("val_overall_recall", results["overall_recall"], prog_bar = True)
-        self.log("val_overall_precision", results["overall_precision"], prog_bar = True)
 
         return loss
 
+    def on_validation_epoch_end(self):
+        self._log_metric("val", self.val_metric)
+        self.val_metric.reset()
+
+    def _log_metric(self, prefix:str, metric:entity_f1_accumulator):
+        results = metric.compute()
+        self.log(f"{prefix}_overall_fl", results["overall_f1"], prog_bar = True)
+        self.log(f"{prefix}_overall_recall", results["overall_recall"], prog_bar = True)
+        self.log(f"{prefix}_overall_precision", results["overall_precision"], prog_bar = True)
+
 
     def get_labels(self, predictions:any, references:any = None):
 
         # Transform predictions and references tensors to numpy arrays
-        if predictions.device.type == "cpu":
-            y_pred = predictions.detach().clone()
-            if references is not None:
-                y_true = references.detach().clone()
-            else:
-                y_true = None
-        else:
-            y_pred = predictions.detach().cpu().clone()
-            if references is not None:
-                y_true = references.detach().cpu().clone()
-            else:
-                y_true = None
+        y_pred = predictions.detach().cpu().numpy()
+        y_true = references.detach().cpu().numpy() if references is not None else None
 
         # true_predictions: když máme y_true, filtrujeme podle -100, jinak bereme celé
         if y_true is not None:
-            true_predictions = list()
-            true_labels = list()
-
-
-            for pred, gold_label in zip(y_pred, y_true):
-                true_predictions_document = list()
-                for (p, l) in zip(pred, gold_label):
-                    if l != -100:
-                        true_predictions_document.append(list(token_tags)[p].text)
-                true_predictions.append(true_predictions_document)
+            valid = y_true != -100
 
-            for pred, gold_label in zip(y_pred, y_true):
-                true_labels_document = list()
-                for (p, l) in zip(pred, gold_label):
-                    if l != -100:
-                        true_labels_document.append(list(token_tags)[l].text)
-                true_labels.append(true_labels_document)
-            
+            true_predictions = [self.tag_names[pred[mask]].tolist() for pred, mask in zip(y_pred, valid)]
+            true_labels = [self.tag_names[gold[mask]].tolist() for gold, mask in zip(y_true, valid)]
 
             return true_predictions, true_labels
         else:
-            true_predictions = [
-                [list(token_tags)[p].text for p in pred] for pred in y_pred
-            ]
+            true_predictions = [self.tag_names[pred].tolist() for pred in y_pred]
             return true_predictions, None
     
 
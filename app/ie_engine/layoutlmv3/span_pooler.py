@@ -19,8 +19,9 @@ class span_pooler(nn.Module):
             "token_indices": List[List[int]]      # word-level token indexy tvořící span (v pořadí)
         }
         batch["words"][b]: List[str]              # nepovinné
-        batch["word_input_ids_mapping"][b]: List[Tuple[int,int]]
-            # mapping slovo -> (start_subtok, end_subtok), včetně obou krajů
+        batch["word_input_ids_mapping"]: Tensor [B, okna, slova, 2]
+            # mapping slovo -> (start_subtok, end_subtok) v každém okně, včetně obou krajů, (-1,-1) mimo okno
+        batch["windows"][b]: int                  # skutečný počet oken dokumentu
         batch["relationships"][b]: {
             "span_index_a": List[int],            # originální indexy (před filtrem)
             "span_index_b": List[int],
@@ -34,11 +35,18 @@ class span_pooler(nn.Module):
         self.hidden_size = hidden_size  # jen informativní; nevyžadováno
 
     @staticmethod
-    def _span_subtoken_range(token_indices: List[int], word_to_subtok: List[List[Tuple[int, int]]]) -> List[tuple[int, int]]:
+    def _pool_spans(hidden: torch.Tensor, word_to_subtok: torch.Tensor, windows: torch.Tensor,
+                    span_doc: torch.Tensor, token_word: torch.Tensor, token_span: torch.Tensor) -> torch.Tensor:
         """
-        Z word-level tokenů ve spanu spočítá globální (min_start, max_end) rozsah subtokénů.
-        Vrací (start, end) včetně obou hran.
-        Musí vracet start a end pro každou stránku
+        Pooling všech spanů batche najednou: [first ⊕ mean ⊕ last] přes subtokény spanu.
+
+        hidden: Tensor [B, S, L, H]  (S=počet oken, L=délka okna, H=dim)
+        word_to_subtok: Tensor [B, S, N, 2] mapování slovo -> (start_subtok, end_subtok) v okně, (-1,-1) mimo okno
+        windows: Tensor [B] skutečný počet oken dokumentů
+        span_doc: Tensor [K] dokument každého spanu
+        token_word, token_span: Tensor [T] slova všech spanů za sebou (v pořadí) a index spanu, ke kterému patří
+
+        Vrací: Tensor [K, 3H], span bez slov má nuly
         """
 
         #token indices obsahuje...kdyz mam slovo Čechova tak se rozpadne v DATECH uměle(nikoliv v encoderu) na Čech ova...token indices tedy obsahuje číslo
@@ -46,66 +54,64 @@ class span_pooler(nn.Module):
         # word_to_subtok na místě 177 má dvojici (s,e) kde s znamená, kde Čech začíná v input_ids a také v hidden layeru layoutlmv3
         # to samé platí i pro index 181  
 
-        if not token_indices:
-            return list()  # prázdný rozsah (start > end)
-        ranges = [] #indexy jsou jednotlivé stránky...(start, end)
-        for t in token_indices:
-            s,e = -1,-1
-            for wts_index in range(len(word_to_subtok)):
-                s,e = word_to_subtok[wts_index][t]
-                if(s != -1 and e != -1):
-                    break
-            while(wts_index >= len(ranges)):
-                ranges.append([])
-            ranges[wts_index].append((s,e))
-
-        return ranges
-
-    @staticmethod
-    def _pool_span_hidden(hidden: torch.Tensor, ranges: List[tuple[int, int]]) -> torch.Tensor:
-        """
-        hidden: Tensor [S, L, H]  (S=počet oken, L=délka okna, H=dim)
-        start, end: globální tokenové indexy přes S*L (end včetně)
-        window_len: očekávaná délka okna (default 512); pokud nesedí, vezme se L z hidden
-
-        Vrací: Tensor [3H] = [first ⊕ mean ⊕ last]
-        """
-
-        S, L, H = hidden.shape
-        # neplatný rozsah → nuly
-
-        if len(ranges) <= 0:
-            return hidden.new_zeros(3 * H)
-        
-        start = None
-
-        for page_index, page in enumerate(ranges):
-            if(len(page) == 0):
-                continue
-            else:
-                start = (page_index,ranges[page_index][0][0])
-
-        #SPANY
-        end = (len(ranges)-1,ranges[-1][-1][1])#index posledního subtokenu posledního slova
-
-        # first/last
-        first = hidden[start[0], start[1]]        # [H]
-        last  = hidden[end[0], end[1]]        # [H]
-
-        
-        parts = []
-
-
-        #průměr přes všechny slova
-        for page_index, page in enumerate(ranges):
-            for word_start_id, word_end_id in page:
-                for id in range(word_start_id, word_end_id+1):
-                    parts.append(hidden[page_index, id])
-        
-        seg = torch.stack(parts, dim=0)                        # [M, H]
-        mean = seg.mean(dim=0)
-
-        return torch.cat([first, mean, last], dim=-1)                # [3H]
+        B, S, L, H = hidden.shape
+        K = span_doc.size(0)
+        T = token_word.size(0)
+        device = hidden.device
+
+        out = hidden.new_zeros(K, 3 * H)
+        if T == 0:
+            return out
+
+        token_doc = span_doc[token_span]                                    # [T]
+        token_pos = torch.arange(T, device=device)
+
+        #slovo patří do prvního okna, ve kterém je...pokud není v žádném, bere se poslední okno dokumentu s (-1,-1)
+        subtok = word_to_subtok[token_doc, :, token_word].long()            # [T, S, 2]
+        found = (subtok != -1).all(dim=-1)                                  # [T, S]
+        page = torch.where(found.any(dim=1), found.int().argmax(dim=1), windows[token_doc] - 1)
+        bounds = subtok[token_pos, page]                                    # [T, 2]
+
+        # first/last...první slovo a poslední slovo na poslední stránce spanu
+        span_page = torch.full((K,), -1, dtype=torch.long, device=device).scatter_reduce(0, token_span, page, reduce="amax")
+        on_last_page = page == span_page[token_span]
+        first_token = torch.full((K,), T, dtype=torch.long, device=device).scatter_reduce(
+            0, token_span, torch.where(on_last_page, token_pos, T), reduce="amin")
+        last_token = torch.full((K,), -1, dtype=torch.long, device=device).scatter_reduce(
+            0, token_span, torch.where(on_last_page, token_pos, -1), reduce="amax")
+
+        has_tokens = last_token >= 0
+        first_token, last_token = first_token[has_tokens], last_token[has_tokens]
+        doc, last_page = span_doc[has_tokens], span_page[has_tokens]
+
+        #(-1,-1) ukazuje na poslední subtoken okna (stejně jako záporný index)
+        first = hidden[doc, last_page, bounds[first_token, 0] % L]          # [K', H]
+        last = hidden[doc, last_page, bounds[last_token, 1] % L]            # [K', H]
+
+        #průměr přes všechny subtokeny spanu...v pořadí stránka, slovo, subtoken
+        order = torch.sort(token_span * S + page, stable=True).indices
+        lengths = bounds[order, 1] - bounds[order, 0] + 1                   # [T]
+        element_token = torch.repeat_interleave(order, lengths)             # [E]
+        token_offsets = torch.cumsum(lengths, dim=0) - lengths
+        element_offset = torch.arange(element_token.size(0), device=device) - torch.repeat_interleave(token_offsets, lengths)
+        element_sub = (bounds[element_token, 0] + element_offset) % L
+        element_span = token_span[element_token]
+
+        element_vectors = hidden[token_doc[element_token], page[element_token], element_sub]  # [E, H]
+
+        counts = torch.bincount(element_span, minlength=K)                  # [K]
+        span_offsets = torch.cumsum(counts, dim=0) - counts
+
+        #segment-mean po skupinách spanů se stejným počtem subtokenů...[K_m, m, H].sum(1) sčítá ve stejném pořadí jako mean nad [m, H]
+        mean = hidden.new_zeros(K, H)
+        for m in torch.unique(counts[has_tokens]).tolist():
+            group = torch.nonzero(counts == m).squeeze(1)
+            elements = span_offsets[group].unsqueeze(1) + torch.arange(m, device=device)   # [K_m, m]
+            mean[group] = element_vectors[elements].sum(dim=1) / m
+        mean = mean[has_tokens]
+
+        out[has_tokens] = torch.cat([first, mean, last], dim=-1)            # [K', 3H]
+        return out
 
 
     def forward(self, batch: Dict[str, Any], layoutlmv3_output: List[torch.Tensor], training: bool = True):
@@ -122,106 +128,108 @@ class span_pooler(nn.Module):
         origin2kept_per_doc: List[Dict[int, int]] = []
         kept2origin_per_doc: List[Dict[int, int]] = []
 
-        # Filtr a pooling spanů
+        #ploché indexy ponechaných spanů celého batche
+        span_doc: List[int] = []
+        token_word: List[int] = []
+        token_span: List[int] = []
+        origin_to_global: List[int] = [] #originální span (přes celý batch) -> index ponechaného spanu v batchi, -1 pokud se zahodil
+        origin_offsets: List[int] = []
+
+        # Filtr spanů
         for b in range(B):
             tags_b: List[int] = spans[b]["tags"]
             tokidx_b: List[List[int]] = spans[b]["token_indices"]
-            w2s_b: List[Tuple[int, int]] = word_input_ids_mapping[b]
-            hidden_b: torch.Tensor = layoutlmv3_output[b]   # [počet oken,L_b, H]
 
-            keep_mask = [t in self.allowed_span_types for t in tags_b]
-            kept_reprs: List[torch.Tensor] = []
             kept_tags: List[int] = []
             kept_spans: List[str] = []
 
             o2k: Dict[int, int] = {}
             k2o: Dict[int, int] = {}
 
+            origin_offsets.append(len(origin_to_global))
+
             k = 0
-            for i, keep in enumerate(keep_mask):
-                if not keep:
+            for i, tag in enumerate(tags_b):
+                if tag not in self.allowed_span_types:
+                    origin_to_global.append(-1)
                     continue
-                ranges = self._span_subtoken_range(tokidx_b[i], w2s_b)
-                span_vec = self._pool_span_hidden(hidden_b, ranges)
-                kept_reprs.append(span_vec)
-                kept_tags.append(tags_b[i])
+                origin_to_global.append(len(span_doc))
+                token_word.extend(tokidx_b[i])
+                token_span.extend([len(span_doc)] * len(tokidx_b[i]))
+                span_doc.append(b)
+                kept_tags.append(tag)
                 kept_spans.append(' '.join([batch["words"][b][idx] for idx in tokidx_b[i]]))
                 o2k[i] = k
                 k2o[k] = i
                 k += 1
 
-            if kept_reprs:
-                span_reprs_per_doc.append(torch.stack(kept_reprs, dim=0))  # [S_kept, 3H]
-            else:
-                span_reprs_per_doc.append(None)
-                
-            # else:
-            #     span_reprs_per_doc.append(torch.zeros(0, 3 * H, device=device))
             kept_spans_per_doc.append(kept_spans)
             kept_tags_per_doc.append(kept_tags)
             origin2kept_per_doc.append(o2k)
             kept2origin_per_doc.append(k2o)
 
-        
-        #Generování kandidátních párů: (cokoli != percentage) -> (percentage)
-        pair_indices_per_doc: List[tuple[int, int]] = []
-        pair_labels_per_doc: List[tuple[int, int]] = []
-
-        for b in range(B):
-            tags = kept_tags_per_doc[b]
-            S = len(tags)
-            if S == 0:
-                pair_indices_per_doc.append(None)
-                pair_labels_per_doc.append(None)
-                continue
-
-            idx_pct = [i for i, t in enumerate(tags) if t == VAT_PERCENTAGE_TAG]
-            idx_oth = [i for i, t in enumerate(tags) if t != VAT_PERCENTAGE_TAG]
-
-            pairs_b: List[Tuple[int, int]] = [(i, j) for i in idx_oth for j in idx_pct]
-
-            # 3) Labely z relationships (porovnáváme v kept-indexech)
-            labels_b: List[int] = []
-            if relationships is not None:
-                rel_b = relationships[b]
-                # Přemapování všech vztáhů z datasetu do kept-indexů
-                mapped_gt = {}
-                for a, c, t in zip(rel_b["span_index_a"], rel_b["span_index_b"], rel_b["relationship_type"]):
-                    ai = origin2kept_per_doc[b].get(a, None)
-                    bi = origin2kept_per_doc[b].get(c, None)
-                    if ai is not None and bi is not None:
-                        mapped_gt[(ai, bi)] = t
-
-                for (i, j) in pairs_b:
-                    labels_b.append(mapped_gt.get((i, j), relationship_types.NONE.code))
-            else:
-                labels_b = [relationship_types.NONE.code] * len(pairs_b)
-
-            pair_indices_per_doc.append(pairs_b)
-            pair_labels_per_doc.append(labels_b)
-
-        pairs_per_doc = list()
-
-        for doc_index, doc in enumerate(pair_indices_per_doc):
-            pairs = list()
-            if(doc):
-                for item_index , (i, j) in enumerate(doc):
-                    pairs.append(torch.cat((span_reprs_per_doc[doc_index][i], span_reprs_per_doc[doc_index][j])))
-                if(len(pairs)>0):
-                    pairs_per_doc.append(torch.stack(pairs))
-            else:
-                pairs_per_doc.append(None)
-            # else:
-            #     pairs_per_doc.append(torch.empty((0,2* 3 * H)))
-        #per doc znamená na prvek na batche
+        # Pooling všech spanů batche najednou
+        span_reprs = self._pool_spans(torch.stack(layoutlmv3_output, dim=0), word_input_ids_mapping.to(device),
+                                      torch.as_tensor(batch["windows"], device=device),
+                                      torch.tensor(span_doc, dtype=torch.long, device=device),
+                                      torch.tensor(token_word, dtype=torch.long, device=device),
+                                      torch.tensor(token_span, dtype=torch.long, device=device))   # [K, 3H]
+
+        for doc_reprs, kept_tags in zip(span_reprs.split([len(tags) for tags in kept_tags_per_doc]), kept_tags_per_doc):
+            span_reprs_per_doc.append(doc_reprs if kept_tags else None)  # [S_kept, 3H]
+
+        #Generování kandidátních párů: (cokoli != percentage) -> (percentage) pro celý batch najednou
+        doc_of_span = torch.tensor(span_doc, dtype=torch.long, device=device)                       # [K]
+        tags = torch.tensor([t for kept_tags in kept_tags_per_doc for t in kept_tags], dtype=torch.long, device=device)
+        is_pct = tags == VAT_PERCENTAGE_TAG
+
+        #kartézský součin přes broadcast...pořadí (dokument, i, j) odpovídá původním vnořeným smyčkám
+        candidates = (doc_of_span.unsqueeze(1) == doc_of_span.unsqueeze(0)) & (~is_pct).unsqueeze(1) & is_pct.unsqueeze(0)
+        pair_i, pair_j = torch.nonzero(candidates, as_tuple=True)                                  # [P], [P]
+
+        pairs = torch.cat([span_reprs[pair_i], span_reprs[pair_j]], dim=-1)                          # [P, 2*(3*H)]
+
+        pair_counts = torch.bincount(doc_of_span[pair_i], minlength=B)
+        pair_doc_offsets = torch.cat([pair_counts.new_zeros(1), torch.cumsum(pair_counts, dim=0)])  # [B+1]
+
+        # Labely z relationships...hustá matice [K, K] s typem vztahu mezi ponechanými spany
+        K = doc_of_span.size(0)
+        relation_matrix = torch.full((K, K), relationship_types.NONE.code, dtype=torch.long, device=device)
+
+        if relationships is not None and K > 0:
+            rel_a: List[int] = []
+            rel_b: List[int] = []
+            rel_t: List[int] = []
+            for b in range(B):
+                rel_a.extend(origin_offsets[b] + a for a in relationships[b]["span_index_a"])
+                rel_b.extend(origin_offsets[b] + c for c in relationships[b]["span_index_b"])
+                rel_t.extend(relationships[b]["relationship_type"])
+
+            origin_map = torch.tensor(origin_to_global, dtype=torch.long, device=device)
+            ga = origin_map[torch.tensor(rel_a, dtype=torch.long, device=device)]
+            gb = origin_map[torch.tensor(rel_b, dtype=torch.long, device=device)]
+            valid = (ga >= 0) & (gb >= 0)
+            relation_matrix[ga[valid], gb[valid]] = torch.tensor(rel_t, dtype=torch.long, device=device)[valid]
+
+        pair_labels = relation_matrix[pair_i, pair_j]                                                  # [P]
+
+        #indexy párů v rámci dokumentu (kept-indexy), jen pro výpis
+        kept_offsets = [0]
+        for kept_tags in kept_tags_per_doc:
+            kept_offsets.append(kept_offsets[-1] + len(kept_tags))
+        pair_doc = doc_of_span[pair_i].tolist()
+        pair_indices_per_doc: List[List[Tuple[int, int]]] = [[] for _ in range(B)]
+        for b, i, j in zip(pair_doc, pair_i.tolist(), pair_j.tolist()):
+            pair_indices_per_doc[b].append((i - kept_offsets[b], j - kept_offsets[b]))
 
         return {
-            #P je počet párů spanů v dokumentu, 
+            #P je počet párů spanů v celém batchi, 
             #S_kept je počet ponechaných spanů,
             #H je rozěr output vektoru layoutlmv3 pro jeden subtoken
-            "pairs_per_doc": pairs_per_doc,                # list [P, 2*(3*H)]
+            "pairs": pairs,                        # [P, 2*(3*H)] páry všech dokumentů za sebou
+            "pair_doc_offsets": pair_doc_offsets,  # [B+1] páry dokumentu b jsou pairs[offsets[b]:offsets[b+1]]
             "pair_indices": pair_indices_per_doc,  # list (i, j)  obsahuje indexy tvořící pár
-            "pair_labels": pair_labels_per_doc,    # list [P] obsahuje labely pro dané páry
+            "pair_labels": pair_labels,            # [P] obsahuje labely pro dané páry
 
             "span_reprs": span_reprs_per_doc,      # list [S_kept, 3H]
             "span_tags": kept_tags_per_doc,        # list list[int]
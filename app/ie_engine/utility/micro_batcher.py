@@ -0,0 +1,136 @@
+import asyncio
+from concurrent.futures import Executor
+import time
+from typing import Any, Callable, Dict, Generic, List, Tuple, TypeVar
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class micro_batcher(Generic[T, R]):
+    """
+    Asynchronní fronta požadavků před inferencí, která skládá jednotlivé požadavky do batchů.
+
+    Worker čeká na první požadavek a pak sbírá další, dokud batch nemá `max_batch_size` prvků
+    nebo od prvního požadavku neuběhlo `max_wait_ms`. Batch zpracuje `process_batch` ve vlákně
+    (event loop mezitím dál přijímá požadavky) a výsledky se rozdají do futures jednotlivých požadavků.
+    Když `process_batch` pro celý batch selže, zpracuje se každý požadavek batche znovu samostatně,
+    takže chyba jednoho vstupu (poškozený obrázek, chyba OCR) neshodí ostatní požadavky batche.
+    Větší `max_batch_size` a `max_wait_ms` zvyšují propustnost za cenu latence jednotlivého požadavku.
+
+    :param process_batch: Zpracuje list vstupů a vrátí list výsledků ve stejném pořadí
+    :param max_batch_size: Maximální počet požadavků v jednom batchi
+    :param max_wait_ms: Jak dlouho nejvýše čekat na doplnění batche od prvního požadavku
+    :param executor: Executor pro `process_batch` (None = výchozí executor event loopu)
+    """
+
+    def __init__(self, process_batch: Callable[[List[T]], List[R]], max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 executor: Executor | None = None):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+
+        self._queue: asyncio.Queue[Tuple[T, asyncio.Future[R], float]] | None = None
+        self._worker: asyncio.Task[None] | None = None
+
+        self.counters: Dict[str, float] = {"requests": 0, "batches": 0, "failed_batches": 0, "wait_seconds": 0.0, "process_seconds": 0.0}
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def start(self) -> None:
+        """
+        Spustí worker v běžícím event loopu.
+        """
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Zpracuje požadavky, které už jsou ve frontě, a ukončí worker.
+        """
+        if self._worker is None:
+            return
+
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+    async def submit(self, item: T) -> R:
+        self.start()
+
+        future: asyncio.Future[R] = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_ms / 1000
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.process_batch, items)
+                if len(results) != len(items):
+                    raise ValueError(f"process_batch vrátil {len(results)} výsledků pro {len(items)} vstupů.")
+            except Exception as e:
+                #batch se zopakuje po jednom požadavku...chyba se předá jen požadavkům, které selžou i samostatně
+                self.counters["failed_batches"] += 1
+                if len(batch) == 1:
+                    self._resolve(batch[0][1], error=e)
+                else:
+                    for item, future, _ in batch:
+                        try:
+                            (result,) = await loop.run_in_executor(self.executor, self.process_batch, [item])
+                        except Exception as item_error:
+                            self._resolve(future, error=item_error)
+                        else:
+                            self._resolve(future, result)
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    self._resolve(future, result)
+            finally:
+                self.counters["requests"] += len(batch)
+                self.counters["batches"] += 1
+                self.counters["wait_seconds"] += sum(start - queued for _, _, queued in batch)
+                self.counters["process_seconds"] += time.perf_counter() - start
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _resolve(future: "asyncio.Future[R]", result: Any = None, error: BaseException | None = None) -> None:
+        #future mohl mezitím zrušit klient (např. timeout požadavku)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.counters)
+        stats["avg_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        stats["avg_wait_ms"] = 1000 * stats["wait_seconds"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
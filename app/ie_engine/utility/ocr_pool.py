@@ -0,0 +1,211 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import os
+from threading import Lock
+from typing import Any, Dict, List, Sequence, Tuple
+
+from PIL import Image
+import pytesseract
+from pytesseract import Output
+
+try:
+    import tesserocr # type: ignore[import]
+except ImportError:
+    tesserocr = None
+
+
+@dataclass
+class ocr_page:
+    """
+    Výsledek OCR jedné stránky: slova, jejich boxy v pixelech (left, top, right, bottom) a jistota 0-100.
+    """
+
+    width: int
+    height: int
+    words: List[str] = field(default_factory=list)
+    boxes: List[Tuple[int, int, int, int]] = field(default_factory=list)
+    confidences: List[float] = field(default_factory=list)
+
+    def normalized(self, min_confidence: float = 40) -> Tuple[List[str], List[Tuple[float, float, float, float]]]:
+        """
+        Slova nad prahem jistoty a jejich boxy přepočtené na 0-1000 (vstup LayoutLMv3).
+        """
+        words: List[str] = list()
+        boxes: List[Tuple[float, float, float, float]] = list()
+        for word, (l, t, r, b), conf in zip(self.words, self.boxes, self.confidences):
+            if conf <= min_confidence:
+                continue
+            words.append(word)
+            boxes.append((l/self.width*1000, t/self.height*1000, r/self.width*1000, b/self.height*1000))
+        return words, boxes
+
+
+class ocr_pool:
+    """
+    OCR s omezeným počtem trvalých workerů a diskovou cache výsledků.
+
+    - workery jsou procesy, které žijí po celou dobu poolu...s tesserocr drží každý worker jednu načtenou
+      instanci Tesseractu, bez něj volají pytesseract (tesseract binárka z `tesseract_cmd` nebo TESSERACT_CMD)
+    - výsledek se ukládá pod sha256 obsahu obrázku (a jazyka a konfigurace), stejný sken se podruhé vůbec nerozpoznává
+    - `workers=0` rozpoznává v hlavním procesu
+
+    :param workers: Počet OCR procesů (None = počet jader)
+    :param lang: Jazyk Tesseractu (musí být nainstalovaný traineddata)
+    :param config: Další parametry Tesseractu (např. "--psm 6")
+    :param tesseract_cmd: Cesta k tesseractu, jinak proměnná prostředí TESSERACT_CMD, jinak PATH
+    :param cache_folder_path: Složka cache (None = bez cache)
+    """
+
+    def __init__(self, workers: int | None = None, lang: str = "ces", config: str = "", tesseract_cmd: str | None = None,
+                 cache_folder_path: str | None = "app/data/ocr_cache"):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.lang = lang
+        self.config = config
+        self.tesseract_cmd = tesseract_cmd or os.environ.get("TESSERACT_CMD")
+        self.cache_folder_path = cache_folder_path
+
+        self._executor: Executor | None = None
+        self._lock = Lock()
+        self.counters: Dict[str, int] = {"hits": 0, "misses": 0}
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def recognize(self, source: Image.Image | str) -> ocr_page:
+        return self.recognize_batch([source])[0]
+
+    def recognize_batch(self, sources: Sequence[Image.Image | str]) -> List[ocr_page]:
+        """
+        Rozpozná obrázky (objekty PIL nebo cesty k souborům) paralelně ve workerech. Výsledky z cache se nepočítají znovu.
+        """
+        keys = [self.cache_key(source) for source in sources]
+        pages: List[ocr_page | None] = [self._load(key) for key in keys]
+
+        missing = [i for i, page in enumerate(pages) if page is None]
+        with self._lock:
+            self.counters["hits"] += len(pages) - len(missing)
+            self.counters["misses"] += len(missing)
+
+        if missing:
+            if self.workers == 0:
+                _init_worker(self.tesseract_cmd, self.lang)
+                results = [_recognize(sources[i], self.lang, self.config) for i in missing]
+            else:
+                results = list(self._pool().map(_recognize, [sources[i] for i in missing],
+                                                 [self.lang] * len(missing), [self.config] * len(missing)))
+
+            for i, page in zip(missing, results):
+                pages[i] = page
+                self._save(keys[i], page)
+
+        return pages
+
+    def cache_key(self, source: Image.Image | str) -> str:
+        digest = hashlib.sha256(f"{self.lang}|{self.config}|".encode("utf-8"))
+
+        if isinstance(source, str):
+            #u souboru stačí hash jeho obsahu...obrázek se načte až ve workeru
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(f"{source.mode}|{source.size}|".encode("utf-8"))
+            digest.update(source.tobytes())
+
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_folder_path, key[:2], key + ".json")
+
+    def _load(self, key: str) -> ocr_page | None:
+        if self.cache_folder_path is None:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        data["boxes"] = [tuple(box) for box in data["boxes"]]
+        return ocr_page(**data)
+
+    def _save(self, key: str, page: ocr_page) -> None:
+        if self.cache_folder_path is None:
+            return
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        #zápis přes dočasný soubor...souběžný čtenář nikdy neuvidí rozepsaný výsledek
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(page), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self.tesseract_cmd, self.lang))
+        return self._executor
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.counters)
+        stats["backend"] = "tesserocr" if tesserocr is not None else "pytesseract"
+        return stats
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "ocr_pool":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+
+#instance Tesseractu ve workeru (jen s tesserocr)
+_api: Any = None
+
+
+def _init_worker(tesseract_cmd: str | None, lang: str) -> None:
+    global _api
+
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    if tesserocr is not None and _api is None:
+        _api = tesserocr.PyTessBaseAPI(lang=lang)
+
+
+def _recognize(source: Image.Image | str, lang: str, config: str) -> ocr_page:
+    img = Image.open(source) if isinstance(source, str) else source
+    page = ocr_page(width=img.width, height=img.height)
+
+    if _api is not None and not config:
+        level = tesserocr.RIL.WORD
+        _api.SetImage(img)
+        _api.Recognize()
+        for word in tesserocr.iterate_level(_api.GetIterator(), level):
+            text = word.GetUTF8Text(level)
+            if not text or not text.strip():
+                continue
+            page.words.append(text)
+            page.boxes.append(tuple(word.BoundingBox(level)))
+            page.confidences.append(float(word.Confidence(level)))
+        return page
+
+    data = pytesseract.image_to_data(img, lang=lang, config=config, output_type=Output.DICT)
+    for text, l, t, w, h, c in zip(data["text"], data["left"], data["top"], data["width"], data["height"], data["conf"]):
+        if float(c) < 0 or not text.strip():
+            continue
+        page.words.append(text)
+        page.boxes.append((l, t, l + w, t + h))
+        page.confidences.append(float(c))
+    return page
@@ -0,0 +1,15 @@
+from typing import Tuple
+
+import torch
+from torch.utils.data import get_worker_info
+
+
+def worker_split() -> Tuple[int, int, int]:
+    """
+    (id workeru, počet workerů, seed epochy) aktuálního procesu DataLoaderu.
+    Seed epochy je ve všech workerech stejný a mění se s každou epochou.
+    """
+    worker = get_worker_info()
+    if worker is None:
+        return 0, 1, torch.initial_seed()
+    return worker.id, worker.num_workers, worker.seed - worker.id
@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class output_formats(Enum):
+    # samostatné PNG soubory + metadata.jsonl
+    PNG = "png"
+    # tar shardy ve formátu WebDataset (obrázek + anotace v jednom archivu)
+    TAR = "tar"
+    # samostatné PNG soubory + sloupcové anotace v Arrow IPC souborech (annotations-*.arrow)
+    ARROW = "arrow"
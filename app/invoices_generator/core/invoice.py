@@ -1,23 +1,23 @@
 from itertools import islice
 import json
 from abc import ABC, abstractmethod
+import copy
 from dataclasses import dataclass, field
 from datetime import datetime
 import random
-from typing import Any, List, Tuple
+from typing import Any, BinaryIO, List, Tuple
 
-from PIL import Image, ImageOps, ImageFilter, ImageDraw, ImageEnhance
-from PIL.ImageFont import FreeTypeFont, truetype
+from PIL import Image, ImageChops, ImageDraw
+from PIL.ImageFont import FreeTypeFont
 from decimal import Decimal, ROUND_HALF_UP
-import math
+import io
 import os
 
 from jinja2 import Environment, FileSystemLoader
 import numpy as np
-import pytesseract
-from pytesseract import Output
 
 from app.ie_engine.enumerates.engines import engines
+from app.ie_engine.utility.ocr_pool import ocr_pool
 from app.invoices_generator.core.bank import bank
 from app.invoices_generator.core.company import company
 from app.invoices_generator.core.enumerates.currency_code import currency_code
@@ -27,8 +27,13 @@ from app.invoices_generator.core.invoice_item import invoice_item
 from app.invoices_generator.core.relationship import relationship
 from app.invoices_generator.core.vat_item import vat_item
 from app.invoices_generator.core.token import token
+from app.invoices_generator.utility.augmentation import augmentation_config, augmentation_pipeline
+from app.invoices_generator.utility.box_array import box_array
+from app.invoices_generator.utility.font_registry import font_registry
 from app.invoices_generator.utility.invoice_consts import fonts
 from app.invoices_generator.utility.json_serializable import json_serializable
+from app.invoices_generator.utility.page_cache import null_draw, page_cache
+from app.invoices_generator.utility.text_metrics import text_metrics
 from app.invoices_generator.core.enumerates.token_tags import token_tags
 from app.invoices_generator.core.span import span
 
@@ -60,6 +65,8 @@ class invoice(json_serializable, ABC):
 
     :param items: Seznam položek faktury (`invoice_item`)
     :param vat: Seznam ďanových položek faktury (`vat_item`)
+    :param printed_at: Datum a čas tisku, které některé šablony vypisují do patičky
+    :param augmentation: Konfigurace augmentace obrázku (None = bez augmentace)
     """
 
     ############################
@@ -95,12 +102,21 @@ class invoice(json_serializable, ABC):
     description: str = ""
     items: List[invoice_item] = field(default_factory=list)
 
+    # datum tisku...generátor ho předává, aby byl obrázek reprodukovatelný
+    printed_at: datetime = field(default_factory=datetime.now)
+
+    # efekty naskenovaného dokumentu v post_process (None = čistý obrázek)
+    augmentation: augmentation_config | None = None
+
     ###############################################################
     #            Informace potřebné pro tvorbu datasetu           # 
     ###############################################################
 
     _tokens:List[token] = field(default_factory=list)
     _spans:List[span] = field(default_factory=list)
+    #b-boxy tokenů (relativní 0-1) a spanů (0-1000)...indexy odpovídají _tokens a _spans
+    _token_boxes: box_array = field(default_factory=box_array)
+    _span_boxes: box_array = field(default_factory=lambda: box_array(scale=(1000, 1000)))
     _relationships: List[relationship] = field(default_factory=list)
 
     ###############################################################
@@ -123,6 +139,11 @@ class invoice(json_serializable, ABC):
     _BOX_BG = (252, 252, 252)
     _TMOBILE_PINK = (226, 0, 126)
 
+    # podklad rozpracovaný v _render_static (bez anotace...není to pole dataclassu)
+    _static_page = None
+    # kreslení pevných částí aktuálního dokumentu (uzavře ho post_process)
+    _static_draw = None
+
     def __post_init__(self):
         # vybere se náhodná dvojice fontů při vytvoření instance
         regular, bold = random.choice(fonts)
@@ -219,23 +240,11 @@ class invoice(json_serializable, ABC):
             return self.to_json_layoutlmv2(img_path)
 
     def extract_words_teseract(self, img_path:str)->None:
-        lang = "ces"  # jazykové balíčky Tesseractu musí být nainstalované (ces.traineddata)
-
-        pytesseract.pytesseract.tesseract_cmd = r'E:\user\plocha\BP\packages\tesseract.exe'
-        data = pytesseract.image_to_data(Image.open(img_path), lang=lang, output_type=Output.DICT)
-        print(data)
-
-        lines = []
-        n = len(data["text"])
-        for i in range(n):
-            text = data["text"][i]
-            conf = float(data["conf"][i]) if data["conf"][i] != "-1" else 0.0
-            if not text.strip():
-                continue
+        #tesseract z proměnné prostředí TESSERACT_CMD nebo z PATH, jazykové balíčky Tesseractu musí být nainstalované (ces.traineddata)
+        page = ocr_pool(workers=0, lang="ces").recognize(img_path)
+        print(page)
 
-            x, y, w, h = data["left"][i], data["top"][i], data["width"][i], data["height"][i]
-            box = (x, y, x+w, y+h)
-            lines.append({"box": box, "text": text, "conf": conf})
+        lines = [{"box": box, "text": text, "conf": conf} for text, box, conf in zip(page.words, page.boxes, page.confidences)]
 
         # 3) vykreslení do kopie
         out = Image.open(img_path)
@@ -261,8 +270,9 @@ class invoice(json_serializable, ABC):
 
     #je totožná pro všechny faktury
     def to_json_layoutlmv2(self, img_path:str)->str:
-        tokens, tokens_boxes, tokens_tag_list = ([], [], []) if not self._tokens else map(list, zip(*((w.text, w.b_box, w.tag.code) for w in self._tokens)))
-        spans_tokens_indices, spans_boxes, spans_tag_list = ([], [], []) if not self._spans else map(list, zip(*((w.tokens, w.b_box, w.tag.code) for w in self._spans)))
+        tokens, tokens_tag_list = ([], []) if not self._tokens else map(list, zip(*((w.text, w.tag.code) for w in self._tokens)))
+        spans_tokens_indices, spans_tag_list = ([], []) if not self._spans else map(list, zip(*((w.tokens, w.tag.code) for w in self._spans)))
+        tokens_boxes, spans_boxes = self._token_boxes.tolist(), self._span_boxes.tolist(decimals=3)
         spans_a_indices, spans_b_indices, relationship_types = ([], [], []) if not self._relationships else map(list, zip(*((w.span_a_index, w.span_b_index, w.type.code) for w in self._relationships)))
 
         output = { 
@@ -285,136 +295,99 @@ class invoice(json_serializable, ABC):
         return output
 
     @abstractmethod
-    def generate_img(self, output_path:str)->bool:
+    def generate_img(self, output_path:str | BinaryIO)->bool:
         """
         Vykreslí obrázek faktury pomocí Pillow kreslících příkazů
+        (output_path může být i binární buffer, např. pro zápis do tar shardu)
         """
         return True
     
-    def post_process(self, img: Image.Image) -> Image.Image:
-
-        return img
-        # náhodná rotace (40 %)
-        if random.random() < 0.4:
-            angle_deg = random.randint(-2, 2)
-
-            #rozměry plátna před rotatcí
-            w, h = img.size
-            img = img.rotate(angle_deg, expand=True, fillcolor=(255,255,255),
-                            resample=Image.Resampling.BICUBIC)
-
-            #střed plátna
-            cx, cy = w/2.0, h/2.0
-            θ = math.radians(-angle_deg)
-
-            T1 = np.array([[1,0,-cx],[0,1,-cy],[0,0,1]], float)
-            R  = np.array([[math.cos(θ), -math.sin(θ), 0],
-                        [math.sin(θ),  math.cos(θ), 0],
-                        [0,0,1]], float)
-            T2c = np.array([[1,0,cx],[0,1,cy],[0,0,1]], float)
-
-            #rotace podle středu plátna
-            M_center = T2c @ R @ T1
-
-            #kvůli EXPANZI...spočítám kam se transformovali rohové body
-            corners = np.array([[0,   w,   w,   0],
-                                [0,   0,   h,   h],
-                                [1,   1,   1,   1]], float) #[roh 1, roh2, roh3, roh4]
-            tc = M_center @ corners #(3,3)*(3,4) = (3,4)...[t-roh1, t-roh2, t-roh3, t-roh4]
-            ox = -tc[0,:].min()
-            oy = -tc[1,:].min()
-
-            Toffset = np.array([[1,0,ox],[0,1,oy],[0,0,1]], float)
-            M = Toffset @ M_center
-
-            self._apply_matrix(M)  # → uvnitř transformuj 4 rohy každého bboxu
-
-            w, h = img.size
-            
-            #downscale zvětšeného plátna
-            scale_w, scale_h = float(self._A4_W_PX)/w, float(self._A4_H_PX)/h 
-
-            S = np.array([[scale_w, 0, 0],
-                        [0,  scale_h, 0],
-                        [0,0,1]], float)
-
-            self._apply_matrix(S)  # → uvnitř transformuj 4 rohy každého bboxu
+    def _page(self, bg: Tuple[int, int, int] = _BG) -> Tuple[Image.Image, ImageDraw.ImageDraw, ImageDraw.ImageDraw]:
+        """
+        Plátno nového dokumentu: (obrázek, kreslení proměnných částí, kreslení pevných částí).
 
-            img = img.resize((self._A4_W_PX,self._A4_H_PX),resample=Image.Resampling.BICUBIC)
+        Pevné části stránky (čáry, pruhy, rámečky, stálé popisky na pevných pozicích) šablona kreslí druhým kreslením.
+        Pro každou dvojici (šablona, fonty, pozadí) se vykreslí jen jednou do podkladu v `page_cache`,
+        každý dokument pak začíná kopií podkladu a pevné části jen projde bez kreslení...`_text` vytvoří stejné tokeny
+        (i se stejným náhodným undersamplingem) jako při kreslení, anotace se tedy cache nemění.
+        """
+        if self._static_page is not None:
+            #vykreslení podkladu...kreslí se jen pevné části
+            return self._static_page, null_draw(), ImageDraw.Draw(self._static_page)
 
-        #náhodný grayscale
-        if random.random() < 0.3:  # 30% šance
-            img = ImageOps.grayscale(img).convert("RGB")
+        key = (type(self).__name__, self.font_regular_path, self.font_bold_path, bg)
+        img = page_cache.get(key, lambda: self._render_static(bg)).copy()
+        self._static_draw = null_draw()
 
-        # --- Gaussian blur (efekt naskenovaného papíru) ---
-        if random.random() < 0.3:
-            img = img.filter(ImageFilter.GaussianBlur(radius=random.uniform(0.5, 1.5)))
+        return img, ImageDraw.Draw(img), self._static_draw
 
-        # --- přidání šumu (salt & pepper) ---
-        if random.random() < 0.3:
-            arr = np.array(img)
-            amount = random.uniform(0.005, 0.02)  # 0.5–2 % pixelů
-            noise = np.random.choice([0, 255], arr.shape, p=[1 - amount, amount]).astype(np.uint8)
-            mask = np.random.rand(*arr.shape[:2]) < amount
-            arr[mask] = noise[mask]
-            img = Image.fromarray(arr)
+    def _render_static(self, bg: Tuple[int, int, int]) -> Image.Image:
+        page = self._static_render(bg, self)
 
-        # --- zažloutlý papír ---
-        if random.random() < 0.25:
-            overlay = Image.new("RGB", img.size, (240, 230, 200))
-            img = Image.blend(img, overlay, 0.08)
+        #kontrola kontraktu šablony...přes s se smí kreslit jen to, co nezávisí na datech faktury ani na random,
+        #jinak by podklad z cache nesl údaje prvního dokumentu do všech dalších
+        variant = copy.copy(self)
+        variant.supplier, variant.customer, variant.items = self.customer, self.supplier, self.items[:1]
+        state = random.getstate()
+        try:
+            random.seed(random.getrandbits(64))
+            check = self._static_render(bg, variant)
+        finally:
+            random.setstate(state)
+
+        if ImageChops.difference(page, check).getbbox() is not None:
+            raise RuntimeError(f"Pevné části šablony {type(self).__name__} závisí na datech dokumentu nebo na náhodě "
+                               f"(kreslete je přes d, ne přes s)")
+
+        return page
+
+    @staticmethod
+    def _static_render(bg: Tuple[int, int, int], source: "invoice") -> Image.Image:
+        #šablona se projde na kopii faktury s vlastními anotacemi...tokeny ani stav random se do dokumentu nepropíšou
+        renderer = copy.copy(source)
+        renderer._tokens, renderer._spans, renderer._relationships = list(), list(), list()
+        renderer._token_boxes, renderer._span_boxes = box_array(), box_array(scale=(1000, 1000))
+        renderer._static_page = Image.new("RGB", (source._A4_W_PX, source._A4_H_PX), bg)
+
+        state = random.getstate()
+        try:
+            renderer.generate_img(io.BytesIO())
+        except _static_page_done:
+            pass
+        finally:
+            random.setstate(state)
 
-        # --- náhodné čáry (škrábance, stopy skeneru) ---
-        if random.random() < 0.2:
-            d = ImageDraw.Draw(img)
-            for _ in range(random.randint(1, 3)):
-                x1, y1 = random.randint(0, img.width), random.randint(0, img.height)
-                x2, y2 = random.randint(0, img.width), random.randint(0, img.height)
-                d.line((x1, y1, x2, y2), fill=(150, 150, 150), width=random.randint(1, 3))
+        return renderer._static_page
 
-        if random.random() < 0.3:  # 30% šance
-            img = ImageOps.grayscale(img).convert("RGB")
+    def post_process(self, img: Image.Image) -> Image.Image:
+        """
+        Efekty naskenovaného dokumentu podle `augmentation` (rotace transformuje i b-boxy tokenů a spanů).
+        """
+        if self._static_page is not None:
+            #podklad je hotový...šablona už nemusí nic ukládat
+            raise _static_page_done()
+        if self._static_draw is not None:
+            #po post_process už b-boxy nesedí na podklad...další kreslení přes s je chyba šablony
+            self._static_draw.close()
 
-        return img
+        if self.augmentation is None:
+            return img
 
+        return augmentation_pipeline.shared(self.augmentation).apply(img, on_transform=self._apply_matrix)
 
     def _apply_matrix(self, M: np.ndarray):
         """
-        Správně transformuje všech 4 rohy b-boxu homogenní maticí M.
+        Transformuje všechny 4 rohy b-boxů tokenů i spanů homogenní maticí M zadanou v pixelech plátna A4.
         """
-        for w in self._tokens:
-            left, top, right, bottom = w.b_box
-
-            # čtyři rohy v homogenních souřadnicích
-            pts = np.array([
-                [left,  top,    1.0],
-                [right, top,    1.0],
-                [right, bottom, 1.0],
-                [left,  bottom, 1.0],
-            ], dtype=float).T  #(3,4)
-
-            # transformované body 
-            tpts = (M @ pts)  #(3,4)
-
-            xs = tpts[0, :]
-            ys = tpts[1, :]
-
-            n_left   = float(xs.min())
-            n_right  = float(xs.max())
-            n_top    = float(ys.min())
-            n_bottom = float(ys.max())
-
-            w.b_box = (n_left, n_top, n_right, n_bottom)
-
-
-
+        self._token_boxes.transform(M, self._A4_W_PX, self._A4_H_PX)
+        self._span_boxes.transform(M, self._A4_W_PX, self._A4_H_PX)
 
     def mm(self, x:float)->int:
         return int(round(x * self._DPI / 25.4))
 
     def _load_font(self, path:str, size:float, fallback:str="arial")->FreeTypeFont:
-        SCALE:float = self._DPI/100.0 #přibližný a zjednodušený výpočet
-        return truetype(path, size= size * SCALE)
+        #fonty se načítají jen jednou za proces a sdílí je všechny instance faktur
+        return font_registry.get(path, size, self._DPI)
 
     def _fmt_money(self, x: float) -> str:
         try:
@@ -459,8 +432,7 @@ class invoice(json_serializable, ABC):
             draw.text((x, y), str(sp), font=font, fill=self._INK)
             
             #rozměry spanu
-            left, top, right, bottom = font.getbbox("ABCDEFGHIJKLMNOPQRSTUVWXYZ") #největší možná výška pro daný font
-            span_width, span_height = self._text_width(draw,sp,font), bottom - top + self.mm(0.75)
+            span_width, span_height = self._text_width(draw,sp,font), text_metrics.line_height(font) + self.mm(0.75)
 
 
             indices:list[int] = list()
@@ -497,24 +469,28 @@ class invoice(json_serializable, ABC):
                 ##HARD UNDERSAMPLING
                 if(span_tag == span_tags.O and hard_undersampling and random.choice([True,False, False, False, False, False, False])):
                     indices.append(len(self._tokens)) #index tokenu
-                    self._tokens.append(token(chunk,token_possition,token_tag))
+                    self._tokens.append(token(chunk,token_tag))
+                    self._token_boxes.append(token_possition)
                 ##SOFT UNDERSAMPLING
                 if(span_tag == span_tags.O and not hard_undersampling and random.choice([True, True, True, True, False, False, False])):
                     indices.append(len(self._tokens)) #index tokenu
-                    self._tokens.append(token(chunk,token_possition,token_tag))
+                    self._tokens.append(token(chunk,token_tag))
+                    self._token_boxes.append(token_possition)
 
                 if(span_tag != span_tags.O):
                     indices.append(len(self._tokens)) #index tokenu
-                    self._tokens.append(token(chunk,token_possition,token_tag))
+                    self._tokens.append(token(chunk,token_tag))
+                    self._token_boxes.append(token_possition)
 
-            span_possition = (((x - self.mm(0.75)/self._A4_W_PX)*1000),
-                            ((y - self.mm(0.75)/self._A4_H_PX))*1000,
+            span_possition = (((x - self.mm(0.75))/self._A4_W_PX)*1000,
+                            ((y - self.mm(0.75))/self._A4_H_PX)*1000,
                             ((x+span_width)/self._A4_W_PX)*1000,
                             ((y+span_height)/self._A4_H_PX)*1000)
 
             if(span_tag != span_tags.O):
                 span_index = len(self._spans)
-                self._spans.append(span(span_possition,tag=span_tag, tokens=indices))    
+                self._spans.append(span(tag=span_tag, tokens=indices))
+                self._span_boxes.append(span_possition)    
             x += span_width + self._text_width(draw, "_", font)  #plus mezera mezi slovy
 
         if end is not None:
@@ -525,10 +501,8 @@ class invoice(json_serializable, ABC):
         return (x, span_index)
 
     def _text_width(self, draw: ImageDraw.ImageDraw, text: str, font: FreeTypeFont) -> float:
-        if not text:
-            return 0.0
-        left, top, right, bottom = font.getbbox(text)
-        return right - left
+        #šířky jsou memoizované...stejné řetězce se měří opakovaně (mezery, oddělovače, _draw_right/_draw_center)
+        return text_metrics.width(font, text)
 
     def _draw_right(self, draw: ImageDraw.ImageDraw, x_right: float, y: float, text: str, font: FreeTypeFont, fill: tuple[int, int, int], tag: span_tags = span_tags.O,
     label: str | None = None, end: str | None = None, undersampling:bool = True) -> tuple[float, int|None]:
@@ -608,4 +582,10 @@ class invoice(json_serializable, ABC):
 
                 index = end_index
 
-        return tokens
\ No newline at end of file
+        return tokens
+
+
+class _static_page_done(Exception):
+    """
+    Ukončí průchod šablonou při vykreslování podkladu (post_process je poslední krok před uložením).
+    """
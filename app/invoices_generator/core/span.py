@@ -5,8 +5,6 @@ from app.invoices_generator.core.enumerates.span_tags import span_tags
 
 @dataclass
 class span:
-    
-    
-    b_box: tuple[float, float, float, float]
+    #b-box spanu je v invoice._span_boxes na stejném indexu
     tag: span_tags
     tokens:List[int] = field(default_factory=list)
@@ -5,6 +5,6 @@ from app.invoices_generator.core.enumerates.token_tags import token_tags
 @dataclass
 class token:
     
+    #b-box tokenu je v invoice._token_boxes na stejném indexu
     text:str
-    b_box: tuple[float, float, float, float]
     tag: token_tags
@@ -1,9 +1,14 @@
-from dataclasses import dataclass
-from datetime import date, timedelta
-import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+import glob
+import io
+import os
 import random
 import re
-from typing import Type
+from typing import Any, Type
+
+import numpy as np
 
 from app.ie_engine.enumerates.engines import engines
 from app.invoices_generator.core.bank import bank
@@ -12,6 +17,7 @@ from app.invoices_generator.core.enumerates.banks import banks
 from app.invoices_generator.core.enumerates.company_type import company_type
 from app.invoices_generator.core.enumerates.country_code import country_code
 from app.invoices_generator.core.enumerates.currency_code import currency_code
+from app.invoices_generator.core.enumerates.output_formats import output_formats
 from app.invoices_generator.core.enumerates.payment_type import payment_type
 from app.invoices_generator.core.invoice import invoice
 from app.invoices_generator.core.invoice_item import invoice_item
@@ -30,7 +36,36 @@ from app.invoices_generator.templates.simple_invoice import simple_invoice
 from app.invoices_generator.templates.inverted_invoice import inverted_invoice
 from app.invoices_generator.templates.random_invoice import random_invoice
 
+from app.invoices_generator.utility.annotation_store import annotation_writer
+from app.invoices_generator.utility.augmentation import augmentation_config, default_augmentations
 from app.invoices_generator.utility.invoice_consts import *
+from app.invoices_generator.utility.metadata_writer import metadata_writer
+from app.invoices_generator.utility.run_manifest import run_manifest
+from app.invoices_generator.utility.shards import shard_writer
+
+
+invoice_classes: list[type[invoice]] = [
+        alza_invoice,
+        general_invoice,
+        phone_invoice,
+        post_invoice,
+        restaurant_receipt,
+        store_receipt,
+        classic_invoice,
+        modern_invoice,
+        colorful_invoice, 
+        compact_invoice,
+        a_invoice,
+        simple_invoice,
+        inverted_invoice,
+        random_invoice,
+        random_invoice,
+        random_invoice,
+        random_invoice,
+        random_invoice,
+        random_invoice,
+        random_invoice,
+    ]
 
 
 @dataclass
@@ -42,6 +77,11 @@ class invoice_generator:
     ####                    ####
     ############################
 
+    # referenční čas běhu...nahrazuje date.today() a datetime.now(), aby šel běh zopakovat
+    reference_time: datetime = field(default_factory=lambda: datetime.now().replace(second=0, microsecond=0))
+
+    # augmentace obrázků podle složky (train/test/validation)...None nebo chybějící složka = čisté obrázky
+    augmentation: dict[str, augmentation_config | None] = field(default_factory=lambda: dict(default_augmentations))
 
     ############################
     ####                    ####
@@ -156,7 +196,7 @@ class invoice_generator:
             return f"{random.randrange(0, 9999):04d}"
     
     def __generate_invoice_dates(self) -> tuple[str, str, str]:
-        today = date.today()
+        today = self.reference_time.date()
         
         # náhodné datum vystavení během posledních X dní
         random_offset = random.randint(0, 1440)
@@ -179,105 +219,221 @@ class invoice_generator:
 
         return (issue_date, taxable_supply_date, due_date)
 
-    def __generate_folder(self, folder: str, count: int, engine:engines = engines.DONUT) -> None:
-        invoice_classes: list[type[invoice]] = [
-                alza_invoice,
-                general_invoice,
-                phone_invoice,
-                post_invoice,
-                restaurant_receipt,
-                store_receipt,
-                classic_invoice,
-                modern_invoice,
-                colorful_invoice, 
-                compact_invoice,
-                a_invoice,
-                simple_invoice,
-                inverted_invoice,
-                random_invoice,
-                random_invoice,
-                random_invoice,
-                random_invoice,
-                random_invoice,
-                random_invoice,
-                random_invoice,
-            ]
-        
-        for _ in range(count):
-            
-            for cls in invoice_classes:
-
-                supp = self.__generate_company()
-                cust = self.__generate_company()
-
-                bank = banks_[random.randrange(0, len(banks_))]
-                payment = payments[random.randrange(0, len(payments))]
-
-                items, total_price, total_vat = self.__generate_items()
-
-                invoice_number = self.__generate_invoice_number()
-                variable_symbol = self.__generate_variable_symbol(invoice_number)
-                const_symbol = self.__generate_const_symbol()
-
-                bank_account_number, IBAN = self.__generate_bank_account(bank)
-
-                issue_date, taxable_supply_date, due_date = self.__generate_invoice_dates()
-
-                instance = cls(
-                    invoice_number=invoice_number,
-                    variable_symbol=variable_symbol,
-                    bank_account_number=bank_account_number,
-                    IBAN=IBAN,
-                    issue_date=issue_date,
-                    taxable_supply_date=taxable_supply_date,
-                    due_date=due_date,
-                    const_symbol=const_symbol,
-                    supplier=supp,
-                    customer=cust,
-                    rounding=0,
-                    total_vat=total_vat,
-                    total_price=total_price,
-                    bank_account=bank,
-                    payment=payment,
-                    items=items,
-                )
-
-                img_path = f"app/data/{folder}/{cls.__name__}_{invoice_number}.png"
-                meta_path = f"app/data/{folder}/metadata.jsonl"
-
-                if instance.generate_img(img_path):
-                    print(f"{cls.__name__}: faktura byla vytvořena ({folder}).")
-
-                
-                with open(meta_path, "a", encoding="utf-8") as f:
-                    if(engine == engines.DONUT):
-                        output = {
-                            "file_name": f"{cls.__name__}_{invoice_number}.png",
-                            "ground_truth": {
-                                "gt_parse": instance.to_json(img_path, engine)
-                            }
-                        }
-                    elif(engine == engines.LAYOUTLMv3):
-                        output = {
-                            "file_name": f"{cls.__name__}_{invoice_number}.png",
-                            "data": instance.to_json(img_path, engine)
-                        }
-                    
-                    f.write(json.dumps(output, ensure_ascii=False) + "\n")
-
-                
-    def generate(self, train_count:int, test_count:int, validation_count:int, engine:engines = engines.DONUT)->bool:
-        
-        if(train_count>0):
-            self.__generate_folder("train", train_count, engine)
+    def __generate_document(self, folder: str, cls: type[invoice], engine:engines = engines.DONUT,
+                            output_format:output_formats = output_formats.PNG) -> tuple[dict[str, Any], bytes | None]:
+        supp = self.__generate_company()
+        cust = self.__generate_company()
+
+        bank = banks_[random.randrange(0, len(banks_))]
+        payment = payments[random.randrange(0, len(payments))]
+
+        items, total_price, total_vat = self.__generate_items()
+
+        invoice_number = self.__generate_invoice_number()
+        variable_symbol = self.__generate_variable_symbol(invoice_number)
+        const_symbol = self.__generate_const_symbol()
+
+        bank_account_number, IBAN = self.__generate_bank_account(bank)
+
+        issue_date, taxable_supply_date, due_date = self.__generate_invoice_dates()
+
+        instance = cls(
+            invoice_number=invoice_number,
+            variable_symbol=variable_symbol,
+            bank_account_number=bank_account_number,
+            IBAN=IBAN,
+            issue_date=issue_date,
+            taxable_supply_date=taxable_supply_date,
+            due_date=due_date,
+            const_symbol=const_symbol,
+            supplier=supp,
+            customer=cust,
+            rounding=0,
+            total_vat=total_vat,
+            total_price=total_price,
+            bank_account=bank,
+            payment=payment,
+            items=items,
+            printed_at=self.reference_time,
+            augmentation=self.augmentation.get(folder),
+        )
+
+        img_path = f"app/data/{folder}/{cls.__name__}_{invoice_number}.png"
+        image: bytes | None = None
+
+        if(output_format == output_formats.TAR):
+            #obrázek se nezapisuje na disk, bajty se předají do shardu
+            buffer = io.BytesIO()
+            if instance.generate_img(buffer):
+                print(f"{cls.__name__}: faktura byla vytvořena ({folder}).")
+            image = buffer.getvalue()
+        elif instance.generate_img(img_path):
+            print(f"{cls.__name__}: faktura byla vytvořena ({folder}).")
+
+        if(engine == engines.DONUT):
+            output = {
+                "file_name": f"{cls.__name__}_{invoice_number}.png",
+                "ground_truth": {
+                    "gt_parse": instance.to_json(img_path, engine)
+                }
+            }
+        elif(engine == engines.LAYOUTLMv3):
+            output = {
+                "file_name": f"{cls.__name__}_{invoice_number}.png",
+                "data": instance.to_json(img_path, engine)
+            }
+
+        return (output, image)
+
+    def _generate_unit(self, folder: str, documents: list[tuple[int, int]], engine:engines = engines.DONUT,
+                       output_format:output_formats = output_formats.PNG) -> list[tuple[str, dict[str, Any], bytes | None]]:
+        """
+        Vygeneruje dokumenty jedné pracovní jednotky a vrátí trojice (id dokumentu, záznam pro metadata.jsonl, bajty PNG).
+        Bajty PNG se vrací jen pro výstup do shardů, jinak je obrázek rovnou uložený a vrací se None.
+        Metadata ani shardy nezapisuje, to dělá vždy jen hlavní proces.
+
+        :param documents: Dvojice (index dokumentu ve složce, odvozený seed)
+        """
+        results: list[tuple[str, dict[str, Any], bytes | None]] = list()
+
+        for index, seed in documents:
+            #každý dokument má vlastní seed...výsledek nezávisí na počtu procesů ani na pořadí
+            random.seed(seed)
+            np.random.seed(seed % 2**32)
+
+            cls = invoice_classes[index % len(invoice_classes)]
+            output, image = self.__generate_document(folder, cls, engine, output_format)
+            results.append((run_manifest.document_id(index), output, image))
+
+        return results
+
+    def __open_manifest(self, folder: str, count: int, engine: engines, output_format: output_formats,
+                        seed: int | None, resume: bool) -> run_manifest:
+        manifest_path = f"app/data/{folder}/manifest.json"
+        previous = run_manifest.load(manifest_path)
+        manifest = previous if resume else None
+
+        if manifest is None:
+            master_seed = seed if seed is not None else random.getrandbits(63)
+            reference_time = self.reference_time
+
+            if previous is not None and previous.master_seed == master_seed:
+                #přegenerování se stejným seedem...i data musí vycházet ze stejného referenčního času
+                reference_time = previous.reference_time
+
+            #nový běh...výstupy předchozího běhu by se s novými promíchaly (sinky jen připisují)
+            self.__clear_outputs(folder)
+
+            manifest = run_manifest(path=manifest_path, master_seed=master_seed,
+                                    reference_time=reference_time, engine=engine.value,
+                                    output_format=output_format.value)
+            manifest.reset_completed()
+        else:
+            if seed is not None and seed != manifest.master_seed:
+                raise ValueError(f"Seed {seed} neodpovídá manifestu {manifest_path} (seed {manifest.master_seed}).")
+            if engine.value != manifest.engine:
+                raise ValueError(f"Engine {engine.value} neodpovídá manifestu {manifest_path} ({manifest.engine}).")
+            if output_format.value != manifest.output_format:
+                #potvrzená pozice má pro každý formát jiný význam (bajty metadata.jsonl / počet souborů / počet shardů)
+                raise ValueError(f"Formát výstupu {output_format.value} neodpovídá manifestu {manifest_path} ({manifest.output_format}).")
+
+        manifest.plan(folder, count)
+        manifest.save()
+
+        return manifest
+
+    def __clear_outputs(self, folder: str) -> None:
+        """
+        Smaže vygenerované výstupy složky (obrázky, metadata.jsonl, annotations-*.arrow, shardy i jejich .tmp).
+        """
+        folder_path = f"app/data/{folder}"
+        patterns = ("*.png", "metadata.jsonl", "annotations-*.arrow*", "shard-*.tar*")
+
+        for pattern in patterns:
+            for path in glob.glob(os.path.join(folder_path, pattern)):
+                os.remove(path)
+
+    def __work_units(self, folder: str, manifest: run_manifest, chunk_size: int) -> list[tuple[str, list[tuple[int, int]]]]:
+        #pracovní jednotky (složka, dokumenty)...dokumenty jsou rozdělené po chunk_size, aby se práce mezi procesy rozložila rovnoměrně
+        pending = manifest.pending()
+
+        return [(folder, pending[start:start + chunk_size]) for start in range(0, len(pending), chunk_size)]
+
+    def generate(self, train_count:int, test_count:int, validation_count:int, engine:engines = engines.DONUT,
+                 workers:int = 1, chunk_size:int = 16, seed:int | None = None, resume:bool = False,
+                 metadata_batch:int = 256, output_format:output_formats = output_formats.PNG, shard_size:int = 1000)->bool:
+        """
+        Vygeneruje datasety train/test/validation.
+
+        Každá složka má svůj `manifest.json` s hlavním seedem, odvozenými seedy dokumentů
+        a seznamem hotových dokumentů. Stejný seed dává stejné obrázky i anotace.
+
+        :param workers: Počet procesů, mezi které se rozdělí pracovní jednotky (1 = vše v hlavním procesu)
+        :param chunk_size: Maximální počet dokumentů v jedné pracovní jednotce
+        :param seed: Hlavní seed běhu (None = náhodný)
+        :param resume: Naváže na existující manifest a přeskočí hotové dokumenty
+        :param metadata_batch: Počet záznamů, po kterém se metadata.jsonl (u ARROW jeden annotations-*.arrow) zapisuje na disk
+        :param output_format: PNG (obrázky + metadata.jsonl), ARROW (obrázky + sloupcové anotace) nebo TAR (shardy s obrázky i anotacemi)
+        :param shard_size: Počet vzorků v jednom tar shardu
+        """
+
+        manifests: dict[str, run_manifest] = dict()
+        units: list[tuple[str, list[tuple[int, int]]]] = list()
+
+        for folder, count in (("train", train_count), ("test", test_count), ("validation", validation_count)):
+            if(count>0):
+                manifest = self.__open_manifest(folder, count * len(invoice_classes), engine, output_format, seed, resume)
+                manifests[folder] = manifest
+                units.extend(self.__work_units(folder, manifest, chunk_size))
+
+        #dokument je hotový až ve chvíli, kdy je jeho záznam zapsaný na disku
+        on_flush = lambda folder, ids, position: manifests[folder].mark_completed(ids, position)
+
+        #potvrzená pozice výstupu...co je za ní, zůstalo po pádu nepotvrzené a sink to zahodí
+        committed = {folder: manifest.committed for folder, manifest in manifests.items()}
+
+        if(output_format == output_formats.TAR):
+            sink = shard_writer(shard_size=shard_size, on_flush=on_flush, committed=committed)
+        elif(output_format == output_formats.ARROW):
+            sink = annotation_writer(max_records=metadata_batch, on_flush=on_flush, committed=committed)
+        else:
+            sink = metadata_writer(max_records=metadata_batch, on_flush=on_flush, committed=committed)
 
-        if(test_count>0):
-            self.__generate_folder("test", test_count, engine)
+        def write(folder: str, results: list[tuple[str, dict[str, Any], bytes | None]]) -> None:
+            for doc_id, output, image in results:
+                if(output_format == output_formats.TAR):
+                    sink.write(folder, doc_id, output, image)
+                else:
+                    sink.write(folder, doc_id, output)
 
-        if(validation_count>0):
-            self.__generate_folder("validation", validation_count, engine)
+        with sink:
+
+            if(workers <= 1):
+                for folder, documents in units:
+                    write(folder, _run_unit(folder, manifests[folder].reference_time, documents, engine, output_format, self.augmentation))
+
+                return True
+
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_run_unit, folder, manifests[folder].reference_time, documents, engine, output_format, self.augmentation)
+                           for folder, documents in units]
+
+                #metadata a shardy zapisuje jen hlavní proces, takže se záznamy z různých procesů nepromíchají
+                #zápis je v pořadí jednotek (ne v pořadí dokončení)...stejný seed dává stejné metadata i shardy pro libovolný počet procesů
+                for (folder, _), future in zip(units, futures):
+                    write(folder, future.result())
 
         return True
     
 
     pass
+
+
+def _run_unit(folder: str, reference_time: datetime, documents: list[tuple[int, int]], engine: engines,
+              output_format: output_formats = output_formats.PNG,
+              augmentation: dict[str, augmentation_config | None] | None = None) -> list[tuple[str, dict[str, Any], bytes | None]]:
+    """
+    Vstupní bod pracovního procesu. Seedy se nastavují pro každý dokument zvlášť v `_generate_unit`.
+    """
+    generator = invoice_generator(reference_time=reference_time) if augmentation is None else invoice_generator(reference_time=reference_time, augmentation=augmentation)
+    return generator._generate_unit(folder, documents, engine, output_format)
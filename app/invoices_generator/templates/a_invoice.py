@@ -1,4 +1,3 @@
-from datetime import datetime
 import json
 import random
 from typing import Any, Dict, final
@@ -242,7 +241,7 @@ class a_invoice(invoice):
         hr(bar_y, "thin")
         self._text(d,(margin_l, bar_y + self.mm(2)), "Generováno pro účely testování OCR.", font=self._f10, fill=self._INK)
         self._draw_center(d, self._A4_W_PX / 2, bar_y + self.mm(2), "Strana 1 z 1", self._f10, self._INK)
-        now_str = datetime.now().strftime("%d.%m.%Y %H:%M")
+        now_str = self.printed_at.strftime("%d.%m.%Y %H:%M")
         self._draw_right(d, self._A4_W_PX - margin_r, bar_y + self.mm(2), f"Tisk: {now_str}", self._f10, self._INK)
 
         # Uložení
@@ -3,7 +3,6 @@ import json
 import random
 from typing import Any, Dict, final
 
-from PIL import Image, ImageDraw, ImageFont
 from decimal import Decimal, ROUND_HALF_UP
 
 import pytesseract
@@ -42,8 +41,9 @@ class classic_invoice(invoice):
         margin_t = self.mm(15)
         margin_b = self.mm(15)
 
-        img = Image.new("RGB", (self._A4_W_PX, self._A4_H_PX), (255, 255, 255))
-        d = ImageDraw.Draw(img)
+        #s kreslí pevné části stránky (jsou v podkladu z page_cache), d proměnné části
+        #přes s jen to, co nezávisí na datech faktury ani na random, a jen před post_process (hlídá invoice._render_static)
+        img, d, s = self._page((255, 255, 255))
 
         # Černobílé barvy
         BLACK = (0, 0, 0)
@@ -54,8 +54,8 @@ class classic_invoice(invoice):
 
         # --- HLAVIČKA ---
         # Dvojitá linie nahoře
-        d.line([(margin_l, y), (self._A4_W_PX - margin_r, y)], fill=BLACK, width=3)
-        d.line([(margin_l, y + 3), (self._A4_W_PX - margin_r, y + 3)], fill=BLACK, width=1)
+        s.line([(margin_l, y), (self._A4_W_PX - margin_r, y)], fill=BLACK, width=3)
+        s.line([(margin_l, y + 3), (self._A4_W_PX - margin_r, y + 3)], fill=BLACK, width=1)
         
         y += self.mm(8)
         
@@ -74,17 +74,17 @@ class classic_invoice(invoice):
         self._text(d,(x_dic, y), label="DIČ: ", text=f"{self._safe(self.supplier.tax_id)}", font=self._f10, fill=BLACK, span_tag=span_tags.SUPPLIER_TAX_ID, hard_undersampling=False)
 
         y += self.mm(10)
-        d.line([(margin_l, y), (self._A4_W_PX - margin_r, y)], fill=LIGHT_GRAY, width=1)
+        s.line([(margin_l, y), (self._A4_W_PX - margin_r, y)], fill=LIGHT_GRAY, width=1)
         y += self.mm(8)
 
         # --- ADRESÁT V RÁMEČKU ---
         box_width = self.mm(80)
         box_height = self.mm(35)
-        d.rectangle((margin_l, y, margin_l + box_width, y + box_height), outline=BLACK, width=2)
+        s.rectangle((margin_l, y, margin_l + box_width, y + box_height), outline=BLACK, width=2)
         
         # Hlavička rámečku
-        d.rectangle((margin_l, y, margin_l + box_width, y + self.mm(8)), fill=LIGHT_GRAY)
-        self._text(d,(margin_l + self.mm(3), y + self.mm(2)), "FAKTURAČNÍ ADRESA", font=self._f10b, fill=BLACK)
+        s.rectangle((margin_l, y, margin_l + box_width, y + self.mm(8)), fill=LIGHT_GRAY)
+        self._text(s,(margin_l + self.mm(3), y + self.mm(2)), "FAKTURAČNÍ ADRESA", font=self._f10b, fill=BLACK)
         
         # Obsah
         content_y = y + self.mm(12)
@@ -102,10 +102,10 @@ class classic_invoice(invoice):
         info_x = margin_l + box_width + self.mm(20)
         info_y = y
         
-        self._text(d,(info_x, info_y), "ÚDAJE O FAKTUŘE", font=self._f12b, fill=BLACK)
+        self._text(s,(info_x, info_y), "ÚDAJE O FAKTUŘE", font=self._f12b, fill=BLACK)
         info_y += self.mm(8)
         
-        d.line([(info_x, info_y), (self._A4_W_PX - margin_r, info_y)], fill=BLACK, width=1)
+        s.line([(info_x, info_y), (self._A4_W_PX - margin_r, info_y)], fill=BLACK, width=1)
         info_y += self.mm(5)
         
         # Tabulka údajů
@@ -119,7 +119,7 @@ class classic_invoice(invoice):
         ]
         
         for label, value, tag in labels_values:
-            self._text(d,(info_x, info_y), label, font=self._f10, fill=BLACK, hard_undersampling=False)
+            self._text(s,(info_x, info_y), label, font=self._f10, fill=BLACK, hard_undersampling=False)
             self._text(d,(info_x + label_width, info_y), value, font=self._f10b, fill=BLACK, span_tag=tag, hard_undersampling=False)
             info_y += self.mm(5)
 
@@ -136,13 +136,13 @@ class classic_invoice(invoice):
 
         # Hlavička s tmavým pozadím
         header_height = self.mm(8)
-        d.rectangle((margin_l, y, self._A4_W_PX - margin_r, y + header_height), fill=GRAY)
+        s.rectangle((margin_l, y, self._A4_W_PX - margin_r, y + header_height), fill=GRAY)
         
         for i, header in enumerate(headers):
             if i in [0, 3,4, 5,6]:  # Číslo, množství, DPH% - střed
-                self._draw_center(d, x_cols[i] + col_abs[i] // 2, y + self.mm(2), header, self._f9b, (255, 255, 255))
+                self._draw_center(s, x_cols[i] + col_abs[i] // 2, y + self.mm(2), header, self._f9b, (255, 255, 255))
             else:  # Popis, MJ - vlevo
-                self._text(d,(x_cols[i] + self.mm(2), y + self.mm(2)), header, font=self._f9b, fill=(255, 255, 255))
+                self._text(s,(x_cols[i] + self.mm(2), y + self.mm(2)), header, font=self._f9b, fill=(255, 255, 255))
 
         y += header_height
 
@@ -3,7 +3,6 @@ import json
 import random
 from typing import Any, Dict, final
 
-from PIL import Image, ImageDraw, ImageFont
 from decimal import Decimal, ROUND_HALF_UP
 
 import pytesseract
@@ -40,8 +39,9 @@ class colorful_invoice(invoice):
         margin_b = self.mm(15)
 
         # Světlé pozadí s nádechem barvy
-        img = Image.new("RGB", (self._A4_W_PX, self._A4_H_PX), (250, 251, 255))
-        d = ImageDraw.Draw(img)
+        #s kreslí pevné části stránky (jsou v podkladu z page_cache), d proměnné části
+        #přes s jen to, co nezávisí na datech faktury ani na random, a jen před post_process (hlídá invoice._render_static)
+        img, d, s = self._page((250, 251, 255))
 
         # Barevná paleta
         PRIMARY = (138, 43, 226)  # Fialová
@@ -65,7 +65,7 @@ class colorful_invoice(invoice):
             g = int(PRIMARY[1] * (1 - ratio) + SECONDARY[1] * ratio)
             b = int(PRIMARY[2] * (1 - ratio) + SECONDARY[2] * ratio)
             
-            d.rectangle((0, i * step_height, self._A4_W_PX, (i + 1) * step_height), fill=(r, g, b))
+            s.rectangle((0, i * step_height, self._A4_W_PX, (i + 1) * step_height), fill=(r, g, b))
 
         # Text v hlavičce
         self._text(d,(margin_l, margin_t + self.mm(5)), self._safe(self.supplier.name), 
@@ -85,11 +85,11 @@ class colorful_invoice(invoice):
 
         # Karta 1 - Dodavatel
         card1_x = margin_l
-        d.rectangle((card1_x, y, card1_x + card_width, y + card_height), 
+        s.rectangle((card1_x, y, card1_x + card_width, y + card_height), 
                     fill=(255, 255, 255), outline=PRIMARY, width=2)
-        d.rectangle((card1_x, y, card1_x + card_width, y + self.mm(6)), fill=PRIMARY)
+        s.rectangle((card1_x, y, card1_x + card_width, y + self.mm(6)), fill=PRIMARY)
         
-        self._text(d,(card1_x + self.mm(3), y + self.mm(1)), "PRODÁVAJÍCÍ", font=self._f10b, fill=(255, 255, 255))
+        self._text(s,(card1_x + self.mm(3), y + self.mm(1)), "PRODÁVAJÍCÍ", font=self._f10b, fill=(255, 255, 255))
         self._text(d,(card1_x + self.mm(3), y + self.mm(8)), self._safe(self.supplier.name), font=self._f11b, fill=DARK)
         self._text(d,(card1_x + self.mm(3), y + self.mm(13)), self._safe(self.supplier.address)[:25], font=self._f9, fill=DARK)
         self._text(d,(card1_x + self.mm(3), y + self.mm(17)), label="IČ:", text=f"{self._safe(self.supplier.register_id)}", font=self._f9, fill=DARK,
@@ -99,11 +99,11 @@ class colorful_invoice(invoice):
 
         # Karta 2 - Kupující  
         card2_x = margin_l + card_width + self.mm(7.5)
-        d.rectangle((card2_x, y, card2_x + card_width, y + card_height), 
+        s.rectangle((card2_x, y, card2_x + card_width, y + card_height), 
                     fill=(255, 255, 255), outline=ACCENT, width=2)
-        d.rectangle((card2_x, y, card2_x + card_width, y + self.mm(6)), fill=ACCENT)
+        s.rectangle((card2_x, y, card2_x + card_width, y + self.mm(6)), fill=ACCENT)
         
-        self._text(d,(card2_x + self.mm(3), y + self.mm(1)), "KUPUJÍCÍ", font=self._f10b, fill=(255, 255, 255))
+        self._text(s,(card2_x + self.mm(3), y + self.mm(1)), "KUPUJÍCÍ", font=self._f10b, fill=(255, 255, 255))
         self._text(d,(card2_x + self.mm(3), y + self.mm(8)), self._safe(self.customer.name), font=self._f11b, fill=DARK)
         self._text(d,(card2_x + self.mm(3), y + self.mm(13)), self._safe(self.customer.address)[:25], font=self._f9, fill=DARK)
         self._text(d,(card2_x + self.mm(3), y + self.mm(17)), label="IČ:", text=f"{self._safe(self.customer.register_id)}", font=self._f9, fill=DARK,
@@ -113,11 +113,11 @@ class colorful_invoice(invoice):
 
         # Karta 3 - Platba
         card3_x = margin_l + 2 * card_width + self.mm(15)
-        d.rectangle((card3_x, y, card3_x + card_width, y + card_height), 
+        s.rectangle((card3_x, y, card3_x + card_width, y + card_height), 
                     fill=(255, 255, 255), outline=SECONDARY, width=2)
-        d.rectangle((card3_x, y, card3_x + card_width, y + self.mm(6)), fill=SECONDARY)
+        s.rectangle((card3_x, y, card3_x + card_width, y + self.mm(6)), fill=SECONDARY)
         
-        self._text(d,(card3_x + self.mm(3), y + self.mm(1)), "PLATBA", font=self._f10b, fill=(255, 255, 255))
+        self._text(s,(card3_x + self.mm(3), y + self.mm(1)), "PLATBA", font=self._f10b, fill=(255, 255, 255))
         self._text(d,(card3_x + self.mm(3), y + self.mm(8)), label="Datum:", text=f"{self._safe(self.issue_date)}", font=self._f9, fill=DARK,
                     span_tag=span_tags.ISSUE_DATE, hard_undersampling=False)
         self._text(d,(card3_x + self.mm(3), y + self.mm(12)), label="Splatnost:", text=f"{self._safe(self.due_date)}", font=self._f9, fill=DARK, span_tag=span_tags.DUE_DATE, hard_undersampling=False)
@@ -141,7 +141,7 @@ class colorful_invoice(invoice):
             g = int(ACCENT[1] * (1 - ratio) + PRIMARY[1] * ratio) 
             b = int(ACCENT[2] * (1 - ratio) + PRIMARY[2] * ratio)
             
-            d.rectangle((margin_l, y + i * step_height, self._A4_W_PX - margin_r, 
+            s.rectangle((margin_l, y + i * step_height, self._A4_W_PX - margin_r, 
                        y + (i + 1) * step_height), fill=(r, g, b))
 
         # Texty hlavičky
@@ -149,12 +149,12 @@ class colorful_invoice(invoice):
             text_x = x_cols[i] + self.mm(3)
             if i in [1, 2, 4]:  # Střed pro množství, jednotku, DPH
                 text_x = x_cols[i] + col_abs[i] // 2
-                self._draw_center(d, text_x, y + self.mm(2.5), header, self._f10b, (255, 255, 255))
+                self._draw_center(s, text_x, y + self.mm(2.5), header, self._f10b, (255, 255, 255))
             elif i in [3, 5]:  # Doprava pro ceny
                 text_x = x_cols[i] + col_abs[i] - self.mm(3)
-                self._draw_right(d, text_x, y + self.mm(2.5), header, self._f10b, (255, 255, 255))
+                self._draw_right(s, text_x, y + self.mm(2.5), header, self._f10b, (255, 255, 255))
             else:  # Vlevo pro popis
-                self._text(d,(text_x, y + self.mm(2.5)), header, font=self._f10b, fill=(255, 255, 255))
+                self._text(s,(text_x, y + self.mm(2.5)), header, font=self._f10b, fill=(255, 255, 255))
 
         y += header_height
 
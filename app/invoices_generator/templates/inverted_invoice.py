@@ -1,4 +1,3 @@
-from datetime import datetime
 import json
 from typing import Any, Dict, Optional, final
 
@@ -149,7 +148,7 @@ class inverted_invoice(invoice):
         footer_y += self.mm(5)
         
         self._text(d,(margin, footer_y), "Platbu prosím proveďte na výše uvedený bankovní účet.", font=self._f11, fill=self._INK)
-        self._draw_right(d, self._A4_W_PX - margin, footer_y, f"Datum tisku: {datetime.now().strftime('%d.%m.%Y')}", font=self._f11, fill=self._INK)
+        self._draw_right(d, self._A4_W_PX - margin, footer_y, f"Datum tisku: {self.printed_at.strftime('%d.%m.%Y')}", font=self._f11, fill=self._INK)
         
         img = self.post_process(img)
 
@@ -3,7 +3,6 @@ import json
 import random
 from typing import Any, Dict, final
 
-from PIL import Image, ImageDraw, ImageFont
 from decimal import Decimal, ROUND_HALF_UP
 
 import pytesseract
@@ -42,8 +41,9 @@ class modern_invoice(invoice):
 
         # Světle šedé pozadí
         BG_COLOR = (248, 249, 250)
-        img = Image.new("RGB", (self._A4_W_PX, self._A4_H_PX), BG_COLOR)
-        d = ImageDraw.Draw(img)
+        #s kreslí pevné části stránky (jsou v podkladu z page_cache), d proměnné části
+        #přes s jen to, co nezávisí na datech faktury ani na random, a jen před post_process (hlídá invoice._render_static)
+        img, d, s = self._page(BG_COLOR)
 
         # Barvy pro moderní design
         PRIMARY_COLOR = (33, 37, 41)
@@ -55,7 +55,7 @@ class modern_invoice(invoice):
 
         # --- HLAVIČKA S BAREVNÝM PRUHEM ---
         header_height = self.mm(25)
-        d.rectangle((0, 0, self._A4_W_PX, header_height), fill=ACCENT_COLOR)
+        s.rectangle((0, 0, self._A4_W_PX, header_height), fill=ACCENT_COLOR)
         
         # Logo/název vlevo v hlavičce
         self._text(d,(margin_l, margin_t), self._safe(self.supplier.name), font=self._f20b, fill=(255, 255, 255))
@@ -73,9 +73,9 @@ class modern_invoice(invoice):
 
         # Levý box - dodavatel
         supplier_box = (margin_l, y, margin_l + box_width, y + box_height)
-        d.rectangle(supplier_box, fill=(255, 255, 255), outline=BORDER_COLOR, width=2)
+        s.rectangle(supplier_box, fill=(255, 255, 255), outline=BORDER_COLOR, width=2)
         
-        self._text(d,(margin_l + self.mm(5), y + self.mm(3)), "DODAVATEL", font=self._f12b, fill=LIGHT_GRAY)
+        self._text(s,(margin_l + self.mm(5), y + self.mm(3)), "DODAVATEL", font=self._f12b, fill=LIGHT_GRAY)
         self._text(d,(margin_l + self.mm(5), y + self.mm(8)), self._safe(self.supplier.name), font=self._f14b, fill=PRIMARY_COLOR)
         self._text(d,(margin_l + self.mm(5), y + self.mm(13)), self._safe(self.supplier.address), font=self._f11, fill=PRIMARY_COLOR)
         self._text(d,(margin_l + self.mm(5), y + self.mm(18)), label="IČ: ", text=f"{self._safe(self.supplier.register_id)}", font=self._f11, fill=PRIMARY_COLOR,
@@ -84,10 +84,10 @@ class modern_invoice(invoice):
 
         # Pravý box - odběratel
         customer_box = (margin_l + box_width + self.mm(10), y, self._A4_W_PX - margin_r, y + box_height)
-        d.rectangle(customer_box, fill=(255, 255, 255), outline=BORDER_COLOR, width=2)
+        s.rectangle(customer_box, fill=(255, 255, 255), outline=BORDER_COLOR, width=2)
         
         customer_x = margin_l + box_width + self.mm(15)
-        self._text(d,(customer_x, y + self.mm(3)), "ODBĚRATEL", font=self._f12b, fill=LIGHT_GRAY)
+        self._text(s,(customer_x, y + self.mm(3)), "ODBĚRATEL", font=self._f12b, fill=LIGHT_GRAY)
         self._text(d,(customer_x, y + self.mm(8)), self._safe(self.customer.name), font=self._f14b, fill=PRIMARY_COLOR)
         self._text(d,(customer_x, y + self.mm(13)), self._safe(self.customer.address), font=self._f11, fill=PRIMARY_COLOR)
         if self.customer.register_id:
@@ -101,18 +101,18 @@ class modern_invoice(invoice):
 
         # --- DETAILY FAKTURY ---
         details_y = y
-        self._text(d,(margin_l, details_y), "Datum vystavení:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
+        self._text(s,(margin_l, details_y), "Datum vystavení:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
         self._text(d,(margin_l + self.mm(35), details_y), self._safe(self.issue_date), font=self._f11b, fill=PRIMARY_COLOR, span_tag=span_tags.ISSUE_DATE, hard_undersampling=False)
         
-        self._text(d,(margin_l, details_y + self.mm(6)), "Datum splatnosti:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
+        self._text(s,(margin_l, details_y + self.mm(6)), "Datum splatnosti:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
         self._text(d,(margin_l + self.mm(35), details_y + self.mm(6)), self._safe(self.due_date), font=self._f11b, fill=PRIMARY_COLOR, span_tag=span_tags.DUE_DATE, hard_undersampling=False)
 
         # Platební údaje vpravo
         payment_x = self._A4_W_PX // 2 + self.mm(10)
-        self._text(d,(payment_x, details_y), "Způsob platby:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
+        self._text(s,(payment_x, details_y), "Způsob platby:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
         self._text(d,(payment_x + self.mm(30), details_y), self._safe(self.payment.value), font=self._f11b, fill=PRIMARY_COLOR, span_tag=span_tags.PAYMENT_TYPE, hard_undersampling=False)
         
-        self._text(d,(payment_x, details_y + self.mm(6)), "Variabilní symbol:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
+        self._text(s,(payment_x, details_y + self.mm(6)), "Variabilní symbol:", font=self._f11, fill=LIGHT_GRAY, hard_undersampling=False)
         self._text(d,(payment_x + self.mm(30), details_y + self.mm(6)), self._safe(self.variable_symbol), font=self._f11b, fill=PRIMARY_COLOR, span_tag=span_tags.VARIABLE_SYMBOL, hard_undersampling=False)
 
         y += self.mm(20)
@@ -127,14 +127,14 @@ class modern_invoice(invoice):
 
         # Hlavička tabulky
         header_height = self.mm(12)
-        d.rectangle((margin_l, y, self._A4_W_PX - margin_r, y + header_height), fill=ACCENT_COLOR)
+        s.rectangle((margin_l, y, self._A4_W_PX - margin_r, y + header_height), fill=ACCENT_COLOR)
         
         for i, header in enumerate(headers):
             text_x = x_cols[i] + self.mm(3)
             if i > 1:  # Číselné sloupce zarovnáváme doprava
-                self._draw_center(d,  x_cols[i]+col_abs[i]/2, y + self.mm(3), header, self._f11b, (255, 255, 255))
+                self._draw_center(s,  x_cols[i]+col_abs[i]/2, y + self.mm(3), header, self._f11b, (255, 255, 255))
             else:
-                self._text(d,(text_x, y + self.mm(3)), header, font=self._f11b, fill=(255, 255, 255))
+                self._text(s,(text_x, y + self.mm(3)), header, font=self._f11b, fill=(255, 255, 255))
 
         y += header_height
 
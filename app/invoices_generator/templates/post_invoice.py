@@ -2,7 +2,6 @@ from datetime import datetime
 import json
 from typing import Any, Dict, final
 
-from PIL import Image, ImageDraw, ImageFont
 from decimal import Decimal, ROUND_HALF_UP
 
 import pytesseract
@@ -48,24 +47,25 @@ class post_invoice(invoice):
         _BORDER = (153, 153, 153)
 
         # Plátno
-        img = Image.new("RGB", (self._A4_W_PX, self._A4_H_PX), self._BG)
-        d = ImageDraw.Draw(img)
+        #s kreslí pevné části stránky (jsou v podkladu z page_cache), d proměnné části
+        #přes s jen to, co nezávisí na datech faktury ani na random, a jen před post_process (hlídá invoice._render_static)
+        img, d, s = self._page(self._BG)
 
         # Start Y
         y = margin_t
 
         # --- HLAVIČKA S POZADÍM ---
         header_h = self.mm(15)
-        d.rectangle((margin_l, y, self._A4_W_PX - margin_r, y + header_h),
+        s.rectangle((margin_l, y, self._A4_W_PX - margin_r, y + header_h),
                     fill=_HEADER_BG, outline=_BORDER, width=2)
 
         # Text hlavičky
-        self._text(d,(margin_l + self.mm(15), y + self.mm(8)), "FAKTURA daňový doklad",
+        self._text(s,(margin_l + self.mm(15), y + self.mm(8)), "FAKTURA daňový doklad",
                 font=self._f14b, fill=self._INK)
 
         # Variabilní symbol vpravo
         vs_x = self._A4_W_PX - margin_r - self.mm(15)
-        self._draw_right(d, vs_x, y + self.mm(2), "Variabilní symbol pro platbu", self._f10, self._INK, undersampling=False)
+        self._draw_right(s, vs_x, y + self.mm(2), "Variabilní symbol pro platbu", self._f10, self._INK, undersampling=False)
         self._draw_right(d, vs_x, y + self.mm(8), self._safe(self.variable_symbol), self._f14b, self._INK, tag=span_tags.VARIABLE_SYMBOL, undersampling=False)
 
         y += header_h + self.mm(15)
@@ -82,12 +82,12 @@ class post_invoice(invoice):
         # Číslo faktury
         self._text(d,(left_x, y_left), label="Č.",text=f"{self._safe(self.invoice_number)}", font=self._f10b, fill=self._INK, span_tag=span_tags.INVOICE_NUMBER, hard_undersampling=False)
         y_left += self.mm(4)
-        self._text(d,(left_x, y_left), "- pro účely kontrolního hlášení DPH v ČR",
+        self._text(s,(left_x, y_left), "- pro účely kontrolního hlášení DPH v ČR",
                 font=self._f8, fill=self._INK)
         y_left += self.mm(10)
 
         # Dodavatel
-        self._text(d,(left_x, y_left), "Dodavatel:", font=self._f10b, fill=self._INK)
+        self._text(s,(left_x, y_left), "Dodavatel:", font=self._f10b, fill=self._INK)
         #y_left += self.mm(5)
 
         # Konstantní symbol + ID klienta (pokud máš)
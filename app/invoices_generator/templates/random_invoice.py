@@ -12,6 +12,7 @@ from app.invoices_generator.core.enumerates.span_tags import span_tags
 from app.invoices_generator.core.invoice import invoice
 from app.invoices_generator.core.relationship import relationship
 from app.invoices_generator.utility.json_encoder import json_encoder
+from app.invoices_generator.utility.skyline_packer import skyline_packer
 
 @final
 class random_invoice(invoice):
@@ -183,7 +184,7 @@ class random_invoice(invoice):
         Jednotlivé bloky se náhodně rozmístí, aby se nepřekrývaly.
         """
         self.excluded = []
-        margin = self.mm(25)
+        margin = self.mm(15)
         
         img = Image.new("RGB", (self._A4_W_PX, self._A4_H_PX), self._BG)
         d = ImageDraw.Draw(img)
@@ -201,36 +202,17 @@ class random_invoice(invoice):
         ]
         
         random.shuffle(blocks)
-        placed_blocks = []
-        
-        y = self.mm(8) 
-        # Pokus o umístění každého bloku na náhodné místo bez překrývání
-        for block in blocks:
-            placed = False
-            attempts = 0
-            while not placed and attempts < 200:
-                x = random.randint(margin, self._A4_W_PX - margin - block["width"])
-                
-                new_rect = (x, y, x + block["width"], y + block["height"])
-                overlap = False
-                
-                for placed_block in placed_blocks:
-                    placed_rect = placed_block["rect"]
-                    if (new_rect[0] < placed_rect[2] and new_rect[2] > placed_rect[0] and
-                        new_rect[1] < placed_rect[3] and new_rect[3] > placed_rect[1]):
-                        overlap = True
-                        break
-                
-                if not overlap:
-                    block["rect"] = new_rect
-                    block["draw_func"](d, x, y)
-                    placed_blocks.append(block)
-                    placed = True
-                attempts += 1
-            y += block["height"]
-            if not placed:
-                print(f"Nepodařilo se umístit blok {block['id']} po {attempts} pokusech. Možná je stránka příliš plná.")
-        
+
+        # Rozmístění bloků skyline packerem...nejdřív volně (náhodné mezery a výběr z více pozic),
+        # když se to na stránku nevejde, tak co nejtěsněji od nejvyššího bloku
+        layout = self._layout(blocks, margin, gaps=True)
+        if layout is None:
+            blocks.sort(key=lambda b: b["height"], reverse=True)
+            layout = self._layout(blocks, margin, gaps=False, force=True)
+
+        for block, (x, y) in zip(blocks, layout):
+            block["draw_func"](d, x, y)
+
         img = self.post_process(img)
 
         # d = ImageDraw.Draw(img)
@@ -245,6 +227,30 @@ class random_invoice(invoice):
 
         return True
 
+    def _layout(self, blocks: List[Dict[str, Any]], margin: int, gaps: bool, force: bool = False) -> List[Tuple[int, int]] | None:
+        """
+        Pozice (x, y) pro bloky v daném pořadí, nebo None, pokud se některý nevejde.
+
+        :param gaps: Náhodné mezery pod bloky a výběr mezi více volnými pozicemi (jinak co nejvýš)
+        :param force: Blok, který se nevejde, se nezahodí, ale položí pod nejnižší blok (přečnívá stránku)
+        """
+        packer = skyline_packer(margin, self.mm(8), self._A4_W_PX - margin, self._A4_H_PX - self.mm(8))
+
+        layout: List[Tuple[int, int]] = []
+        for block in blocks:
+            w, h = block["width"], block["height"]
+            gap = random.randint(self.mm(2), self.mm(10)) if gaps else 0
+
+            position = packer.place(w, h + gap, slack=self.mm(20) if gaps else 0) or packer.place(w, h)
+            if position is None:
+                if not force:
+                    return None
+                print(f"Blok {block['id']} se nevejde na stránku, umístí se pod ostatní.")
+                position = packer.stack(w, h)
+
+            layout.append(position)
+        return layout
+
     def _draw_supplier_block(self, d: ImageDraw.ImageDraw, x: int, y: int) -> None:
         """Vykreslí blok s informacemi o dodavateli s náhodným vyloučením polí."""
         self._text(d,(x, y), random.choice(self.labels["supplier_labels"]), font=self._f12b, fill=self._INK)
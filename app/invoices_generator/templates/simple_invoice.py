@@ -1,4 +1,3 @@
-from datetime import datetime
 import json
 from typing import Any, Dict, Optional, final
 
@@ -181,7 +180,7 @@ class simple_invoice(invoice):
         hr(self._A4_H_PX - self.mm(15), "strong")
         
         self._draw_center(d, self._A4_W_PX / 2, self._A4_H_PX - self.mm(12), "Strana 1 z 1", self._f10, self._INK)
-        self._text(d,(self._A4_W_PX - margin_r, self._A4_H_PX - self.mm(12)), f"Tisk: {datetime.now().strftime('%d.%m.%Y %H:%M')}", font=self._f10, fill=self._INK)
+        self._text(d,(self._A4_W_PX - margin_r, self._A4_H_PX - self.mm(12)), f"Tisk: {self.printed_at.strftime('%d.%m.%Y %H:%M')}", font=self._f10, fill=self._INK)
 
         img = self.post_process(img)
 
@@ -0,0 +1,232 @@
+import glob
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+ANNOTATION_PATTERN: str = "annotations-*.arrow"
+
+_box = pa.list_(pa.float64(), 4)
+
+#sloupce pro záznamy LayoutLMv3 (to_json_layoutlmv2)...vnořené seznamy jsou list sloupce
+LAYOUT_SCHEMA: pa.Schema = pa.schema([
+    ("file_name", pa.string()),
+    ("tokens", pa.list_(pa.string())),
+    ("token_boxes", pa.list_(_box)),
+    ("token_tags", pa.list_(pa.int32())),
+    ("span_token_indices", pa.list_(pa.list_(pa.int32()))),
+    ("span_boxes", pa.list_(_box)),
+    ("span_tags", pa.list_(pa.int32())),
+    ("span_index_a", pa.list_(pa.int32())),
+    ("span_index_b", pa.list_(pa.int32())),
+    ("relationship_type", pa.list_(pa.int32())),
+])
+
+#záznamy Donut mají libovolně vnořený gt_parse...ukládá se jako json řetězec
+DONUT_SCHEMA: pa.Schema = pa.schema([
+    ("file_name", pa.string()),
+    ("gt_parse", pa.string()),
+])
+
+
+def list_annotation_parts(folder: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(folder, ANNOTATION_PATTERN)))
+
+
+def record_to_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Převede záznam ve tvaru řádku metadata.jsonl na řádek Arrow tabulky.
+    """
+    if "data" not in record:
+        return {"file_name": record["file_name"], "gt_parse": json.dumps(record["ground_truth"]["gt_parse"], ensure_ascii=False)}
+
+    data = record["data"]
+    return {
+        "file_name": record["file_name"],
+        "tokens": data["tokens"]["tokens"],
+        "token_boxes": data["tokens"]["boxes"],
+        "token_tags": data["tokens"]["tags"],
+        "span_token_indices": data["spans"]["token_indices"],
+        "span_boxes": data["spans"]["boxes"],
+        "span_tags": data["spans"]["tags"],
+        "span_index_a": data["relationships"]["span_index_a"],
+        "span_index_b": data["relationships"]["span_index_b"],
+        "relationship_type": data["relationships"]["relationship_type"],
+    }
+
+
+def row_to_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Opak `record_to_row`...vrátí záznam ve tvaru řádku metadata.jsonl.
+    """
+    if "gt_parse" in row:
+        return {"file_name": row["file_name"], "ground_truth": {"gt_parse": json.loads(row["gt_parse"])}}
+
+    return {
+        "file_name": row["file_name"],
+        "data": {
+            "tokens": {"tokens": row["tokens"], "boxes": row["token_boxes"], "tags": row["token_tags"]},
+            "spans": {"token_indices": row["span_token_indices"], "boxes": row["span_boxes"], "tags": row["span_tags"]},
+            "relationships": {"span_index_a": row["span_index_a"], "span_index_b": row["span_index_b"],
+                              "relationship_type": row["relationship_type"]},
+        }
+    }
+
+
+def write_annotations(path: str, records: List[Dict[str, Any]]) -> None:
+    """
+    Zapíše záznamy (ve tvaru řádků metadata.jsonl) do jednoho Arrow IPC souboru přes `.tmp` a přejmenování.
+    """
+    rows = [record_to_row(record) for record in records]
+    schema = DONUT_SCHEMA if rows and "gt_parse" in rows[0] else LAYOUT_SCHEMA
+    table = pa.Table.from_pylist(rows, schema=schema)
+
+    with pa.OSFile(path + ".tmp", "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+
+class annotation_store:
+    """
+    Sloupcové anotace jedné složky datasetu uložené v Arrow IPC souborech (`annotations-*.arrow`).
+
+    Soubory se memory-mapují, takže anotace nezabírají heap a DataLoader workery sdílejí stránky
+    přes page cache místo vlastních kopií seznamů slovníků. `__getitem__` vezme zero-copy řez
+    tabulky a do Python objektů převede jen jeden řádek. Při picklování (předání do workeru)
+    se tabulka zahodí a worker si soubory namapuje znovu.
+
+    :param folder: Složka datasetu (např. app/data/train)
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.paths: List[str] = list_annotation_parts(folder)
+        self._table: pa.Table | None = None
+
+    @property
+    def table(self) -> pa.Table:
+        if self._table is None:
+            tables = [pa.ipc.open_file(pa.memory_map(path, "r")).read_all() for path in self.paths]
+            self._table = pa.concat_tables(tables) if tables else LAYOUT_SCHEMA.empty_table()
+        return self._table
+
+    def exists(self) -> bool:
+        return bool(self.paths)
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, index: int) -> Dict[str, Any]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return row_to_record(self.table.slice(index, 1).to_pylist()[0])
+
+    def list_lengths(self, column: str) -> List[int]:
+        """
+        Délky list sloupce pro všechny řádky (např. počet tokenů dokumentů) bez převodu řádků do Pythonu.
+        """
+        return pc.list_value_length(self.table.column(column)).to_pylist()
+
+    def iter_column(self, column: str) -> Iterator[Any]:
+        """
+        Hodnoty jednoho sloupce po částech tabulky...do Pythonu se naráz převede jen jedna část.
+        """
+        for chunk in self.table.column(column).chunks:
+            yield from chunk.to_pylist()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for batch in self.table.to_batches():
+            for row in batch.to_pylist():
+                yield row_to_record(row)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_table"] = None
+        return state
+
+
+class annotation_writer:
+    """
+    Zápis anotací do Arrow IPC souborů (náhrada `metadata_writer` pro output_formats.ARROW).
+
+    Záznamy se sbírají v paměti a každé vyprázdnění bufferu zapíše jeden nový soubor
+    `annotations-XXXXXX.arrow` (přes `.tmp` a přejmenování), takže po pádu nezůstane rozepsaný soubor
+    a hotové soubory se už nikdy nemění. Číslování navazuje na existující soubory (resume).
+    `on_flush` dostane jako pozici počet souborů včetně nového. Soubory za potvrzeným počtem z `committed`
+    (zapsané těsně před pádem, ale nepotvrzené v manifestu) se před prvním zápisem smažou.
+
+    :param root: Kořenová složka datasetu
+    :param max_records: Počet záznamů, po kterém se buffer zapisuje
+    :param max_seconds: Maximální doba, po kterou záznam zůstane jen v paměti
+    :param on_flush: Zavolá se s (split, id dokumentů, počet souborů) po zapsání souboru
+    :param committed: Potvrzený počet souborů pro jednotlivé splity
+    """
+
+    def __init__(self, root: str = "app/data", max_records: int = 1024, max_seconds: float = 30.0,
+                 on_flush: Callable[[str, List[str], int], None] | None = None, committed: Dict[str, int] | None = None):
+        self.root = root
+        self.max_records = max_records
+        self.max_seconds = max_seconds
+        self.on_flush = on_flush
+        self.committed = committed or dict()
+
+        self._buffers: Dict[str, List[Tuple[str, Dict[str, Any]]]] = dict()
+        self._last_flush: Dict[str, float] = dict()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def write(self, folder: str, doc_id: str, record: Dict[str, Any]) -> None:
+        buffer = self._buffers.setdefault(folder, list())
+        buffer.append((doc_id, record))
+
+        last_flush = self._last_flush.setdefault(folder, time.monotonic())
+
+        if len(buffer) >= self.max_records or time.monotonic() - last_flush >= self.max_seconds:
+            self.flush(folder)
+
+    def flush(self, folder: str | None = None) -> None:
+        folders = [folder] if folder is not None else list(self._buffers.keys())
+
+        for f in folders:
+            buffer = self._buffers.get(f)
+            self._last_flush[f] = time.monotonic()
+
+            if not buffer:
+                continue
+
+            folder_path = os.path.join(self.root, f)
+
+            committed = self.committed.pop(f, None)
+            if committed is not None:
+                for path in list_annotation_parts(folder_path)[committed:]:
+                    os.remove(path)
+
+            existing = list_annotation_parts(folder_path)
+            index = int(os.path.basename(existing[-1])[len("annotations-"):-len(".arrow")]) + 1 if existing else 0
+
+            write_annotations(os.path.join(folder_path, f"annotations-{index:06d}.arrow"), [record for _, record in buffer])
+
+            self._buffers[f] = list()
+
+            if self.on_flush is not None:
+                self.on_flush(f, [doc_id for doc_id, _ in buffer], index + 1)
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> "annotation_writer":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
@@ -0,0 +1,227 @@
+from dataclasses import dataclass
+import math
+import random
+from threading import Lock, local
+from typing import Callable, Dict, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+@dataclass(frozen=True)
+class augmentation_config:
+    """
+    Pravděpodobnosti a parametry jednotlivých kroků augmentace (efekty naskenovaného dokumentu).
+
+    Kroky se provádějí v pořadí rotace, grayscale, blur, šum, zažloutnutí, čáry, grayscale.
+    Pravděpodobnost 0 krok vypíná.
+
+    :param rotation_p: Pravděpodobnost rotace o úhel z <-max_angle, max_angle> stupňů
+    :param grayscale_p: Pravděpodobnost převodu do šedi před ostatními efekty
+    :param blur_p: Pravděpodobnost Gaussova rozmazání s poloměrem z `blur_radius`
+    :param noise_p: Pravděpodobnost šumu sůl a pepř s podílem pixelů z `noise_amount`
+    :param yellowing_p: Pravděpodobnost prolnutí s barvou `yellowing_color` s váhou `yellowing_alpha`
+    :param lines_p: Pravděpodobnost `lines_count` čar (škrábance, stopy skeneru) s tloušťkou z `lines_width`
+    :param final_grayscale_p: Pravděpodobnost převodu do šedi na konci
+    """
+
+    rotation_p: float = 0.4
+    max_angle: float = 2.0
+
+    grayscale_p: float = 0.3
+
+    blur_p: float = 0.3
+    blur_radius: Tuple[float, float] = (0.5, 1.5)
+
+    noise_p: float = 0.3
+    noise_amount: Tuple[float, float] = (0.005, 0.02)
+
+    yellowing_p: float = 0.25
+    yellowing_alpha: float = 0.08
+    yellowing_color: Tuple[int, int, int] = (240, 230, 200)
+
+    lines_p: float = 0.2
+    lines_count: Tuple[int, int] = (1, 3)
+    lines_width: Tuple[int, int] = (1, 3)
+    lines_color: Tuple[int, int, int] = (150, 150, 150)
+
+    final_grayscale_p: float = 0.3
+
+
+#výchozí augmentace při generování podle složky datasetu...složka, která tu není, se neaugmentuje
+#train se ukládá čistý, augmentuje se až při načítání (každou epochu jinak), test a validace mají pevné efekty
+default_augmentations: Dict[str, augmentation_config | None] = {
+    "train": None,
+    "test": augmentation_config(),
+    "validation": augmentation_config(),
+}
+
+_WHITE = (255, 255, 255)
+
+#luminance (ITU-R 601) do všech tří kanálů...cv2.transform s touto maticí převede RGB do šedi na místě
+_GRAYSCALE = np.array([[0.299, 0.587, 0.114]] * 3, dtype=np.float32)
+
+
+class augmentation_pipeline:
+    """
+    Augmentace obrázku dokumentu jedním průchodem nad jedním uint8 bufferem.
+
+    - obrázek se jednou zkopíruje do bufferu [H, W, 3], všechny efekty pak běží na místě (cv2, bez nových obrázků)
+    - rotace s expanzí plátna a zmenšením zpět na původní rozměr je jedna afinní transformace do druhého bufferu,
+      stejná matice se předá `on_transform`, aby se transformovaly i b-boxy
+    - šum se nelosuje pro každý pixel, losují se jen indexy zasažených pixelů (~1 % obrázku)
+    - buffery jsou pro každé vlákno (worker procesu) vlastní a znovu se používají
+
+    Vrácený obrázek může sdílet paměť s bufferem vlákna (Image.fromarray podle verze Pillow)...platí do dalšího volání `apply` ve stejném vlákně
+    (faktura ho hned ukládá, dataset ho hned předává procesoru). Pokud se žádný krok nevylosuje, vrací se vstup beze změny.
+
+    Náhoda se losuje jen z `random`, takže výsledek určuje seed dokumentu při generování
+    a seed workeru DataLoaderu při načítání (PyTorch ho nastavuje každému workeru jinak, np.random ne).
+    """
+
+    ############################
+    ####                    ####
+    ####     PROPERTIES     ####
+    ####                    ####
+    ############################
+
+    _pipelines: Dict[augmentation_config, "augmentation_pipeline"] = dict()
+    _lock: Lock = Lock()
+
+    def __init__(self, config: augmentation_config):
+        self.config = config
+        self._scratch = local()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @classmethod
+    def shared(cls, config: augmentation_config) -> "augmentation_pipeline":
+        """
+        Pipeline pro danou konfiguraci sdílená v rámci procesu (a s ní i buffery jeho vláken).
+        """
+        pipeline = cls._pipelines.get(config)
+        if pipeline is None:
+            with cls._lock:
+                pipeline = cls._pipelines.setdefault(config, cls(config))
+        return pipeline
+
+    def apply(self, img: Image.Image, on_transform: Callable[[np.ndarray], None] | None = None) -> Image.Image:
+        """
+        Vylosuje a provede kroky augmentace.
+
+        :param on_transform: Dostane homogenní matici 3x3 (v pixelech obrázku) geometrické transformace, pokud nějaká proběhla
+        """
+        c = self.config
+
+        #nejdřív se vylosuje, co se provede...bez efektu se obrázek vůbec nekopíruje
+        angle = random.uniform(-c.max_angle, c.max_angle) if random.random() < c.rotation_p else 0.0
+        grayscale = random.random() < c.grayscale_p
+        blur = random.uniform(*c.blur_radius) if random.random() < c.blur_p else 0.0
+        noise = random.uniform(*c.noise_amount) if random.random() < c.noise_p else 0.0
+        yellowing = random.random() < c.yellowing_p
+        lines = random.randint(*c.lines_count) if random.random() < c.lines_p else 0
+        final_grayscale = random.random() < c.final_grayscale_p
+
+        if not (angle or grayscale or blur or noise or yellowing or lines or final_grayscale):
+            return img
+
+        w, h = img.size
+        buffer, spare = self._buffers(w, h)
+        np.copyto(buffer, np.asarray(img if img.mode == "RGB" else img.convert("RGB")))
+
+        if angle:
+            M = rotation_matrix(w, h, angle)
+            cv2.warpAffine(buffer, M[:2], (w, h), dst=spare, flags=cv2.INTER_CUBIC,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=_WHITE)
+            buffer, spare = spare, buffer
+            if on_transform is not None:
+                on_transform(M)
+
+        if grayscale:
+            cv2.transform(buffer, _GRAYSCALE, dst=buffer)
+
+        if blur:
+            cv2.GaussianBlur(buffer, (0, 0), sigmaX=blur, dst=buffer)
+
+        if noise:
+            self._salt_and_pepper(buffer, noise)
+
+        if yellowing:
+            a = c.yellowing_alpha
+            #prolnutí s konstantní barvou jako afinní transformace barev: (1-a)*pixel + a*barva
+            m = np.hstack([np.eye(3, dtype=np.float32) * (1 - a), a * np.array(c.yellowing_color, dtype=np.float32)[:, None]])
+            cv2.transform(buffer, m, dst=buffer)
+
+        for _ in range(lines):
+            x1, y1 = random.randint(0, w), random.randint(0, h)
+            x2, y2 = random.randint(0, w), random.randint(0, h)
+            cv2.line(buffer, (x1, y1), (x2, y2), c.lines_color, thickness=random.randint(*c.lines_width))
+
+        if final_grayscale:
+            cv2.transform(buffer, _GRAYSCALE, dst=buffer)
+
+        return Image.fromarray(buffer)
+
+    def _buffers(self, w: int, h: int) -> Tuple[np.ndarray, np.ndarray]:
+        scratch = self._scratch
+        if getattr(scratch, "size", None) != (w, h):
+            scratch.size = (w, h)
+            scratch.buffers = (np.empty((h, w, 3), dtype=np.uint8), np.empty((h, w, 3), dtype=np.uint8))
+        return scratch.buffers
+
+    def _salt_and_pepper(self, buffer: np.ndarray, amount: float) -> None:
+        pixels = buffer.reshape(-1, 3)
+        n = pixels.shape[0]
+
+        #každý dokument má vlastní vzor...generátor se seeduje z `random`, takže vzor určuje seed dokumentu (workeru)
+        rng = np.random.default_rng(random.getrandbits(64))
+        indices = rng.integers(0, n, size=int(amount * n))
+
+        #polovina zasažených pixelů bílá, polovina černá
+        half = indices.size // 2
+        pixels[indices[:half]] = 255
+        pixels[indices[half:]] = 0
+
+
+def rotation_matrix(w: int, h: int, angle_deg: float) -> np.ndarray:
+    """
+    Homogenní matice rotace o `angle_deg` stupňů kolem středu plátna w x h s expanzí plátna
+    (celý otočený obsah zůstane vidět) a zmenšením zpět na w x h.
+    """
+    #střed plátna
+    cx, cy = w/2.0, h/2.0
+    θ = math.radians(-angle_deg)
+
+    T1 = np.array([[1,0,-cx],[0,1,-cy],[0,0,1]], float)
+    R  = np.array([[math.cos(θ), -math.sin(θ), 0],
+                [math.sin(θ),  math.cos(θ), 0],
+                [0,0,1]], float)
+    T2c = np.array([[1,0,cx],[0,1,cy],[0,0,1]], float)
+
+    #rotace podle středu plátna
+    M_center = T2c @ R @ T1
+
+    #kvůli EXPANZI...spočítám kam se transformovali rohové body
+    corners = np.array([[0,   w,   w,   0],
+                        [0,   0,   h,   h],
+                        [1,   1,   1,   1]], float) #[roh 1, roh2, roh3, roh4]
+    tc = M_center @ corners #(3,3)*(3,4) = (3,4)...[t-roh1, t-roh2, t-roh3, t-roh4]
+    ox = -tc[0,:].min()
+    oy = -tc[1,:].min()
+
+    Toffset = np.array([[1,0,ox],[0,1,oy],[0,0,1]], float)
+
+    #downscale zvětšeného plátna
+    scale_w = w / (tc[0,:].max() + ox)
+    scale_h = h / (tc[1,:].max() + oy)
+
+    S = np.array([[scale_w, 0, 0],
+                [0,  scale_h, 0],
+                [0,0,1]], float)
+
+    return S @ Toffset @ M_center
@@ -0,0 +1,88 @@
+from typing import List, Sequence
+
+import numpy as np
+
+
+class box_array:
+    """
+    Souvislé pole b-boxů (left, top, right, bottom) ve float32 [N, 4].
+
+    Boxy se přidávají po jednom (pole se při zaplnění zdvojnásobí), transformují se ale všechny
+    najednou jedním maticovým násobením.
+
+    :param scale: Velikost plátna v jednotkách boxů (šířka, výška)...např. (1, 1) pro relativní souřadnice
+    :param capacity: Počáteční kapacita
+    """
+
+    def __init__(self, scale: Sequence[float] = (1.0, 1.0), capacity: int = 256):
+        self.scale = (float(scale[0]), float(scale[1]))
+        self._data = np.empty((capacity, 4), dtype=np.float32)
+        self._size = 0
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @classmethod
+    def from_list(cls, boxes: Sequence[Sequence[float]], scale: Sequence[float] = (1.0, 1.0)) -> "box_array":
+        output = cls(scale, capacity=max(1, len(boxes)))
+        if len(boxes):
+            output._data[:] = boxes
+            output._size = len(boxes)
+        return output
+
+    def append(self, box: Sequence[float]) -> int:
+        """
+        Přidá box a vrátí jeho index.
+        """
+        if self._size == self._data.shape[0]:
+            grown = np.empty((max(1, 2 * self._size), 4), dtype=np.float32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+
+        self._data[self._size] = box
+        self._size += 1
+        return self._size - 1
+
+    @property
+    def array(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        return self.array[index]
+
+    def transform(self, M: np.ndarray, width: float, height: float) -> None:
+        """
+        Transformuje všechny boxy homogenní maticí M (3x3) zadanou v pixelech plátna `width` x `height`.
+
+        Transformují se všechny 4 rohy každého boxu a nový box je jejich obálka.
+        """
+        if not self._size:
+            return
+
+        #přepočet jednotek boxů na pixely a zpět...M' = D⁻¹ @ M @ D
+        sx, sy = width / self.scale[0], height / self.scale[1]
+        D = np.diag([sx, sy, 1.0])
+        D_inv = np.diag([1.0 / sx, 1.0 / sy, 1.0])
+        M = (D_inv @ np.asarray(M, dtype=np.float64) @ D).astype(np.float32)
+
+        boxes = self.array
+        # čtyři rohy v homogenních souřadnicích [N, 4, 3]...(l,t), (r,t), (r,b), (l,b)
+        corners = np.ones((self._size, 4, 3), dtype=np.float32)
+        corners[:, :, 0] = boxes[:, [0, 2, 2, 0]]
+        corners[:, :, 1] = boxes[:, [1, 1, 3, 3]]
+
+        tc = corners.reshape(-1, 3) @ M.T   #(4N,3)*(3,3) = (4N,3)
+        xy = (tc[:, :2] / tc[:, 2:]).reshape(self._size, 4, 2)
+
+        boxes[:, :2] = xy.min(axis=1)
+        boxes[:, 2:] = xy.max(axis=1)
+
+    def tolist(self, decimals: int = 6) -> List[List[float]]:
+        #float32 by se do jsonu zapsal s šumem za přesností...zaokrouhlí se
+        return self.array.astype(np.float64).round(decimals).tolist()
@@ -0,0 +1,66 @@
+from threading import Lock
+from typing import Dict, Tuple
+
+from PIL.ImageFont import FreeTypeFont, Layout, truetype
+
+
+class font_registry:
+    """
+    Registr fontů sdílený v rámci celého procesu.
+
+    Každý řez (cesta, velikost, DPI) se z disku načte a naparsuje jen jednou,
+    všechny instance faktur pak dostávají stejný objekt `FreeTypeFont`.
+    Při generování přes více procesů má každý proces vlastní registr.
+    """
+
+    ############################
+    ####                    ####
+    ####     PROPERTIES     ####
+    ####                    ####
+    ############################
+
+    _fonts: Dict[Tuple[str, float, int], FreeTypeFont] = dict()
+    _lock: Lock = Lock()
+
+    hits: int = 0
+    misses: int = 0
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @classmethod
+    def get(cls, path: str, size: float, dpi: int) -> FreeTypeFont:
+        key = (path, size, dpi)
+
+        font = cls._fonts.get(key)
+        if font is not None:
+            cls.hits += 1
+            return font
+
+        with cls._lock:
+            #mezitím ho mohlo načíst jiné vlákno
+            font = cls._fonts.get(key)
+            if font is None:
+                SCALE: float = dpi/100.0 #přibližný a zjednodušený výpočet
+                #BASIC layout (bez kerningu)...šířky z text_metrics (součet šířek glyfů) pak sedí s vykresleným textem i tam, kde je libraqm
+                font = truetype(path, size=size * SCALE, layout_engine=Layout.BASIC)
+                cls._fonts[key] = font
+                cls.misses += 1
+            else:
+                cls.hits += 1
+
+        return font
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {"hits": cls.hits, "misses": cls.misses, "fonts": len(cls._fonts)}
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._fonts.clear()
+            cls.hits = 0
+            cls.misses = 0
@@ -0,0 +1,122 @@
+import json
+import os
+import time
+from typing import IO, Any, Callable, Dict, List, Tuple
+
+try:
+    import orjson # type: ignore[import]
+except ImportError:
+    orjson = None
+
+try:
+    import ujson # type: ignore[import]
+except ImportError:
+    ujson = None
+
+
+def dumps(obj: Any, fast: bool = True) -> str:
+    """
+    Serializace jednoho záznamu na řádek jsonl. Pokud je k dispozici orjson nebo ujson, použije se.
+    """
+    if fast and orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    if fast and ujson is not None:
+        return ujson.dumps(obj, ensure_ascii=False)
+    return json.dumps(obj, ensure_ascii=False)
+
+
+class metadata_writer:
+    """
+    Bufferovaný zápis záznamů do `metadata.jsonl`.
+
+    Pro každý split (train/test/validation) drží jeden otevřený soubor a záznamy sbírá v paměti.
+    Buffer se vyprázdní po `max_records` záznamech nebo po `max_seconds` od posledního zápisu.
+    Po zápisu a fsync dávky dostane `on_flush` i novou délku souboru, kterou si manifest uloží spolu s id dokumentů.
+    Po pádu (rozepsaný poslední řádek, nebo dávka zapsaná, ale ještě nepotvrzená v manifestu) se soubor
+    při otevření zkrátí na potvrzenou délku z `committed` a zahozené dokumenty se vygenerují znovu.
+    Zapisovat má jen jeden proces (hlavní proces generátoru).
+
+    :param root: Kořenová složka datasetu
+    :param max_records: Počet záznamů, po kterém se buffer splachuje
+    :param max_seconds: Maximální doba, po kterou záznam zůstane jen v paměti
+    :param on_flush: Zavolá se s (split, id dokumentů, délka souboru v bajtech) po zapsání dávky na disk
+    :param committed: Potvrzená délka metadata.jsonl pro jednotlivé splity...soubor se na ni při otevření zkrátí
+    :param fast_json: Použít orjson/ujson, pokud jsou nainstalované
+    """
+
+    def __init__(self, root: str = "app/data", max_records: int = 256, max_seconds: float = 5.0,
+                 on_flush: Callable[[str, List[str], int], None] | None = None, fast_json: bool = True,
+                 committed: Dict[str, int] | None = None):
+        self.root = root
+        self.max_records = max_records
+        self.max_seconds = max_seconds
+        self.on_flush = on_flush
+        self.fast_json = fast_json
+        self.committed = committed or dict()
+
+        self._files: Dict[str, IO[bytes]] = dict()
+        self._buffers: Dict[str, List[Tuple[str, str]]] = dict()
+        self._last_flush: Dict[str, float] = dict()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def write(self, folder: str, doc_id: str, record: Dict[str, Any]) -> None:
+        buffer = self._buffers.setdefault(folder, list())
+        buffer.append((doc_id, dumps(record, self.fast_json)))
+
+        last_flush = self._last_flush.setdefault(folder, time.monotonic())
+
+        if len(buffer) >= self.max_records or time.monotonic() - last_flush >= self.max_seconds:
+            self.flush(folder)
+
+    def flush(self, folder: str | None = None) -> None:
+        folders = [folder] if folder is not None else list(self._buffers.keys())
+
+        for f in folders:
+            buffer = self._buffers.get(f)
+            self._last_flush[f] = time.monotonic()
+
+            if not buffer:
+                continue
+
+            handle = self._handle(f)
+            handle.write("".join(line + "\n" for _, line in buffer).encode("utf-8"))
+            handle.flush()
+            os.fsync(handle.fileno())
+
+            self._buffers[f] = list()
+
+            if self.on_flush is not None:
+                self.on_flush(f, [doc_id for doc_id, _ in buffer], handle.tell())
+
+    def close(self) -> None:
+        self.flush()
+
+        for handle in self._files.values():
+            handle.close()
+        self._files.clear()
+
+    def _handle(self, folder: str) -> IO[bytes]:
+        handle = self._files.get(folder)
+        if handle is None:
+            path = os.path.join(self.root, folder, "metadata.jsonl")
+            handle = open(path, "ab")
+
+            #zahodí se vše za poslední potvrzenou dávkou
+            committed = self.committed.get(folder)
+            if committed is not None and handle.tell() > committed:
+                handle.truncate(committed)
+                handle.seek(0, os.SEEK_END)
+
+            self._files[folder] = handle
+        return handle
+
+    def __enter__(self) -> "metadata_writer":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
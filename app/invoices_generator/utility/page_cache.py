@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+from PIL import Image, ImageDraw
+
+
+class page_cache:
+    """
+    Cache podkladů stránek sdílená v rámci celého procesu.
+
+    Podklad je obrázek s pevnými částmi šablony (čáry, pruhy, rámečky, stálé popisky) pro jednu dvojici
+    (šablona, fonty, pozadí). Vykreslí se při prvním použití, každý další dokument začíná jeho kopií.
+    Jeden podklad A4 má ~11 MB, proto se drží nejvýše `max_pages` naposledy použitých.
+    Při generování přes více procesů má každý proces vlastní cache.
+    """
+
+    ############################
+    ####                    ####
+    ####     PROPERTIES     ####
+    ####                    ####
+    ############################
+
+    _pages: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+    _lock: Lock = Lock()
+
+    max_pages: int = 24
+
+    hits: int = 0
+    misses: int = 0
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @classmethod
+    def get(cls, key: Hashable, render: Callable[[], Image.Image]) -> Image.Image:
+        """
+        Podklad pro klíč (nevracet ven bez kopie...podklad sdílí všechny dokumenty).
+        """
+        with cls._lock:
+            page = cls._pages.get(key)
+            if page is not None:
+                cls._pages.move_to_end(key)
+                cls.hits += 1
+                return page
+
+        page = render()
+
+        with cls._lock:
+            cls._pages[key] = page
+            cls._pages.move_to_end(key)
+            while len(cls._pages) > cls.max_pages:
+                cls._pages.popitem(last=False)
+            cls.misses += 1
+
+        return page
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._pages.clear()
+
+
+class null_draw:
+    """
+    Kreslení, které nic nekreslí...měření textu (textlength, textbbox, ...) ale funguje jako u ImageDraw.
+
+    Šablona přes něj "projde" části stránky, které už jsou v podkladu (nebo se při vykreslování podkladu nekreslí),
+    a `invoice._text` přitom vytvoří stejné tokeny jako při skutečném kreslení.
+    """
+
+    _DRAWING = frozenset({"text", "multiline_text", "line", "rectangle", "rounded_rectangle", "ellipse", "circle",
+                          "polygon", "regular_polygon", "point", "arc", "chord", "pieslice", "bitmap", "shape"})
+
+    def __init__(self):
+        self._measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+        self._closed = False
+
+    def __getattr__(self, name: str) -> Any:
+        if name in self._DRAWING:
+            if self._closed:
+                raise RuntimeError(f"Pevné části stránky se kreslí jen před post_process (volání {name})")
+            return _nothing
+        return getattr(self._measure, name)
+
+    def close(self) -> None:
+        """
+        Další kreslení (ne měření) skončí chybou...pevné části se po post_process už nesmí kreslit.
+        """
+        self._closed = True
+
+
+def _nothing(*args: Any, **kwargs: Any) -> None:
+    return None
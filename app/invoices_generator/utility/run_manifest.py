@@ -0,0 +1,160 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Set
+
+
+@dataclass
+class run_manifest:
+    """
+    Manifest generovacího běhu jedné složky datasetu (train/test/validation).
+
+    Z hlavního seedu se pro každý dokument odvodí vlastní seed, takže výsledek nezávisí
+    na počtu procesů ani na pořadí, ve kterém se dokumenty dogenerují.
+    Hotové dokumenty se průběžně připisují do `<path>.completed` (jedno id na řádek),
+    díky tomu jde spadlý běh navázat (`resume=True`) nebo přegenerovat jen vybrané dokumenty.
+    Každou zapsanou dávku uzavírá řádek `@<pozice>` s pozicí výstupu (např. délka metadata.jsonl) po jejím zápisu.
+    Id platí za hotová až s tímto řádkem, výstup za poslední potvrzenou pozicí se při navázání zahodí.
+
+    :param path: Cesta k manifest.json
+    :param master_seed: Hlavní seed běhu
+    :param reference_time: Referenční čas běhu (nahrazuje `date.today()` a `datetime.now()` v šablonách)
+    :param engine: Formát anotací (`engines.value`)
+    :param output_format: Formát výstupu (`output_formats.value`)...určuje význam `committed`
+    :param documents: Odvozené seedy jednotlivých dokumentů (id -> seed)
+    :param completed: Id hotových dokumentů
+    :param committed: Pozice výstupu po poslední potvrzené dávce (PNG: délka metadata.jsonl v bajtech,
+                      ARROW: počet souborů annotations-*.arrow, TAR: počet shardů)
+    """
+
+    ############################
+    ####                    ####
+    ####     PROPERTIES     ####
+    ####                    ####
+    ############################
+
+    path: str
+    master_seed: int
+    reference_time: datetime
+    engine: str
+    output_format: str | None
+
+    documents: Dict[str, int] = field(default_factory=dict)
+    completed: Set[str] = field(default_factory=set)
+    committed: int = 0
+
+    @property
+    def completed_path(self) -> str:
+        return self.path + ".completed"
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @staticmethod
+    def document_id(index: int) -> str:
+        return f"{index:08d}"
+
+    @staticmethod
+    def derive_seed(master_seed: int, folder: str, index: int) -> int:
+        #hash místo random.Random(master_seed)...seed dokumentu nezávisí na ostatních dokumentech
+        digest = hashlib.sha256(f"{master_seed}:{folder}:{index}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+    def plan(self, folder: str, count: int) -> None:
+        """
+        Doplní odvozené seedy pro prvních `count` dokumentů složky.
+        Nehotové dokumenty za `count` se z plánu vyřadí (hotové už jsou ve výstupu, zůstávají).
+        """
+        self.documents = {doc_id: seed for doc_id, seed in self.documents.items()
+                          if int(doc_id) < count or doc_id in self.completed}
+
+        for index in range(count):
+            doc_id = self.document_id(index)
+            if doc_id not in self.documents:
+                self.documents[doc_id] = self.derive_seed(self.master_seed, folder, index)
+
+    def pending(self) -> list[tuple[int, int]]:
+        #dvojice (index dokumentu, seed) pro dokumenty, které ještě nejsou hotové
+        return [(int(doc_id), seed) for doc_id, seed in sorted(self.documents.items()) if doc_id not in self.completed]
+
+    def mark_completed(self, ids: Iterable[str], position: int | None = None) -> None:
+        """
+        Potvrdí dávku zapsaných dokumentů.
+
+        :param position: Pozice výstupu po zápisu dávky (None = výstup pozici nemá)
+        """
+        ids = [doc_id for doc_id in ids if doc_id not in self.completed]
+        if not ids and position is None:
+            return
+
+        with open(self.completed_path, "a", encoding="utf-8") as f:
+            f.write("".join(doc_id + "\n" for doc_id in ids) + f"@{'' if position is None else position}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.completed.update(ids)
+        if position is not None:
+            self.committed = position
+
+    def save(self) -> None:
+        output = {
+            "master_seed": self.master_seed,
+            "reference_time": self.reference_time.isoformat(),
+            "engine": self.engine,
+            "output_format": self.output_format,
+            "documents": self.documents,
+        }
+
+        #zápis přes dočasný soubor, aby po pádu nezůstal rozepsaný manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def reset_completed(self) -> None:
+        self.completed.clear()
+        self.committed = 0
+        open(self.completed_path, "w", encoding="utf-8").close()
+
+    @classmethod
+    def load(cls, path: str) -> "run_manifest | None":
+        if not os.path.exists(path):
+            return None
+
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        manifest = cls(path=path,
+                       master_seed=int(data["master_seed"]),
+                       reference_time=datetime.fromisoformat(data["reference_time"]),
+                       engine=data["engine"],
+                       output_format=data.get("output_format"),
+                       documents={k: int(v) for k, v in data["documents"].items()})
+
+        if os.path.exists(manifest.completed_path):
+            with open(manifest.completed_path, "r", encoding="utf-8") as f:
+                content = f.read()
+
+            #poslední řádek může být po pádu neúplný...zahodí se, stejně jako id bez uzavírajícího řádku @
+            lines = content.splitlines() if content.endswith("\n") else content.splitlines()[:-1]
+            batch: list[str] = []
+            for line in lines:
+                if line.startswith("@"):
+                    manifest.completed.update(doc_id for doc_id in batch if doc_id in manifest.documents)
+                    batch = []
+                    if line[1:]:
+                        manifest.committed = int(line[1:])
+                else:
+                    batch.append(line.strip())
+
+            if content and not content.endswith("\n"):
+                #další zápis nesmí navázat na neúplný řádek
+                with open(manifest.completed_path, "a", encoding="utf-8") as f:
+                    f.write("\n")
+
+        return manifest
@@ -0,0 +1,197 @@
+import glob
+import io
+import json
+import os
+import random
+import tarfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from app.invoices_generator.utility.metadata_writer import dumps
+
+
+SHARD_PATTERN: str = "shard-*.tar"
+
+
+def list_shards(folder: str) -> List[str]:
+    """
+    Vrátí seřazené cesty k hotovým shardům ve složce datasetu.
+    """
+    return sorted(glob.glob(os.path.join(folder, SHARD_PATTERN)))
+
+
+def split_shards(paths: List[str], worker_id: int = 0, num_workers: int = 1, seed: int | None = None) -> List[str]:
+    """
+    Rozdělí shardy mezi workery DataLoaderu (každý worker čte celé shardy, žádný vzorek dvakrát).
+
+    :param seed: Pokud není None, pořadí shardů se zamíchá...seed musí být ve všech workerech stejný
+    """
+    paths = list(paths)
+    if seed is not None:
+        random.Random(seed).shuffle(paths)
+    return paths[worker_id::num_workers]
+
+
+def buffer_shuffle(samples: Iterable[Any], size: int, seed: int) -> Iterator[Any]:
+    """
+    Míchání streamu vzorků v bufferu omezené velikosti (jako `webdataset.shuffle`).
+    """
+    rng = random.Random(seed)
+    buffer: List[Any] = list()
+
+    for sample in samples:
+        if len(buffer) < size:
+            buffer.append(sample)
+            continue
+        index = rng.randrange(len(buffer))
+        buffer[index], sample = sample, buffer[index]
+        yield sample
+
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def iter_shard_samples(paths: List[str], with_images: bool = True) -> Iterator[Tuple[str, bytes | None, Dict[str, Any]]]:
+    """
+    Sekvenčně čte shardy a vrací trojice (klíč, bajty obrázku, záznam).
+    Záznam má stejný tvar jako řádek v metadata.jsonl.
+
+    :param with_images: Pokud je False, data obrázků se přeskočí (seek) a vrací se None
+    """
+    for path in paths:
+        #"r|" je čistě sekvenční čtení...pro přeskakování obrázků je potřeba seekovatelný režim
+        with tarfile.open(path, mode="r|" if with_images else "r:") as tar:
+            key: str | None = None
+            image: bytes | None = None
+
+            for member in tar:
+                if not member.isfile():
+                    continue
+
+                member_key, ext = member.name.rsplit(".", 1)
+
+                if member_key != key:
+                    key, image = member_key, None
+
+                if ext == "png":
+                    if with_images:
+                        image = tar.extractfile(member).read()
+                elif ext == "json":
+                    record = json.loads(tar.extractfile(member).read().decode("utf-8"))
+                    yield key, image, record
+
+
+def count_shard_samples(paths: List[str]) -> int:
+    """
+    Spočítá vzorky ve shardech jen z hlaviček archivů (bez čtení dat).
+    """
+    count = 0
+    for path in paths:
+        with tarfile.open(path, mode="r:") as tar:
+            count += sum(1 for member in tar if member.isfile() and member.name.endswith(".json"))
+    return count
+
+
+class shard_writer:
+    """
+    Zápis vygenerovaných faktur do tar shardů ve formátu WebDataset.
+
+    Každý vzorek má v archivu dva soubory se stejným klíčem (id dokumentu):
+    `<klíč>.png` s obrázkem a `<klíč>.json` se záznamem ve tvaru řádku metadata.jsonl.
+    Shard se zapisuje jako `shard-XXXXXX.tar.tmp` a teprve po uzavření se přejmenuje,
+    takže čtenáři nikdy neuvidí nedopsaný shard. `on_flush` se volá s id dokumentů uzavřeného shardu
+    a počtem shardů včetně něj. Shardy za potvrzeným počtem z `committed` (uzavřené těsně před pádem,
+    ale nepotvrzené v manifestu) a nedopsané `.tmp` se před prvním zápisem smažou.
+
+    :param root: Kořenová složka datasetu
+    :param shard_size: Maximální počet vzorků v jednom shardu
+    :param shard_bytes: Maximální velikost shardu v bajtech
+    :param on_flush: Zavolá se s (split, id dokumentů, počet shardů) po uzavření shardu
+    :param committed: Potvrzený počet shardů pro jednotlivé splity
+    """
+
+    def __init__(self, root: str = "app/data", shard_size: int = 1000, shard_bytes: int = 1 << 30,
+                 on_flush: Callable[[str, List[str], int], None] | None = None, committed: Dict[str, int] | None = None):
+        self.root = root
+        self.shard_size = shard_size
+        self.shard_bytes = shard_bytes
+        self.on_flush = on_flush
+        self.committed = committed or dict()
+
+        self._tars: Dict[str, tarfile.TarFile] = dict()
+        self._paths: Dict[str, str] = dict()
+        self._ids: Dict[str, List[str]] = dict()
+        self._sizes: Dict[str, int] = dict()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def write(self, folder: str, doc_id: str, record: Dict[str, Any], image: bytes) -> None:
+        tar = self._tar(folder)
+
+        #mtime zůstává 0...stejný seed pak dává i stejné shardy (invoice_generator zapisuje dokumenty v pořadí nezávislém na počtu procesů)
+        for name, data in ((f"{doc_id}.png", image), (f"{doc_id}.json", dumps(record).encode("utf-8"))):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        self._ids[folder].append(doc_id)
+        self._sizes[folder] += len(image)
+
+        if len(self._ids[folder]) >= self.shard_size or self._sizes[folder] >= self.shard_bytes:
+            self.flush(folder)
+
+    def flush(self, folder: str | None = None) -> None:
+        """
+        Uzavře rozepsané shardy (všech splitů nebo jen zadaného).
+        """
+        folders = [folder] if folder is not None else list(self._tars.keys())
+
+        for f in folders:
+            tar = self._tars.pop(f, None)
+            if tar is None:
+                continue
+
+            tar.close()
+
+            tmp_path = self._paths.pop(f)
+            path = tmp_path[:-len(".tmp")]
+            os.replace(tmp_path, path)
+
+            ids = self._ids.pop(f)
+            if self.on_flush is not None:
+                self.on_flush(f, ids, int(os.path.basename(path)[len("shard-"):-len(".tar")]) + 1)
+
+    def close(self) -> None:
+        self.flush()
+
+    def _tar(self, folder: str) -> tarfile.TarFile:
+        tar = self._tars.get(folder)
+        if tar is None:
+            folder_path = os.path.join(self.root, folder)
+
+            committed = self.committed.pop(folder, None)
+            if committed is not None:
+                for path in list_shards(folder_path)[committed:] + glob.glob(os.path.join(folder_path, SHARD_PATTERN + ".tmp")):
+                    os.remove(path)
+
+            #číslování navazuje na hotové shardy (např. při resume)
+            existing = list_shards(folder_path)
+            index = int(os.path.basename(existing[-1])[len("shard-"):-len(".tar")]) + 1 if existing else 0
+
+            tmp_path = os.path.join(folder_path, f"shard-{index:06d}.tar.tmp")
+            tar = tarfile.open(tmp_path, mode="w")
+
+            self._tars[folder] = tar
+            self._paths[folder] = tmp_path
+            self._ids[folder] = list()
+            self._sizes[folder] = 0
+        return tar
+
+    def __enter__(self) -> "shard_writer":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
@@ -0,0 +1,102 @@
+import random
+from typing import List, Tuple
+
+
+class skyline_packer:
+    """
+    Rozmísťování obdélníků (bloků) na stránku metodou skyline.
+
+    Obsazená část stránky je popsána "obrysem" shora...seznamem úseků (x, y, šířka), kde y je první volný řádek
+    pod již umístěnými bloky. Blok se vždy položí na obrys, takže se s ničím nepřekrývá a kontroluje se jen
+    proti úsekům obrysu (ne proti všem umístěným blokům). Jedno umístění je O(úseků²), bez opakovaných pokusů.
+
+    :param left: Levý okraj oblasti
+    :param top: Horní okraj oblasti
+    :param right: Pravý okraj oblasti
+    :param bottom: Spodní okraj oblasti
+    """
+
+    def __init__(self, left: int, top: int, right: int, bottom: int):
+        self.left, self.top, self.right, self.bottom = left, top, right, bottom
+        self._skyline: List[List[int]] = [[left, top, right - left]]
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    def candidates(self, w: int, h: int) -> List[Tuple[int, int]]:
+        """
+        Všechny pozice (x, y) na obrysu, kam se blok w x h vejde...pro každý úsek zarovnání vlevo, vpravo
+        a náhodný posun uvnitř úseku, pokud je širší než blok.
+        """
+        xs = set()
+        for x, _, sw in self._skyline:
+            xs.add(x)
+            xs.add(x + sw - w)
+            if sw > w:
+                xs.add(random.randint(x, x + sw - w))
+
+        output: List[Tuple[int, int]] = []
+        for x in sorted(xs):
+            y = self._height(x, w)
+            if y is not None and y + h <= self.bottom:
+                output.append((x, y))
+        return output
+
+    def place(self, w: int, h: int, slack: int = 0) -> Tuple[int, int] | None:
+        """
+        Umístí blok w x h a vrátí jeho levý horní roh, nebo None, pokud se na stránku už nevejde.
+
+        :param slack: Náhodně se vybírá ze všech pozic, které jsou nejvýše o `slack` níž než nejvyšší možná
+                      (0 = vždy co nejvýš, větší = řidší a pestřejší rozložení)
+        """
+        candidates = self.candidates(w, h)
+        if not candidates:
+            return None
+
+        best = min(y for _, y in candidates)
+        x, y = random.choice([c for c in candidates if c[1] <= best + slack])
+        self.add(x, y, w, h)
+        return x, y
+
+    def stack(self, w: int, h: int) -> Tuple[int, int]:
+        """
+        Umístí blok w x h k levému okraji pod všechny dosavadní bloky, i když přečnívá spodní okraj.
+        """
+        x, y = self.left, max(sy for _, sy, _ in self._skyline)
+        self.add(x, y, w, h)
+        return x, y
+
+    def add(self, x: int, y: int, w: int, h: int) -> None:
+        """
+        Zapíše blok do obrysu (bez kontroly...i blok přečnívající spodní okraj).
+        """
+        skyline: List[List[int]] = []
+        for sx, sy, sw in self._skyline:
+            #části úseku vlevo a vpravo od bloku zůstávají
+            if sx < x:
+                skyline.append([sx, sy, min(sw, x - sx)])
+            if sx + sw > x + w:
+                start = max(sx, x + w)
+                skyline.append([start, sy, sx + sw - start])
+        skyline.append([x, y + h, w])
+        skyline.sort()
+
+        #sloučení sousedních úseků se stejnou výškou
+        self._skyline = [skyline[0]]
+        for segment in skyline[1:]:
+            last = self._skyline[-1]
+            if last[1] == segment[1] and last[0] + last[2] == segment[0]:
+                last[2] += segment[2]
+            else:
+                self._skyline.append(segment)
+
+    def _height(self, x: int, w: int) -> int | None:
+        """
+        Nejnižší y, na které se dá položit blok široký w od x...maximum obrysu pod ním.
+        """
+        if x < self.left or x + w > self.right:
+            return None
+        return max(sy for sx, sy, sw in self._skyline if sx < x + w and sx + sw > x)
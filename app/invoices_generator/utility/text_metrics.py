@@ -0,0 +1,112 @@
+from functools import lru_cache
+from threading import Lock
+from typing import Dict, Tuple
+
+from PIL.ImageFont import FreeTypeFont
+
+
+#(posun pera, levý okraj inkoustu, pravý okraj inkoustu, má inkoust)
+_glyph = Tuple[float, float, float, bool]
+
+#referenční řetězec pro výšku řádku...největší možná výška pro daný font
+LINE_REFERENCE: str = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class text_metrics:
+    """
+    Memoizované metriky textu pro vykreslování faktur.
+
+    - výška řádku (bbox referenčního řetězce) se počítá jednou pro každý font
+    - šířka se počítá součtem předpočítaných metrik jednotlivých glyfů, bez volání FreeType
+    - výsledky pro dvojice (font, text) drží omezená LRU cache
+
+    Fonty jsou sdílené přes `font_registry`, takže jako klíč stačí identita objektu fontu.
+    Šířka odpovídá `right - left` z `font.getbbox(text)` (základní layout bez kerningu).
+    """
+
+    ############################
+    ####                    ####
+    ####     PROPERTIES     ####
+    ####                    ####
+    ############################
+
+    _line_boxes: Dict[FreeTypeFont, Tuple[float, float, float, float]] = dict()
+    _glyphs: Dict[FreeTypeFont, Dict[str, _glyph]] = dict()
+    _lock: Lock = Lock()
+
+    ############################
+    ####                    ####
+    ####       METHODS      ####
+    ####                    ####
+    ############################
+
+    @classmethod
+    def line_box(cls, font: FreeTypeFont) -> Tuple[float, float, float, float]:
+        box = cls._line_boxes.get(font)
+        if box is None:
+            box = font.getbbox(LINE_REFERENCE)
+            cls._line_boxes[font] = box
+        return box
+
+    @classmethod
+    def line_height(cls, font: FreeTypeFont) -> float:
+        left, top, right, bottom = cls.line_box(font)
+        return bottom - top
+
+    @classmethod
+    def width(cls, font: FreeTypeFont, text: str) -> float:
+        if not text:
+            return 0.0
+        return _cached_width(font, text)
+
+    @classmethod
+    def _glyph(cls, font: FreeTypeFont, char: str) -> _glyph:
+        glyphs = cls._glyphs.get(font)
+        if glyphs is None:
+            with cls._lock:
+                glyphs = cls._glyphs.setdefault(font, dict())
+
+        glyph = glyphs.get(char)
+        if glyph is None:
+            left, top, right, bottom = font.getbbox(char)
+            glyph = (font.getlength(char), left, right, right > left)
+            glyphs[char] = glyph
+        return glyph
+
+    @classmethod
+    def _measure(cls, font: FreeTypeFont, text: str) -> float:
+        pen: float = 0.0
+        ink_left: float | None = None
+        ink_right: float | None = None
+
+        for char in text:
+            advance, left, right, has_ink = cls._glyph(font, char)
+            if has_ink:
+                if ink_left is None:
+                    ink_left, ink_right = pen + left, pen + right
+                else:
+                    ink_left = min(ink_left, pen + left)
+                    ink_right = max(ink_right, pen + right)
+            pen += advance
+
+        if ink_left is None:
+            return 0.0
+        return ink_right - ink_left
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        info = _cached_width.cache_info()
+        return {"hits": info.hits, "misses": info.misses, "cached": info.currsize,
+                "fonts": len(cls._glyphs), "glyphs": sum(len(g) for g in cls._glyphs.values())}
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls._lock:
+            cls._line_boxes.clear()
+            cls._glyphs.clear()
+            _cached_width.cache_clear()
+
+
+@lru_cache(maxsize=65536)
+def _cached_width(font: FreeTypeFont, text: str) -> float:
+    return text_metrics._measure(font, text)